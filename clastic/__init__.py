@@ -19,17 +19,38 @@ except ImportError:
     missing_dep_msg = 'clastic depends on werkzeug. check that you have the right virtualenv activated or run `pip install werkzeug`.'
     raise ImportError(missing_dep_msg)
 
-from . import server
-
 from .application import Application, SubApplication, RerouteWSGI
 from .route import Route, GET, POST, PUT, DELETE, RESERVED_ARGS, S_REDIRECT, S_REWRITE, S_STRICT
 
 from .middleware import Middleware, GetParamMiddleware
 from .render import render_json, render_json_dev, render_basic
-from .meta import MetaApplication, META_ASSETS_APP
-from .static import StaticApplication, StaticFileRoute
 from .errors import HTTPException, BadRequest, InternalServerError
 from .utils import Redirector
 
 from werkzeug.wrappers import BaseRequest, Request, BaseResponse, Response
 from werkzeug.utils import redirect, append_slash_redirect
+
+
+# heavier, optional pieces are imported on first access, keeping
+# "import clastic" light for scripts and workers that don't use them
+_LAZY_ATTRS = {'server': ('.server', None),
+               'MetaApplication': ('.meta', 'MetaApplication'),
+               'META_ASSETS_APP': ('.meta', 'META_ASSETS_APP'),
+               'StaticApplication': ('.static', 'StaticApplication'),
+               'StaticFileRoute': ('.static', 'StaticFileRoute')}
+
+
+def __getattr__(name):
+    try:
+        module_name, attr_name = _LAZY_ATTRS[name]
+    except KeyError:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    import importlib
+    module = importlib.import_module(module_name, __name__)
+    ret = module if attr_name is None else getattr(module, attr_name)
+    globals()[name] = ret  # only look it up once
+    return ret
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Helpers for middlewares which do their work in a background thread,
+off of the request path, such as access logging, span export, stack
+sampling, and watchdogs.
+"""
+
+import time
+import queue
+import threading
+
+
+class LazyThread(object):
+    """A daemon thread running *target*, started by the first call to
+    :meth:`ensure_started`. Threads don't survive a fork, so later
+    calls restart it if it isn't running, e.g., in a forked worker.
+    """
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def ensure_started(self):
+        if self.is_alive():
+            return
+        with self._lock:
+            if not self.is_alive():
+                self._thread = threading.Thread(target=self.target, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+
+
+class BatchQueue(object):
+    """Passes items to *handler* from a background thread, in lists of
+    up to *batch_size*, at least every *flush_interval* seconds while
+    items are waiting. :meth:`put` never blocks: items which do not fit
+    in the *max_queue*-long queue are dropped, and counted in
+    :attr:`dropped_count`.
+    """
+    def __init__(self, handler, name, batch_size=100, flush_interval=1.0,
+                 max_queue=10000):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._dropped_count = 0
+        self._dropped_lock = threading.Lock()
+        self._thread = LazyThread(self._run, name)
+
+    @property
+    def dropped_count(self):
+        "The number of items dropped because the queue was full."
+        return self._dropped_count
+
+    def put(self, item):
+        "Queues *item*, returning ``False`` if it was dropped."
+        self._thread.ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped_count += 1
+            return False
+        return True
+
+    def _run(self):
+        q = self._queue
+        while True:
+            batch = [q.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.handler(batch)
+            except Exception:
+                pass  # handlers are responsible for their own errors
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+    def flush(self):
+        "Blocks until every queued item has been handled."
+        self._queue.join()
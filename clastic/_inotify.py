@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""A minimal, dependency-free binding to Linux's inotify, through
+ctypes, used by the reloader in :mod:`clastic.server`.
+"""
+
+import os
+import sys
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# what the reloader watches directories for
+DIR_CHANGE_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+                   | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                   | IN_DELETE_SELF | IN_MOVE_SELF)
+
+# struct inotify_event {int wd; uint32_t mask, cookie, len; char name[];}
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_LIBC = _load_libc()
+
+
+def is_available():
+    "Whether inotify can be used on this platform."
+    return _LIBC is not None
+
+
+def _raise_errno(path=None):
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err), path)
+
+
+class Inotify(object):
+    """An inotify instance, watching directories (or files), and
+    reading their events as ``(path, mask)`` pairs, where *path* is
+    the full path of the file the event is about.
+
+    Raises :exc:`OSError` if inotify is not available, or on failure
+    to add a watch, e.g., because the user's watch limit is reached.
+    """
+    def __init__(self):
+        if _LIBC is None:
+            raise OSError(errno.ENOSYS, 'inotify not available on %s' % sys.platform)
+        fd = _LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            _raise_errno()
+        self.fd = fd
+        self._wd_paths = {}
+        self._path_wds = {}
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=DIR_CHANGE_MASK):
+        if path in self._path_wds:
+            return self._path_wds[path]
+        wd = _LIBC.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            _raise_errno(path)
+        self._wd_paths[wd] = path
+        self._path_wds[path] = wd
+        return wd
+
+    def is_watched(self, path):
+        return path in self._path_wds
+
+    def read_events(self, timeout=None):
+        """Returns a list of ``(path, mask)`` pairs, waiting up to
+        *timeout* seconds (forever, if ``None``) for at least one."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+        ret = []
+        offset, header_size = 0, _EVENT_HEADER.size
+        while offset + header_size <= len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += header_size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                ret.append((None, mask))  # events were lost
+                continue
+            path = self._wd_paths.get(wd)
+            if mask & IN_IGNORED:
+                # the watch was removed, e.g., its directory deleted
+                self._path_wds.pop(self._wd_paths.pop(wd, None), None)
+            if path is None:
+                continue
+            if name:
+                path = os.path.join(path, os.fsdecode(name))
+            ret.append((path, mask))
+        return ret
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self._wd_paths.clear()
+        self._path_wds.clear()
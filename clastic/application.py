@@ -2,6 +2,7 @@
 
 import os
 import itertools
+from time import perf_counter
 from collections.abc import Sequence
 from argparse import ArgumentParser
 
@@ -10,7 +11,6 @@ from werkzeug import test as werkzeug_test
 from werkzeug.utils import redirect
 from werkzeug.wrappers import Request, Response, BaseResponse
 
-from .server import run_simple
 from .route import (Route,
                     NullRoute,
                     S_STRICT,
@@ -148,6 +148,14 @@ class Application(object):
       slash_mode (str): *Advanced*: Controls how the Application handles trailing slashes.
         One of :data:`clastic.S_REDIRECT`, :data:`~clastic.S_STRICT`, :data:`~clastic.S_REWRITE`.
         Defaults to :data:`~clastic.S_REDIRECT`.
+      lazy_compile (bool): *Advanced*: Set to ``True`` to defer
+        generating each Route's middleware chain code until the Route
+        is first dispatched to, which speeds up construction of
+        Applications with many rarely-used Routes. Dependencies are
+        still checked at construction. See :meth:`~Application.compile_all()`.
+        Defaults to ``False``. Routes of embedded Applications are
+        always compiled this way, unless they are unchanged by
+        embedding, in which case they share the embedded Route's code.
 
     In addition to arguments, certain advanced behaviors can be
     customized by inheriting from :class:`Application` and overriding
@@ -166,6 +174,7 @@ class Application(object):
                  render_factory=None, error_handler=None, **kwargs):
         self.debug = kwargs.pop('debug', None)
         self.slash_mode = kwargs.pop('slash_mode', S_REDIRECT)
+        self.lazy_compile = kwargs.pop('lazy_compile', False)
         if kwargs:
             raise TypeError('unexpected keyword args: %r' % kwargs.keys())
         self.resources = dict(resources or {})
@@ -182,6 +191,11 @@ class Application(object):
 
         routes = routes or []
         self.routes = []
+        # compiled middleware chains shared by this app's routes, see BoundRoute
+        self._chain_cache = {}
+        # whether any route's middlewares time the request phases, see
+        # DispatchState.timings
+        self._timed = False
         self._null_route = NullRoute().bind(self)
         for entry in routes:
             self.add(entry)
@@ -244,6 +258,19 @@ class Application(object):
         for br in bound_routes:
             self.routes.insert(index, br)
             index += 1
+            if any([getattr(mw, 'phase_timing', False) for mw in br.middlewares]):
+                self._timed = True
+        return
+
+    def compile_all(self):
+        """Generates the code for any Routes not yet compiled, which, with
+        *lazy_compile*, is every Route not yet dispatched to. Call
+        before forking worker processes, so that the workers share the
+        compiled Routes, instead of each compiling them on first
+        request.
+        """
+        for route in self.routes + [self._null_route]:
+            route.compile()
         return
 
     def _dispatch_wsgi(self, environ, start_response):
@@ -268,6 +295,10 @@ class Application(object):
         ret = None
         url_path, method = request.path, request.method
         dispatch_state = DispatchState()
+        timed = self._timed
+        if timed:
+            dispatch_state.timings = []
+            routing_start = perf_counter()
         err_handler = self.error_handler
         base_params = dict(self.resources,
                            request=request,
@@ -297,6 +328,10 @@ class Application(object):
                                                             source_route=route)
                         dispatch_state.add_exception(nf_exc)
                         continue
+            if timed:
+                routing_end = perf_counter()
+                dispatch_state.add_timing('routing', routing_end - routing_start,
+                                          routing_start, routing_end)
             try:
                 ret = route.execute(**params)
                 if not isinstance(ret, BaseResponse):
@@ -309,6 +344,8 @@ class Application(object):
                 if not isinstance(ret, HTTPException):
                     uncaught_params = dict(params, _route=route, _error=ret)
                     ret = err_handler.uncaught_to_response(**uncaught_params)
+            if timed:
+                routing_start = perf_counter()
             if not isinstance(ret, HTTPException):
                 # TODO: verify behavior
                 break
@@ -375,6 +412,12 @@ class Application(object):
              recommended for use with *use_debugger*). (Use
              sparingly; not for production.)
 
+        Other keyword arguments are passed through to
+        :func:`clastic.server.run_simple`, e.g., ``warm_reload=True``
+        to have the reloader fork a process which keeps installed
+        packages imported, instead of starting a new interpreter. Also
+        enabled with ``--warm-reload``.
+
         .. warning::
 
            The server provided by this method is not intended for production traffic use.
@@ -386,6 +429,8 @@ class Application(object):
         port = args.port if args.port is not None else port
         kw['use_reloader'] = args.use_reloader and use_reloader
         kw['use_debugger'] = args.use_debugger and use_debugger
+        if args.warm_reload:
+            kw['warm_reload'] = True
         if kw['use_debugger']:
             # TODO: if an error_handler doesn't respect
             # reraise_uncaught then the debugger won't work
@@ -410,6 +455,10 @@ class Application(object):
         if kw.get('_jk_just_testing'):
             return True
 
+        if kw['processes'] and kw['processes'] > 1:
+            self.compile_all()
+
+        from .server import run_simple
         run_simple(address, port, self, **kw)
 
 
@@ -431,6 +480,7 @@ class DispatchState(object):
         self.exceptions = []
         self.allowed_methods = set()
         self.attempted_routes = []
+        self.timings = None
 
     def add_route(self, route):
         self.attempted_routes.append(route)
@@ -442,6 +492,16 @@ class DispatchState(object):
         if methods:
             self.allowed_methods.update(methods)
 
+    def add_timing(self, name, duration, start=None, end=None):
+        """Record that the phase *name* (e.g., ``'routing'`` or
+        ``'endpoint'``) took *duration* seconds, optionally between the
+        :func:`time.perf_counter` values *start* and *end*. Does
+        nothing if :attr:`timings` is ``None``, which it is unless some
+        middleware has *phase_timing* enabled. Middlewares may also set
+        it to ``None`` to disable timing for a request."""
+        if self.timings is not None:
+            self.timings.append((name, duration, start, end))
+
     def __repr__(self):
         args = (self.__class__.__name__, self.exceptions, self.allowed_methods)
         return '<%s exceptions=%r allowed_methods=%r>' % args
@@ -519,6 +579,9 @@ def create_dev_server_parser():
                         action='store_false')
     parser.add_argument('--no-reloader', dest='use_reloader',
                         action='store_false')
+    parser.add_argument('--warm-reload', action='store_true',
+                        help="reload by forking a process which keeps"
+                        " installed packages imported")
     parser.add_argument('--no-debugger', dest='use_debugger',
                         action='store_false')
     parser.add_argument('--no-wsgi-lint', dest='use_lint',
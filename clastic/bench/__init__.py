@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""Tools for measuring Clastic's performance, all run with
+``python -m clastic.bench <tool>``:
+
+* ``suite``, :mod:`clastic.bench.suite`: a suite of microbenchmarks
+  of Clastic's internals, emitting JSON results for tracking
+  regressions.
+* ``cold_start``, :mod:`clastic.bench.cold_start`: Application
+  construction in fresh processes, with and without the on-disk code
+  cache.
+* ``load``, :mod:`clastic.bench.load`: a load generator, reporting
+  the throughput and latency of an application, per route,
+  in-process or over HTTP. The default tool, so
+  ``python -m clastic.bench module:app`` works, too.
+"""
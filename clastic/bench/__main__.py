@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import sys
+from importlib import import_module
+
+
+# tools runnable by name, e.g., python -m clastic.bench suite -o out.json.
+# anything else is an application to load, see clastic.bench.load.
+TOOLS = ('suite', 'cold_start', 'load')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in TOOLS:
+        tool_name, argv = argv[0], argv[1:]
+    else:
+        tool_name = 'load'
+    return import_module('clastic.bench.' + tool_name).main(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
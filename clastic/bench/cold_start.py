@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks cold startup, i.e., constructing an Application with
+many routes in a fresh process, with and without sinter's on-disk
+code cache (see :func:`clastic.sinter.set_code_cache_dir`).
+
+Usage:
+
+    python -m clastic.bench cold_start [--routes 1000] [--runs 5]
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+# so the child process imports this clastic, installed or not
+_CLASTIC_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# run in a child process, so that every run starts cold
+_CHILD_TMPL = '''
+import time
+from clastic import Application, render_basic
+from clastic.middleware import GetParamMiddleware
+
+routes = []
+for i in range(%(route_count)d):
+    # distinct argument names, so that each chain generates distinct code
+    ns = {}
+    exec('def endpoint(arg%%d, q=None):\\n    return arg%%d' %% (i, i), ns)
+    routes.append(('/route%%d/<arg%%d>' %% (i, i), ns['endpoint'], render_basic))
+
+start = time.perf_counter()
+Application(routes, middlewares=[GetParamMiddleware(['q'])])
+print(time.perf_counter() - start)
+'''
+
+
+def run_child(route_count, cache_dir=None):
+    env = dict(os.environ)
+    env.pop('CLASTIC_CODE_CACHE_DIR', None)
+    if cache_dir:
+        env['CLASTIC_CODE_CACHE_DIR'] = cache_dir
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [_CLASTIC_PATH,
+                                                      env.get('PYTHONPATH')]))
+    code = _CHILD_TMPL % {'route_count': route_count}
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return float(output)
+
+
+def run_cold_start(route_count=1000, runs=5):
+    """Returns a dict of the fastest construction times, in seconds, of
+    *runs* fresh processes, without the code cache, and with a warm
+    one, as well as the time taken to populate the cache."""
+    cache_dir = tempfile.mkdtemp(prefix='clastic-code-cache-')
+    try:
+        no_cache = [run_child(route_count) for _ in range(runs)]
+        populate = run_child(route_count, cache_dir)
+        warm_cache = [run_child(route_count, cache_dir) for _ in range(runs)]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    results = {'route_count': route_count,
+               'runs': runs,
+               'no_cache_min': min(no_cache),
+               'cache_populate': populate,
+               'warm_cache_min': min(warm_cache)}
+    results['speedup'] = round(results['no_cache_min'] / results['warm_cache_min'], 2)
+    return results
+
+
+def main(argv=None):
+    prs = ArgumentParser(prog='python -m clastic.bench cold_start',
+                         description=__doc__.splitlines()[0])
+    prs.add_argument('--routes', type=int, default=1000)
+    prs.add_argument('--runs', type=int, default=5)
+    args = prs.parse_args(argv)
+
+    results = run_cold_start(args.routes, args.runs)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
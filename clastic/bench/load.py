@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""A load generator for measuring the throughput and latency of a
+Clastic Application (or any WSGI application), either in-process,
+calling the WSGI interface directly, or over HTTP, through the bundled
+server on a loopback port::
+
+    python -m clastic.bench myproject.app:app -c 10 -n 5000
+    python -m clastic.bench myproject.app:create_app() --server -d 10 -p /a -p /b
+
+Every request is recorded as a :class:`~clastic.middleware.stats.Hit`,
+and aggregated per route and status, the same way
+:class:`~clastic.middleware.stats.StatsMiddleware` does, so the report
+has the same latency quantiles, in milliseconds.
+
+In-process load runs client and application in the same interpreter,
+so concurrency is limited by the GIL, and numbers are best compared
+with other in-process runs. Server mode includes the cost of HTTP
+parsing and the loopback socket, but the client shares the process,
+too.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import itertools
+import http.client
+from time import perf_counter
+from argparse import ArgumentParser
+from importlib import import_module
+
+from werkzeug.test import create_environ
+
+from .._werkzeug_serving import WSGIRequestHandler, make_server
+from ..middleware.stats import (Hit, RouteStats, new_route_hits,
+                                get_route_stats_dict, is_error_status)
+from .suite import get_environment_info
+
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_REQUESTS = 1000
+_QUANTILES = (0.5, 0.75, 0.9, 0.95, 0.99)
+
+
+def load_app(target):
+    """Imports the WSGI application named by *target*, a string like
+    ``'package.module:attr'``. *attr* defaults to ``app``, and if it
+    ends with ``()``, it is called without arguments, for application
+    factories. Like ``python -m``, the current directory is importable.
+    """
+    module_name, _, attr = target.partition(':')
+    attr = attr or 'app'
+    call = attr.endswith('()')
+    if call:
+        attr = attr[:-2]
+    if '' not in sys.path and os.getcwd() not in sys.path:
+        sys.path.insert(0, '')
+    module = import_module(module_name)
+    try:
+        app = getattr(module, attr)
+    except AttributeError:
+        raise ValueError('module %r has no attribute %r' % (module_name, attr))
+    if call:
+        app = app()
+    if not callable(app):
+        raise ValueError('expected a WSGI application at %r, not %r' % (target, app))
+    return app
+
+
+def get_route_pattern(app, path, method='GET'):
+    """Returns the pattern of the first route in *app* matching *path*
+    and *method*, as used by StatsMiddleware, or *path* itself if
+    there is no match, or *app* is not an :class:`Application`."""
+    for route in getattr(app, 'routes', ()):
+        if route.match_path(path) is not None and route.match_method(method):
+            return route.pattern
+    return path
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    # the default logs a line to stderr per request
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+def _make_wsgi_requester(app, method, headers, body):
+    def start_response(status, resp_headers, exc_info=None):
+        resp_info[:] = [status, resp_headers]
+        return lambda data: None
+
+    resp_info = []
+
+    def get_environ(path):
+        return create_environ(path, method=method, headers=headers, data=body)
+
+    def do_request(environ):
+        app_iter = app(environ, start_response)
+        length = 0
+        try:
+            for chunk in app_iter:
+                length += len(chunk)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        status, resp_headers = resp_info
+        mime_type = ''
+        for name, value in resp_headers:
+            if name.lower() == 'content-type':
+                mime_type = value.partition(';')[0]
+        return status.partition(' ')[0], mime_type, length
+
+    return get_environ, do_request
+
+
+def _make_http_requester(host, port, method, headers, body):
+    # one connection per worker thread; http.client reopens it if the
+    # server closes it after a response
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+
+    def get_request(path):
+        return path
+
+    def do_request(path):
+        try:
+            conn.request(method, path, body=body, headers=dict(headers))
+            resp = conn.getresponse()
+            content = resp.read()
+            if resp.will_close:
+                conn.close()
+        except Exception:
+            conn.close()
+            raise
+        mime_type = (resp.getheader('Content-Type') or '').partition(';')[0]
+        return str(resp.status), mime_type, len(content)
+
+    return get_request, do_request, conn.close
+
+
+def _run_worker(make_requester, paths, patterns, counter, max_requests,
+                deadline, start, rate, results):
+    route_hits = new_route_hits()
+    make_request, do_request = make_requester()[:2]
+    path_count = len(paths)
+    while True:
+        i = next(counter)
+        if max_requests is not None and i >= max_requests:
+            break
+        if rate:
+            # open-loop pacing, requests are scheduled 1/rate apart
+            delay = start + i / rate - perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if deadline is not None and perf_counter() >= deadline:
+            break
+        path = paths[i % path_count]
+        request = make_request(path)
+        start_time = time.time()
+        req_start = perf_counter()
+        mime_type, length = '', None
+        try:
+            status, mime_type, length = do_request(request)
+        except Exception as e:
+            status = e.__class__.__name__
+        duration = perf_counter() - req_start
+        hit = Hit(start_time, path, patterns[i % path_count], status,
+                  duration, mime_type, length)
+        route_hits[hit.pattern][hit.status_code].add(hit)
+    results.append(route_hits)
+
+
+def run_load(app, paths=('/',), method='GET', headers=None, body=None,
+             concurrency=DEFAULT_CONCURRENCY, requests=None, duration=None,
+             rate=None, server=False, warmup=True):
+    """Sends requests to *app* from *concurrency* threads, cycling
+    through *paths*, until *requests* have been sent, or *duration*
+    seconds have passed. With neither, sends ``DEFAULT_REQUESTS``.
+
+    *rate* caps the total requests per second. If *server* is true,
+    *app* is served by the bundled server on a loopback port, and
+    requests are sent over HTTP, instead of calling *app* directly.
+    *warmup* sends one uncounted request per path first, so lazily
+    compiled routes don't skew the results.
+
+    Returns a JSON-serializable report, see :func:`get_load_report`.
+    """
+    if concurrency < 1:
+        raise ValueError('expected concurrency of at least 1, not %r' % concurrency)
+    if not paths:
+        raise ValueError('expected at least one path to request')
+    if requests is None and duration is None:
+        requests = DEFAULT_REQUESTS
+    paths = list(paths)
+    if isinstance(headers, dict):
+        headers = list(headers.items())
+    headers = list(headers or ())
+    patterns = [get_route_pattern(app, path, method) for path in paths]
+
+    srv, closers = None, []
+    if server:
+        srv = make_server('127.0.0.1', 0, app, threaded=True,
+                          request_handler=_QuietRequestHandler)
+        srv.daemon_threads = True
+        srv_thread = threading.Thread(target=srv.serve_forever,
+                                      name='clastic-bench-server')
+        srv_thread.daemon = True
+        srv_thread.start()
+
+        def make_requester():
+            requester = _make_http_requester('127.0.0.1', srv.server_port,
+                                             method, headers, body)
+            closers.append(requester[2])
+            return requester
+    else:
+        def make_requester():
+            return _make_wsgi_requester(app, method, headers, body)
+
+    try:
+        if warmup:
+            make_request, do_request = make_requester()[:2]
+            for path in paths:
+                try:
+                    do_request(make_request(path))
+                except Exception:
+                    pass  # counted in the run proper
+        results = []
+        counter = itertools.count()
+        start = perf_counter()
+        deadline = start + duration if duration is not None else None
+        workers = [threading.Thread(target=_run_worker,
+                                    args=(make_requester, paths, patterns,
+                                          counter, requests, deadline,
+                                          start, rate, results))
+                   for _ in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = perf_counter() - start
+    finally:
+        for close in closers:
+            close()
+        if srv is not None:
+            srv.shutdown()
+            srv.server_close()
+
+    settings = {'mode': 'server' if server else 'inprocess',
+                'method': method,
+                'paths': paths,
+                'concurrency': concurrency,
+                'requests': requests,
+                'duration': duration,
+                'rate': rate}
+    return get_load_report(results, elapsed, settings)
+
+
+def get_load_report(route_hits_list, elapsed, settings=None):
+    """Merges per-worker route hits, mappings of pattern to status to
+    :class:`~clastic.middleware.stats.RouteStats`, into a report with
+    ``total`` and per-route stats, as well as the ``settings`` and
+    ``environment``. Latencies are in milliseconds."""
+    route_hits = new_route_hits()
+    for worker_hits in route_hits_list:
+        for pattern, status_map in worker_hits.items():
+            for status, rs in status_map.items():
+                route_hits[pattern][status] = RouteStats.merge(
+                    [route_hits[pattern][status], rs])
+
+    all_stats = [rs for status_map in route_hits.values()
+                 for rs in status_map.values()]
+    total = RouteStats.merge(all_stats)
+    error_count = sum([rs.total_count for status_map in route_hits.values()
+                       for status, rs in status_map.items()
+                       if is_error_status(status)])
+    latency = total.durations.describe(quantiles=_QUANTILES, scale=1000)
+    total_dict = {'count': total.total_count,
+                  'error_count': error_count,
+                  'elapsed': round(elapsed, 4),
+                  'rps': round(total.total_count / elapsed, 2) if elapsed else 0.0,
+                  'bytes': int(total.sizes.total),
+                  'latency': dict([(k, round(v, 3)) for k, v in latency.items()])}
+    routes = {}
+    for pattern, status_map in route_hits.items():
+        routes[pattern] = get_route_stats_dict(status_map)
+        for status, rs in status_map.items():
+            routes[pattern][status]['rps'] = (round(rs.total_count / elapsed, 2)
+                                              if elapsed else 0.0)
+    return {'environment': get_environment_info(),
+            'settings': settings or {},
+            'total': total_dict,
+            'routes': routes}
+
+
+def format_load_report(report):
+    "Formats a report from :func:`run_load` as a text table."
+    settings, total = report['settings'], report['total']
+    latency = total['latency']
+    lines = ['%s %s, %s mode, concurrency %s'
+             % (settings.get('method', 'GET'), ', '.join(settings.get('paths', [])),
+                settings.get('mode'), settings.get('concurrency')),
+             '%s requests in %.2fs, %s errors'
+             % (total['count'], total['elapsed'], total['error_count']),
+             'Requests/sec: %.2f' % total['rps'],
+             'Latency (ms): min %.2f, p50 %.2f, p90 %.2f, p99 %.2f, max %.2f'
+             % (latency['min'], latency['0.5'], latency['0.9'],
+                latency['0.99'], latency['max']),
+             '',
+             '%-32s %-10s %8s %10s %8s %8s %8s %8s'
+             % ('route', 'status', 'count', 'rps', 'p50', 'p95', 'p99', 'max')]
+    for pattern, status_map in sorted(report['routes'].items()):
+        for status, stats in sorted(status_map.items()):
+            lines.append('%-32s %-10s %8s %10.2f %8.2f %8.2f %8.2f %8.2f'
+                         % (pattern, status, stats['count'], stats['rps'],
+                            stats['0.5'], stats['0.95'], stats['0.99'],
+                            stats['max']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    prs = ArgumentParser(prog='python -m clastic.bench',
+                         description='Send load to a WSGI application and'
+                         ' report throughput and latency.')
+    prs.add_argument('target', help="the application to load, as 'module:attr',"
+                     " where attr defaults to 'app', and is called if it ends in '()'")
+    prs.add_argument('-p', '--path', action='append', dest='paths', metavar='PATH',
+                     help="a path to request, repeat to cycle through several"
+                     " (default: '/')")
+    prs.add_argument('-m', '--method', default='GET')
+    prs.add_argument('-H', '--header', action='append', dest='headers', default=[],
+                     metavar='HEADER',
+                     help="a request header, as 'Name: value'")
+    prs.add_argument('--data', help='a request body')
+    prs.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                     help='concurrent client threads (default: %(default)s)')
+    prs.add_argument('-n', '--requests', type=int,
+                     help='total requests to send (default: %s, if no'
+                     ' duration is given)' % DEFAULT_REQUESTS)
+    prs.add_argument('-d', '--duration', type=float,
+                     help='seconds to send requests for')
+    prs.add_argument('--rate', type=float,
+                     help='maximum total requests per second')
+    prs.add_argument('--server', action='store_true',
+                     help='serve the application on a loopback port, and'
+                     ' send requests over HTTP, instead of in-process')
+    prs.add_argument('--no-warmup', action='store_false', dest='warmup')
+    prs.add_argument('--json', action='store_true',
+                     help='output the report as JSON')
+    args = prs.parse_args(argv)
+
+    headers = []
+    for header in args.headers:
+        name, sep, value = header.partition(':')
+        if not sep:
+            prs.error('expected a header like "Name: value", not %r' % header)
+        headers.append((name.strip(), value.strip()))
+    try:
+        app = load_app(args.target)
+    except (ImportError, ValueError) as e:
+        prs.error(str(e))
+    report = run_load(app, paths=args.paths or ['/'], method=args.method.upper(),
+                      headers=headers, body=args.data,
+                      concurrency=args.concurrency, requests=args.requests,
+                      duration=args.duration, rate=args.rate,
+                      server=args.server, warmup=args.warmup)
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_load_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""A reproducible suite of microbenchmarks of Clastic's request path
+and construction: routing, middleware chains, rendering, static file
+serving, stats overhead, and Application construction.
+
+Results are emitted as JSON, see :func:`run_benchmarks`, and can be
+compared against an earlier run to catch regressions::
+
+    python -m clastic.bench suite -o results.json
+    python -m clastic.bench suite --compare results.json
+
+Every benchmark is timed for a number of loops calibrated to take at
+least *min_time* seconds, *repeat* times, and reports per-operation
+times in seconds. The ``min`` and ``median`` times are the most
+reliable, the mean is more affected by noise from the rest of the
+system.
+"""
+
+import os
+import sys
+import json
+import shutil
+import platform
+import tempfile
+import datetime
+import statistics
+from time import perf_counter
+from argparse import ArgumentParser
+
+from werkzeug.test import create_environ
+from werkzeug.wrappers import Request, Response
+
+from .. import __version__, route, sinter
+from ..application import Application
+from ..middleware import Middleware, make_middleware_chain
+from ..middleware.stats import StatsMiddleware
+from ..render import BasicRender, JSONRender, TabularRender
+from ..route import RESERVED_ARGS
+from ..sinter import inject
+from ..static import StaticApplication
+
+
+DEFAULT_MIN_TIME = 0.05
+DEFAULT_REPEAT = 5
+_MAX_LOOPS = 10 ** 6
+
+# name -> (params, setup function), see benchmark()
+BENCHMARKS = {}
+
+
+def benchmark(name, params):
+    """Registers a benchmark. The decorated function is called with each
+    of *params*, and returns a generator, which yields the callable to
+    time. The generator is closed after timing, so cleanup goes in a
+    ``finally`` block."""
+    def register(setup_func):
+        BENCHMARKS[name] = (tuple(params), setup_func)
+        return setup_func
+    return register
+
+
+def _start_response(status, headers, exc_info=None):
+    return lambda data: None
+
+
+def _call_wsgi(wsgi_app, environ):
+    app_iter = wsgi_app(dict(environ), _start_response)
+    try:
+        for _ in app_iter:
+            pass
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+def _make_endpoint(i):
+    def endpoint(item_id):
+        return Response('route %s, item %s' % (i, item_id))
+    return endpoint
+
+
+def _make_routes(route_count):
+    # new endpoints every time, so no route shares a compiled chain
+    return [('/route%s/<item_id:int>' % i, _make_endpoint(i))
+            for i in range(route_count)]
+
+
+def _make_payload(row_count):
+    return [{'id': i,
+             'name': 'name %s' % i,
+             'score': i * 1.5,
+             'tags': ['a', 'b'],
+             'active': bool(i % 2)} for i in range(row_count)]
+
+
+class _PassthroughMiddleware(Middleware):
+    unique = False
+
+    def request(self, next):
+        return next()
+
+
+@benchmark('dispatch', params=(10, 100, 1000))
+def bench_dispatch(route_count):
+    "Application.dispatch() to the last of *route_count* routes."
+    app = Application(_make_routes(route_count))
+    request = Request(create_environ('/route%s/1' % (route_count - 1)))
+    yield lambda: app.dispatch(request)
+
+
+@benchmark('middleware_chain', params=(0, 1, 2, 5, 10))
+def bench_middleware_chain(depth):
+    "A chain of *depth* middlewares, from make_middleware_chain()."
+    middlewares = [_PassthroughMiddleware() for _ in range(depth)]
+
+    def endpoint(request):
+        return {'path': request.path}
+
+    def render(context):
+        return Response(context['path'])
+
+    chain = make_middleware_chain(middlewares, endpoint, render, RESERVED_ARGS)
+    request = Request(create_environ('/'))
+    yield lambda: chain(request=request)
+
+
+@benchmark('render_basic', params=(10, 100, 1000))
+def bench_render_basic(row_count):
+    "BasicRender, with a context of *row_count* dicts."
+    return _bench_render(BasicRender(), row_count)
+
+
+@benchmark('render_json', params=(10, 100, 1000))
+def bench_render_json(row_count):
+    "JSONRender, with a context of *row_count* dicts."
+    return _bench_render(JSONRender(), row_count)
+
+
+@benchmark('render_tabular', params=(10, 100, 1000))
+def bench_render_tabular(row_count):
+    "TabularRender, with a context of *row_count* dicts."
+    return _bench_render(TabularRender(), row_count)
+
+
+def _bench_render(render, row_count):
+    app = Application([('/', lambda: None, render)])
+    injectables = {'context': _make_payload(row_count),
+                   'request': Request(create_environ('/')),
+                   '_route': app.routes[0]}
+    yield lambda: inject(render, injectables)
+
+
+@benchmark('static', params=(1024, 64 * 1024, 1024 * 1024))
+def bench_static(file_size):
+    "StaticApplication serving a file of *file_size* bytes, over WSGI."
+    static_dir = tempfile.mkdtemp(prefix='clastic-bench-')
+    try:
+        with open(os.path.join(static_dir, 'file.bin'), 'wb') as f:
+            f.write(os.urandom(file_size))
+        app = Application([('/static/', StaticApplication(static_dir))])
+        environ = create_environ('/static/file.bin')
+        yield lambda: _call_wsgi(app, environ)
+    finally:
+        shutil.rmtree(static_dir, ignore_errors=True)
+
+
+@benchmark('stats_overhead', params=('none', 'stats', 'phase_timing'))
+def bench_stats_overhead(mode):
+    "A request over WSGI, without and with StatsMiddleware."
+    middlewares = []
+    if mode != 'none':
+        middlewares.append(StatsMiddleware(phase_timing=(mode == 'phase_timing')))
+    app = Application(_make_routes(1), middlewares=middlewares)
+    environ = create_environ('/route0/1')
+    yield lambda: _call_wsgi(app, environ)
+
+
+@benchmark('construction', params=(10, 100, 1000))
+def bench_construction(route_count):
+    """Application construction, with *route_count* new routes each
+    time. The compiled code and path pattern caches are cleared before
+    each construction, and the on-disk code cache disabled, so that
+    every construction is timed cold."""
+    def construct():
+        sinter._CODE_CACHE.clear()
+        route._PATH_PATTERN_CACHE.clear()
+        return Application(_make_routes(route_count))
+
+    code_cache_dir = sinter._CODE_CACHE_DIR
+    sinter.set_code_cache_dir(None)
+    try:
+        yield construct
+    finally:
+        sinter.set_code_cache_dir(code_cache_dir)
+
+
+def time_func(func, min_time=DEFAULT_MIN_TIME, repeat=DEFAULT_REPEAT):
+    """Times *func*, calibrating the number of loops so that each of the
+    *repeat* samples takes at least *min_time* seconds. Returns a
+    dict of per-call times, in seconds, and the loop count."""
+    loops = 1
+    while True:
+        start = perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = perf_counter() - start
+        if elapsed >= min_time or loops >= _MAX_LOOPS:
+            break
+        # aim a little over, to avoid another calibration round
+        loops = min(_MAX_LOOPS, max(loops * 2, int(loops * min_time * 1.2 / (elapsed or 1e-9))))
+    samples = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((perf_counter() - start) / loops)
+    return {'loops': loops,
+            'repeat': repeat,
+            'min': min(samples),
+            'median': statistics.median(samples),
+            'mean': statistics.mean(samples),
+            'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0}
+
+
+def get_environment_info():
+    return {'clastic_version': __version__,
+            'python_version': platform.python_version(),
+            'python_implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': datetime.datetime.utcnow().isoformat()}
+
+
+def run_benchmarks(names=None, min_time=DEFAULT_MIN_TIME,
+                   repeat=DEFAULT_REPEAT, verbose=False):
+    """Runs the benchmarks in *names*, or all of them, and returns the
+    results as a JSON-serializable dict, with an ``environment`` dict,
+    and a ``results`` list with one dict per benchmark and param."""
+    results = []
+    for name in sorted(BENCHMARKS):
+        if names and name not in names:
+            continue
+        params, setup_func = BENCHMARKS[name]
+        for param in params:
+            bench_gen = setup_func(param)
+            try:
+                func = next(bench_gen)
+                func()  # warm up, e.g., lazily-created injectors
+                result = time_func(func, min_time=min_time, repeat=repeat)
+            finally:
+                bench_gen.close()
+            result.update({'name': name, 'param': param,
+                           'ops_per_sec': round(1 / result['median'], 2)})
+            results.append(result)
+            if verbose:
+                sys.stderr.write('%s[%s]: %.2fus\n' % (name, param, result['median'] * 1e6))
+    return {'environment': get_environment_info(),
+            'settings': {'min_time': min_time, 'repeat': repeat},
+            'results': results}
+
+
+def compare_results(baseline, current, threshold=0.1):
+    """Returns a list of ``(name, param, baseline_min, current_min,
+    ratio, is_regression)`` for benchmarks in both results, where a
+    regression is a minimum time more than *threshold* slower. The
+    minimum is the least affected by noise."""
+    base_map = dict([((r['name'], r['param']), r) for r in baseline['results']])
+    ret = []
+    for cur in current['results']:
+        base = base_map.get((cur['name'], cur['param']))
+        if base is None:
+            continue
+        ratio = cur['min'] / base['min']
+        ret.append((cur['name'], cur['param'], base['min'], cur['min'],
+                    ratio, ratio > 1 + threshold))
+    return ret
+
+
+def main(argv=None):
+    prs = ArgumentParser(prog='python -m clastic.bench suite',
+                         description='Run Clastic microbenchmarks, output JSON.')
+    prs.add_argument('names', nargs='*',
+                     help='benchmarks to run, defaults to all of: %s'
+                     % ', '.join(sorted(BENCHMARKS)))
+    prs.add_argument('-o', '--output', help='write results here, instead of stdout')
+    prs.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                     help='minimum seconds per sample (default: %(default)s)')
+    prs.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                     help='samples per benchmark (default: %(default)s)')
+    prs.add_argument('--compare', metavar='BASELINE_JSON',
+                     help='compare to earlier results, exiting 1 on regressions')
+    prs.add_argument('--threshold', type=float, default=0.1,
+                     help='slowdown ratio counted as a regression (default: %(default)s)')
+    prs.add_argument('-q', '--quiet', action='store_true')
+    args = prs.parse_args(argv)
+    unknown_names = sorted(set(args.names) - set(BENCHMARKS))
+    if unknown_names:
+        prs.error('unknown benchmarks: %s' % ', '.join(unknown_names))
+
+    results = run_benchmarks(args.names, min_time=args.min_time,
+                             repeat=args.repeat, verbose=not args.quiet)
+    results_json = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results_json + '\n')
+    elif not args.compare:
+        print(results_json)
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    regressed = False
+    for name, param, base, cur, ratio, is_regression in compare_results(
+            baseline, results, args.threshold):
+        regressed = regressed or is_regression
+        print('%-20s %-14s %10.2fus %10.2fus %6.2fx%s'
+              % (name, param, base * 1e6, cur * 1e6, ratio,
+                 '  REGRESSION' if is_regression else ''))
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
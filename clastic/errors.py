@@ -62,14 +62,14 @@ import builtins as exceptions
 from html import escape as html_escape
 
 from werkzeug.utils import get_content_type
-from werkzeug.debug import DebuggedApplication
 from werkzeug.wrappers import BaseResponse
 from boltons.tbutils import ExceptionInfo, ContextualExceptionInfo
-from glom import glom, T
 
 from . import __version__
 from .render.simple import ClasticJSONEncoder
-from ._contextual_errors import CONTEXTUAL_ENV
+
+# glom, werkzeug's debugger, and the contextual error templates are
+# imported where used, as most processes never need them
 
 
 ERROR_CODE_MAP = None
@@ -478,6 +478,7 @@ class InternalServerError(HTTPException):
                 pass
 
     def to_dict(self):
+        from glom import glom, T
         ret = super(InternalServerError, self).to_dict()
         ret['exc_info'] = glom(self, T.exc_info.to_dict(), skip_exc=Exception)
         return ret
@@ -610,6 +611,7 @@ class ContextualInternalServerError(InternalServerError):
         super(ContextualInternalServerError, self).__init__(*a, **kw)
 
     def to_dict(self, *a, **kw):
+        from glom import glom, T
         ret = super(ContextualInternalServerError, self).to_dict(*a, **kw)
         del ret['exc_info']
         exc_info = getattr(self, 'exc_info', None)
@@ -657,6 +659,7 @@ class ContextualInternalServerError(InternalServerError):
         return ret
 
     def to_html(self, *a, **kw):
+        from ._contextual_errors import CONTEXTUAL_ENV
         render_ctx = self.to_dict()
         return CONTEXTUAL_ENV.render('500.html', render_ctx)
 
@@ -697,6 +700,7 @@ class ContextualNotFound(NotFound):
         return ret
 
     def to_html(self, *a, **kw):
+        from ._contextual_errors import CONTEXTUAL_ENV
         render_ctx = self.to_dict()
         return CONTEXTUAL_ENV.render('404.html', render_ctx)
 
@@ -731,10 +735,10 @@ class ContextualErrorHandler(ErrorHandler):
                       hide_internal_frames=self.hide_internal_frames)
 
 
-class _REPLDebuggedApplication(DebuggedApplication):
-    def __init__(self, app, **kwargs):
-        kwargs['evalex'] = True
-        super(_REPLDebuggedApplication, self).__init__(app, **kwargs)
+def _repl_debugged_application(app, **kwargs):
+    from werkzeug.debug import DebuggedApplication
+    kwargs['evalex'] = True
+    return DebuggedApplication(app, **kwargs)
 
 
 class REPLErrorHandler(ContextualErrorHandler):
@@ -743,7 +747,7 @@ class REPLErrorHandler(ContextualErrorHandler):
 
     """
 
-    wsgi_wrapper = _REPLDebuggedApplication
+    wsgi_wrapper = staticmethod(_repl_debugged_application)
 
     def uncaught_to_response(self, **kwargs):
         raise
@@ -5,6 +5,7 @@ import sys
 import socket
 import platform
 import datetime
+import tracemalloc
 
 from glom import glom, T, Call, Coalesce
 from boltons.strutils import bytes2human
@@ -44,6 +45,7 @@ from .static import StaticApplication
 
 
 from .middleware.url import ScriptRootMiddleware
+from .middleware.memory import MemoryProfileMiddleware, get_site_label
 from .middleware.context import SimpleContextProcessor
 
 
@@ -204,10 +206,54 @@ def get_gc_info():
 
     ret['counts'] = glom(gc, T.get_count(), skip_exc=Exception)
     ret['obj_count'] = glom(gc, (T.get_objects(), len), skip_exc=Exception)
+    ret['garbage_count'] = len(gc.garbage)
+    ret['freeze_count'] = glom(gc, T.get_freeze_count(), skip_exc=Exception)
+
+    gen_stats = glom(gc, T.get_stats(), skip_exc=Exception) or []
+    generations = []
+    for i, gen_stat in enumerate(gen_stats):
+        cur = dict(gen_stat, generation=i)
+        cur['count'] = glom(ret, ('counts', T[i]), skip_exc=Exception)
+        cur['threshold'] = glom(ret, ('thresholds', T[i]), skip_exc=Exception)
+        generations.append(cur)
+    ret['generations'] = generations
 
     return ret
 
 
+def get_tracemalloc_info(limit=10):
+    ret = {'is_tracing': tracemalloc.is_tracing()}
+    if not ret['is_tracing']:
+        return ret
+    cur_size, peak_size = tracemalloc.get_traced_memory()
+    ret['traced_size'] = cur_size
+    ret['traced_size_human'] = bytes2human(cur_size)
+    ret['peak_size'] = peak_size
+    ret['peak_size_human'] = bytes2human(peak_size)
+    snapshot = tracemalloc.take_snapshot()
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    top_stats = snapshot.statistics('lineno')[:limit]
+    ret['top_sites'] = [{'site': get_site_label(stat.traceback),
+                         'size': stat.size,
+                         'size_human': bytes2human(stat.size),
+                         'count': stat.count} for stat in top_stats]
+    return ret
+
+
+def get_route_allocation_infos(_application, limit=10):
+    try:
+        mem_mw = [mw for mw in _application.middlewares
+                  if isinstance(mw, MemoryProfileMiddleware)][0]
+    except IndexError:
+        return None
+    ret = []
+    for pattern, info in sorted(mem_mw.get_route_allocations(limit).items()):
+        info['pattern'] = pattern
+        info['mean_size_diff_human'] = bytes2human(info['mean_size_diff'])
+        ret.append(info)
+    return ret
+
+
 def get_resource_info(_application):
     ret = []
     for key, val in _application.resources.items():
@@ -403,6 +449,31 @@ class PythonPeripheral(AshesMetaPeripheral):
     get_context = staticmethod(get_pyvm_info)
 
 
+class MemoryPeripheral(AshesMetaPeripheral):
+    """Garbage collector generations, the top allocation sites if
+    :mod:`tracemalloc` is tracing, and per-route allocations if a
+    :class:`~clastic.middleware.memory.MemoryProfileMiddleware` is
+    installed."""
+    title = 'Memory'
+    group_key = 'memory'
+    template_path = 'meta_memory_section.html'
+
+    def __init__(self, limit=10):
+        self.limit = limit
+        super(MemoryPeripheral, self).__init__()
+
+    def get_context(self, _application):
+        return {'gc': glom(None, Call(get_gc_info), skip_exc=Exception),
+                'tracemalloc': get_tracemalloc_info(self.limit),
+                'routes': get_route_allocation_infos(_application, self.limit)}
+
+    def get_general_items(self, context):
+        tm_info = context.get('tracemalloc') or {}
+        if not tm_info.get('is_tracing'):
+            return []
+        return [('Traced memory', tm_info['traced_size_human'])]
+
+
 class SysconfigPeripheral(MetaPeripheral):
     title = 'Python System Configuration'
     group_key = 'pyvm'
@@ -422,6 +493,7 @@ DEFAULT_PERIPHERALS = [BasicPeripheral(),
                        ProcessPeripheral(),
                        ResourceUsagePeripheral(),
                        PythonPeripheral(),
+                       MemoryPeripheral(),
                        SysconfigPeripheral()]
 
 
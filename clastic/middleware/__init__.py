@@ -4,6 +4,7 @@ from .core import (Middleware,
                    check_middlewares,
                    merge_middlewares,
                    make_middleware_chain,
+                   check_middleware_chain,
                    DummyMiddleware)
 from .url import GetParamMiddleware
 from .context import (ContextProcessor,
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Structured access logging, written in batches from a background
+thread, so that logging never blocks request handling.
+"""
+
+import sys
+import json
+import time
+import datetime
+
+from .._background import BatchQueue
+from .core import Middleware
+
+
+def format_json_record(record):
+    return json.dumps(record, sort_keys=True)
+
+
+class AccessLogMiddleware(Middleware):
+    """Logs a structured record of every request: its time, request id
+    and guid, method, path, route pattern, status, duration (in
+    milliseconds), and response size in bytes.
+
+    Records are put on a queue of at most *max_queue* records, and
+    written by a background thread in batches of up to *batch_size*,
+    at least every *flush_interval* seconds while records are
+    waiting. If the queue is full, the record is dropped and counted
+    in :attr:`dropped_count`, instead of making the request wait.
+
+    Records are written to the file at *path*, opened for appending,
+    or *stream* (default ``sys.stderr``), one per line, formatted by
+    *formatter*, which defaults to JSON.
+    """
+    def __init__(self, path=None, stream=None, formatter=format_json_record,
+                 batch_size=100, flush_interval=1.0, max_queue=10000):
+        if path is not None and stream is not None:
+            raise TypeError('expected one of path or stream, not both')
+        self.path = path
+        if path is not None:
+            stream = open(path, 'a', encoding='utf-8')
+        self.stream = stream if stream is not None else sys.stderr
+        self.formatter = formatter
+        self._queue = BatchQueue(self._write, 'clastic-access-log',
+                                 batch_size=batch_size,
+                                 flush_interval=flush_interval,
+                                 max_queue=max_queue)
+
+    @property
+    def dropped_count(self):
+        "The number of records dropped because the queue was full."
+        return self._queue.dropped_count
+
+    def request(self, next, request, _route):
+        start_time = time.time()
+        resp_length = None
+        try:
+            resp = next()
+            resp_status = getattr(resp, 'status_code', resp.__class__.__name__)
+            resp_length = resp.headers.get('Content-Length', None, int)
+            if resp_length is None and resp.is_sequence:
+                resp_length = resp.calculate_content_length()
+        except Exception as e:
+            resp_status = getattr(e, 'code', e.__class__.__name__)
+            raise
+        finally:
+            duration = time.time() - start_time
+            record = {'time': datetime.datetime.utcfromtimestamp(start_time).isoformat(),
+                      'request_id': getattr(request, 'request_id', None),
+                      'request_guid': getattr(request, 'request_guid', None),
+                      'method': request.method,
+                      'path': request.path,
+                      'pattern': _route.pattern,
+                      'status': resp_status,
+                      'duration': round(duration * 1000, 3),
+                      'bytes': resp_length,
+                      'remote_addr': request.remote_addr}
+            self.log(record)
+        return resp
+
+    def log(self, record):
+        "Queues *record* for writing, without blocking."
+        self._queue.put(record)
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter(record) + '\n')
+            except Exception:
+                continue  # one bad record shouldn't lose the batch
+        try:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+        except Exception:
+            pass  # nowhere left to report it
+
+    def flush(self):
+        "Blocks until every queued record has been written."
+        self._queue.flush()
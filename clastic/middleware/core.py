@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import itertools
+from time import perf_counter
 from collections import defaultdict
 
 from werkzeug.utils import cached_property
 from werkzeug.wrappers import BaseResponse
 
-from ..sinter import make_chain, get_arg_names, compile_code
+from boltons.funcutils import FunctionBuilder
+
+from ..sinter import make_chain, get_chain_args, get_arg_names, get_fb, compile_code
 
 _INNER_NAME = 'next'
 
@@ -128,19 +132,115 @@ class DummyMiddleware(Middleware):
         return ret
 
 
-def make_middleware_chain(middlewares, endpoint, render, preprovided):
+def _make_timed(func, phase):
+    # wraps a chain function to record its exclusive duration (i.e.,
+    # minus time spent in next()) on the _dispatch_state. the
+    # wrapper's signature is the original's plus _dispatch_state, so
+    # the compiled chain passes it through.
+    fb = get_fb(func)
+    takes_state = '_dispatch_state' in fb.get_arg_names()
+    takes_next = 'next' in fb.args
+
+    def timed(**kwargs):
+        __traceback_hide__ = True
+        if takes_state:
+            dispatch_state = kwargs['_dispatch_state']
+        else:
+            dispatch_state = kwargs.pop('_dispatch_state')
+        if dispatch_state.timings is None:
+            return func(**kwargs)  # timing disabled for this request
+        inner_time = [0.0]
+        if takes_next:
+            inner_next = kwargs['next']
+
+            def timed_next(*a, **kw):
+                __traceback_hide__ = True
+                start = perf_counter()
+                try:
+                    return inner_next(*a, **kw)
+                finally:
+                    inner_time[0] += perf_counter() - start
+            kwargs['next'] = timed_next
+        start = perf_counter()
+        try:
+            return func(**kwargs)
+        finally:
+            end = perf_counter()
+            dispatch_state.add_timing(phase, end - start - inner_time[0],
+                                      start, end)
+
+    timed_fb = copy.copy(fb)
+    timed_fb.args = list(fb.args)
+    if not takes_state:
+        # prepended so that positional defaults stay aligned
+        timed_fb.args.insert(0, '_dispatch_state')
+    timed._sinter_fb = timed_fb
+    return timed
+
+
+def _make_timed_middlewares(middlewares):
+    ret = []
+    for mw in middlewares:
+        timed_mw = copy.copy(mw)
+        for func_name in ('request', 'endpoint', 'render'):
+            func = getattr(mw, func_name, None)
+            if func:
+                phase = '%s.%s' % (mw.name, func_name)
+                setattr(timed_mw, func_name, _make_timed(func, phase))
+        ret.append(timed_mw)
+    return ret
+
+
+def make_middleware_chain(middlewares, endpoint, render, preprovided,
+                          timed=False):
     """
     Expects de-duplicated and conflict-free middleware/endpoint/render
     functions.
 
+    If *timed* is ``True``, each middleware function, the endpoint,
+    and the render record their exclusive durations on the
+    :class:`~clastic.application.DispatchState`, via
+    :meth:`~clastic.application.DispatchState.add_timing`.
+
     # TODO: better name to differentiate a compiled/chained stack from
     # the core functions themselves (endpoint/render)
     """
+    return _make_middleware_chain(middlewares, endpoint, render,
+                                  preprovided, timed=timed)
+
+
+def check_middleware_chain(middlewares, endpoint, render, preprovided):
+    """Performs the same checks as :func:`make_middleware_chain`,
+    raising the same :exc:`NameError` on unresolved arguments, but
+    without generating any code. Used to validate lazily-compiled
+    routes at bind time.
+    """
+    _make_middleware_chain(middlewares, endpoint, render, preprovided,
+                           compile=False)
+
+
+def _check_chain(funcs, provides, final_func, preprovided, inner_name):
+    # make_chain() stand-in, for validation only
+    args, unresolved = get_chain_args(funcs, provides, final_func,
+                                      preprovided, inner_name)
+    return None, args, unresolved
+
+
+def _make_middleware_chain(middlewares, endpoint, render, preprovided,
+                           timed=False, compile=True):
     _next_exc_msg = "argument 'next' reserved for middleware use only (%r)"
     if 'next' in get_arg_names(endpoint):
         raise NameError(_next_exc_msg % endpoint)
     if 'next' in get_arg_names(render):
         raise NameError(_next_exc_msg % render)
+    # the timed wrappers only take builtins on top of the originals'
+    # arguments, so they don't need validating
+    if timed and compile:
+        middlewares = _make_timed_middlewares(middlewares)
+        endpoint = _make_timed(endpoint, 'endpoint')
+        render = _make_timed(render, 'render')
+
+    make_chain_ = make_chain if compile else _check_chain
 
     req_avail = set(preprovided) - set(['next', 'context'])
     req_sigs = [(mw.request, mw.provides)
@@ -152,11 +252,11 @@ def make_middleware_chain(middlewares, endpoint, render, preprovided):
     ep_sigs = [(mw.endpoint, mw.endpoint_provides)
                for mw in middlewares if mw.endpoint]
     ep_funcs, ep_provides = list(zip(*ep_sigs)) or ((), ())
-    ep_chain, ep_args, ep_unres = make_chain(ep_funcs,
-                                             ep_provides,
-                                             endpoint,
-                                             ep_avail,
-                                             _INNER_NAME)
+    ep_chain, ep_args, ep_unres = make_chain_(ep_funcs,
+                                              ep_provides,
+                                              endpoint,
+                                              ep_avail,
+                                              _INNER_NAME)
     if ep_unres:
         raise NameError("unresolved endpoint middleware arguments: %r"
                         % list(ep_unres))
@@ -165,32 +265,43 @@ def make_middleware_chain(middlewares, endpoint, render, preprovided):
     rn_sigs = [(mw.render, mw.render_provides)
                for mw in middlewares if mw.render]
     rn_funcs, rn_provides = list(zip(*rn_sigs)) or ((), ())
-    rn_chain, rn_args, rn_unres = make_chain(rn_funcs,
-                                             rn_provides,
-                                             render,
-                                             rn_avail,
-                                             _INNER_NAME)
+    rn_chain, rn_args, rn_unres = make_chain_(rn_funcs,
+                                              rn_provides,
+                                              render,
+                                              rn_avail,
+                                              _INNER_NAME)
     if rn_unres:
         raise NameError("unresolved render middleware arguments: %r"
                         % list(rn_unres))
 
     req_args = (ep_args | rn_args) - set(['context'])
-    req_func = _create_request_inner(ep_chain,
-                                     rn_chain,
-                                     req_args,
-                                     ep_args,
-                                     rn_args)
-    req_chain, req_chain_args, req_unres = make_chain(req_funcs,
-                                                      req_provides,
-                                                      req_func,
-                                                      req_avail,
-                                                      _INNER_NAME)
+    if compile:
+        req_func = _create_request_inner(ep_chain,
+                                         rn_chain,
+                                         req_args,
+                                         ep_args,
+                                         rn_args)
+    else:
+        req_func = _make_signature_stub('process_request', req_args)
+    req_chain, req_chain_args, req_unres = make_chain_(req_funcs,
+                                                       req_provides,
+                                                       req_func,
+                                                       req_avail,
+                                                       _INNER_NAME)
     if req_unres:
         raise NameError("unresolved request middleware arguments: %r"
                         % list(req_unres))
     return req_chain
 
 
+def _make_signature_stub(name, args):
+    # a callable which get_fb() describes as taking *args*
+    def stub():
+        pass
+    stub._sinter_fb = FunctionBuilder(name, args=sorted(args))
+    return stub
+
+
 _REQ_INNER_TMPL = \
 '''
 def process_request({all_args}):
@@ -205,12 +316,12 @@ def process_request({all_args}):
 
 
 def _named_arg_str(args):
-    return ', '.join([a + '=' + a for a in args])
+    return ', '.join([a + '=' + a for a in sorted(args)])
 
 
 def _create_request_inner(endpoint, render, all_args,
                           endpoint_args, render_args):
-    all_args_str = ','.join(all_args)
+    all_args_str = ','.join(sorted(all_args))
     ep_args_str = _named_arg_str(endpoint_args)
     rn_args_str = _named_arg_str(render_args)
 
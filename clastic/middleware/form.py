@@ -4,7 +4,8 @@ from collections.abc import Mapping, Iterable
 
 from boltons.iterutils import is_iterable
 
-
+from ..errors import BadRequest, UnsupportedMediaType
+from ..render.binary import get_body_loaders
 from .core import Middleware
 
 
@@ -33,3 +34,51 @@ class PostDataMiddleware(Middleware):
         cn = self.__class__.__name__
         param_map = dict([(n, t.__name__) for n, t in self.params.items()])
         return '%s(params=%r)' % (cn, param_map)
+
+
+class BodyDataMiddleware(Middleware):
+    """Decodes a serialized request body and provides it under a single
+    argument name (``body_data`` by default). The decoder is chosen
+    by the request's ``Content-Type``: JSON is always supported,
+    MessagePack and CBOR are supported if ``msgpack`` and ``cbor2``
+    are installed, respectively. Unsupported content types result in
+    a 415, undecodable bodies in a 400.
+
+    Args:
+
+      arg_name (str): Name under which the decoded body is provided.
+      loaders (dict): Optional mapping of MIME type to a function
+        which decodes bytes. Defaults to all available loaders.
+      allow_empty (bool): Provide ``None`` for requests without a
+        body instead of raising a 400. Defaults to ``True``.
+    """
+    def __init__(self, arg_name='body_data', loaders=None, allow_empty=True):
+        self.arg_name = arg_name
+        self.loaders = dict(loaders if loaders is not None
+                            else get_body_loaders())
+        self.allow_empty = allow_empty
+        self.provides = (arg_name,)
+
+    def request(self, next, request):
+        data = request.get_data(cache=True)
+        if not data:
+            if not self.allow_empty:
+                raise BadRequest('expected a non-empty request body')
+            return next(**{self.arg_name: None})
+        loader = self.loaders.get(request.mimetype)
+        if loader is None:
+            raise UnsupportedMediaType('expected request content type to be'
+                                       ' one of %r, not %r'
+                                       % (sorted(self.loaders),
+                                          request.mimetype))
+        try:
+            value = loader(data)
+        except Exception as e:
+            raise BadRequest('could not decode %s request body: %r'
+                             % (request.mimetype, e))
+        return next(**{self.arg_name: value})
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('%s(arg_name=%r, loaders=%r)'
+                % (cn, self.arg_name, sorted(self.loaders)))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Per-route memory allocation profiling, with :mod:`tracemalloc`.
+"""
+
+import random
+import threading
+import tracemalloc
+from collections import defaultdict
+
+from .core import Middleware
+
+
+# keep tracemalloc's own bookkeeping out of the results
+_SNAPSHOT_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),)
+
+
+def get_site_label(traceback):
+    "Formats the innermost frame of a tracemalloc Traceback as file:line."
+    frame = traceback[0]
+    return '%s:%s' % (frame.filename, frame.lineno)
+
+
+class MemoryProfileMiddleware(Middleware):
+    """Measures the memory allocated, and still held, by a random
+    *sample_rate* fraction of requests, and aggregates the
+    allocation sites (source lines) by route pattern.
+
+    Tracing memory allocations slows down the whole process, so
+    unless :mod:`tracemalloc` was already started (e.g., with
+    ``PYTHONTRACEMALLOC=1``), it is started and stopped around each
+    sampled request, and unsampled requests only pay for a random
+    number. Only one request is sampled at a time, but allocations
+    made by concurrent requests in other threads during that time
+    are still counted. Each pattern keeps its *max_sites* largest
+    sites.
+
+    See :meth:`get_route_allocations`, and
+    :class:`~clastic.meta.MemoryPeripheral`, which displays them.
+    """
+    def __init__(self, sample_rate=0.01, max_sites=100):
+        self.sample_rate = sample_rate
+        self.max_sites = max_sites
+        self._sample_lock = threading.Lock()
+        self._data_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._data_lock:
+            # pattern -> site -> [size_diff, count_diff]
+            self.route_sites = defaultdict(dict)
+            self.sample_counts = defaultdict(int)
+            self.size_diffs = defaultdict(int)
+
+    def request(self, next, request, _route):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return next()
+        if not self._sample_lock.acquire(False):
+            return next()
+        try:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            try:
+                before = tracemalloc.take_snapshot()
+                ret = next()
+                after = tracemalloc.take_snapshot()
+            finally:
+                if started:
+                    tracemalloc.stop()
+        finally:
+            self._sample_lock.release()
+        before = before.filter_traces(_SNAPSHOT_FILTERS)
+        after = after.filter_traces(_SNAPSHOT_FILTERS)
+        self._add_diffs(_route.pattern, after.compare_to(before, 'lineno'))
+        return ret
+
+    def _add_diffs(self, pattern, stat_diffs):
+        with self._data_lock:
+            sites = self.route_sites[pattern]
+            self.sample_counts[pattern] += 1
+            for sd in stat_diffs:
+                if not (sd.size_diff or sd.count_diff):
+                    continue
+                self.size_diffs[pattern] += sd.size_diff
+                label = get_site_label(sd.traceback)
+                try:
+                    cur = sites[label]
+                except KeyError:
+                    sites[label] = [sd.size_diff, sd.count_diff]
+                else:
+                    cur[0] += sd.size_diff
+                    cur[1] += sd.count_diff
+            if len(sites) > self.max_sites * 2:
+                # prune in batches, to amortize the sort
+                top = sorted(sites.items(), key=lambda item: -abs(item[1][0]))
+                self.route_sites[pattern] = dict(top[:self.max_sites])
+        return
+
+    def get_route_allocations(self, limit=10):
+        """Returns a dict mapping each sampled route pattern to a dict with
+        the number of requests sampled, the mean net bytes allocated
+        per request, and the *limit* sites with the largest net
+        allocations, with per-request means."""
+        ret = {}
+        with self._data_lock:
+            for pattern, sites in self.route_sites.items():
+                sample_count = self.sample_counts[pattern]
+                top = sorted(sites.items(), key=lambda item: -abs(item[1][0]))
+                ret[pattern] = {
+                    'sample_count': sample_count,
+                    'mean_size_diff': self.size_diffs[pattern] // sample_count,
+                    'top_sites': [{'site': site,
+                                   'size_diff': size_diff,
+                                   'count_diff': count_diff,
+                                   'mean_size_diff': size_diff // sample_count}
+                                  for site, (size_diff, count_diff)
+                                  in top[:limit]]}
+        return ret
@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import sys
+import time
+import random
+import marshal
 import cProfile
+import threading
 from pstats import Stats
+from collections import defaultdict
 
 from io import StringIO
 
+from werkzeug.wrappers import Response
+
+from ..errors import NotImplemented, BadRequest
+from .._background import LazyThread
 from .core import Middleware
 
 
@@ -46,3 +56,379 @@ class SimpleProfileMiddleware(Middleware):
         ret.set_data(body)
 
         return ret
+
+
+class ProfileSessionMiddleware(Middleware):
+    """Accumulates :mod:`cProfile` stats across many requests, for a
+    far less noisy view of hot spots than any single request gives.
+
+    Nothing is profiled until a session is started with
+    :meth:`start`, after which the next *request_count* requests
+    (optionally only those routed to *pattern*, and only a
+    *sample_rate* fraction of those) are profiled, and their stats
+    merged. Only one request is profiled at a time, concurrent
+    requests are served unprofiled. Serve and control sessions with
+    :func:`create_profile_session_app`.
+    """
+    def __init__(self, request_count=100, pattern=None, sample_rate=1.0):
+        self.request_count = request_count
+        self.pattern = pattern
+        self.sample_rate = sample_rate
+        self._profile_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.reset()
+
+    def start(self, request_count=None, pattern=None, sample_rate=None):
+        """Start a new session, discarding the stats of any previous one.
+        Arguments not passed default to those of the middleware."""
+        with self._stats_lock:
+            self.session_pattern = pattern or self.pattern
+            self.session_sample_rate = (self.sample_rate if sample_rate is None
+                                        else sample_rate)
+            self.stats = None
+            self.profiled_count = 0
+            self.start_time = time.time()
+            self.remaining = (self.request_count if request_count is None
+                              else request_count)
+
+    def stop(self):
+        self.remaining = 0
+
+    def reset(self):
+        with self._stats_lock:
+            self.remaining = 0
+            self.session_pattern = self.pattern
+            self.session_sample_rate = self.sample_rate
+            self.stats = None
+            self.profiled_count = 0
+            self.start_time = None
+
+    @property
+    def is_active(self):
+        return self.remaining > 0
+
+    def request(self, next, request, _route):
+        if self.remaining <= 0:
+            return next()
+        if self.session_pattern and _route.pattern != self.session_pattern:
+            return next()
+        if self.session_sample_rate < 1.0 and random.random() >= self.session_sample_rate:
+            return next()
+        # only one profiler may be active at a time on newer Pythons
+        if not self._profile_lock.acquire(False):
+            return next()
+        try:
+            profiler = cProfile.Profile()
+            ret = profiler.runcall(next)
+        finally:
+            self._profile_lock.release()
+        self._add_profile(profiler)
+        return ret
+
+    def _add_profile(self, profiler):
+        with self._stats_lock:
+            if self.remaining <= 0:
+                return  # the session ended while this request ran
+            self.remaining -= 1
+            self.profiled_count += 1
+            if self.stats is None:
+                self.stats = Stats(profiler, stream=StringIO())
+            else:
+                self.stats.add(profiler)
+
+    def get_stats_text(self, sort_key='cumulative', limit=None):
+        """Returns the session's merged stats as pstats-formatted text,
+        sorted by one of the :data:`_sort_keys`."""
+        if sort_key not in _sort_keys:
+            raise KeyError('%s is not a supported sort_key. choose from: %r'
+                           % (sort_key, _sort_keys))
+        with self._stats_lock:
+            if self.stats is None:
+                return 'no requests profiled yet.\n'
+            buff = StringIO()
+            self.stats.stream = buff
+            self.stats.sort_stats(sort_key).print_stats(*([limit] if limit else []))
+        return buff.getvalue()
+
+    def get_stats_bytes(self):
+        """Returns the session's merged stats in the binary format written
+        by :meth:`pstats.Stats.dump_stats`, readable by
+        :class:`pstats.Stats` and tools like snakeviz."""
+        with self._stats_lock:
+            return marshal.dumps(self.stats.stats if self.stats else {})
+
+
+def _get_session_mw(_application):
+    try:
+        session_mw = [mw for mw in _application.middlewares
+                      if isinstance(mw, ProfileSessionMiddleware)][0]
+    except IndexError:
+        raise NotImplemented("ProfileSessionMiddleware not installed on app %r"
+                             % _application)
+    return session_mw
+
+
+def get_profile_session_summary(_application):
+    """Status of the current profiling session. POST to
+    /start?count=100&pattern=/path&sample_rate=1.0 to start a new
+    one, see merged stats at /stats?sort=cumulative&limit=100, and
+    download them from /download.prof for pstats or snakeviz."""
+    session_mw = _get_session_mw(_application)
+    start_time = session_mw.start_time
+    return {'active': session_mw.is_active,
+            'remaining': session_mw.remaining,
+            'profiled_count': session_mw.profiled_count,
+            'pattern': session_mw.session_pattern,
+            'sample_rate': session_mw.session_sample_rate,
+            'start_time': start_time and time.strftime('%Y-%m-%dT%H:%M:%S',
+                                                       time.gmtime(start_time)),
+            'sort_keys': _sort_keys}
+
+
+def start_profile_session(_application, request):
+    session_mw = _get_session_mw(_application)
+    session_mw.start(request_count=request.args.get('count', None, int),
+                     pattern=request.args.get('pattern'),
+                     sample_rate=request.args.get('sample_rate', None, float))
+    return get_profile_session_summary(_application)
+
+
+def stop_profile_session(_application):
+    _get_session_mw(_application).stop()
+    return get_profile_session_summary(_application)
+
+
+def reset_profile_session(_application):
+    _get_session_mw(_application).reset()
+    return get_profile_session_summary(_application)
+
+
+def get_profile_session_stats(_application, request):
+    session_mw = _get_session_mw(_application)
+    sort_key = request.args.get('sort', 'cumulative')
+    if sort_key not in _sort_keys:
+        raise BadRequest('%s is not a supported sort key. choose from: %s'
+                         % (sort_key, ', '.join(sorted(_sort_keys))))
+    limit = request.args.get('limit', None, int)
+    return Response(session_mw.get_stats_text(sort_key, limit),
+                    content_type='text/plain; charset=utf-8')
+
+
+def download_profile_session(_application):
+    session_mw = _get_session_mw(_application)
+    return Response(session_mw.get_stats_bytes(),
+                    content_type='application/octet-stream',
+                    headers={'Content-Disposition':
+                             'attachment; filename="clastic.prof"'})
+
+
+def create_profile_session_app():
+    # imported here because this module is imported by clastic.route
+    from ..route import POST
+    from ..render import render_basic
+    from ..application import Application
+
+    routes = [('/', get_profile_session_summary, render_basic),
+              ('/stats', get_profile_session_stats),
+              ('/download.prof', download_profile_session),
+              POST('/start', start_profile_session, render_basic),
+              POST('/stop', stop_profile_session, render_basic),
+              POST('/reset', reset_profile_session, render_basic)]
+    return Application(routes)
+
+
+class StackSampler(object):
+    """Periodically samples the call stacks of registered threads, from
+    a single background thread, aggregating them into collapsed stacks
+    (root-first frames joined by semicolons) grouped by a key, such
+    as a route pattern.
+
+    Sampling costs one :func:`sys._current_frames` call per
+    *interval* seconds while any thread is registered, and the
+    sampler thread sleeps otherwise. Stacks are truncated to their
+    innermost *max_depth* frames.
+    """
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._cond = threading.Condition()
+        self._active = {}  # thread ident -> (key, stop frame)
+        self._thread = LazyThread(self._run, 'clastic-stack-sampler')
+        self._labels = {}
+        self.reset()
+
+    def reset(self):
+        with self._cond:
+            self.stacks = defaultdict(lambda: defaultdict(int))
+
+    def start(self, key, stop_frame=None):
+        """Start sampling the calling thread, under *key*. Frames above and
+        including *stop_frame* are omitted from samples."""
+        with self._cond:
+            self._active[threading.get_ident()] = (key, stop_frame)
+            self._thread.ensure_started()
+            self._cond.notify()
+
+    def stop(self):
+        "Stop sampling the calling thread."
+        with self._cond:
+            self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._active:
+                    self._cond.wait()
+            time.sleep(self.interval)
+            self.take_sample()
+
+    def _get_label(self, frame):
+        code = frame.f_code
+        try:
+            return self._labels[code]
+        except KeyError:
+            module = frame.f_globals.get('__name__') or code.co_filename
+            label = ('%s:%s' % (module, code.co_name)).replace(';', ':')
+            self._labels[code] = label
+            return label
+
+    def take_sample(self):
+        frames = sys._current_frames()
+        with self._cond:
+            for ident, (key, stop_frame) in self._active.items():
+                frame = frames.get(ident)
+                labels = []
+                while frame is not None and frame is not stop_frame:
+                    labels.append(self._get_label(frame))
+                    frame = frame.f_back
+                if not labels:
+                    continue
+                stack = ';'.join(reversed(labels[:self.max_depth]))
+                self.stacks[key][stack] += 1
+        return
+
+    def get_sample_counts(self):
+        "Returns a dict mapping each key to its number of samples."
+        with self._cond:
+            return dict([(key, sum(key_stacks.values()))
+                         for key, key_stacks in self.stacks.items()])
+
+    def get_collapsed(self, key=None):
+        """Returns samples in the "collapsed" format read by `FlameGraph
+        <https://github.com/brendangregg/FlameGraph>`_ and `speedscope
+        <https://www.speedscope.app/>`_, one ``frame;frame;frame count``
+        line per unique stack. Without *key*, each stack is rooted at
+        its key, so that all keys fit in one graph.
+        """
+        with self._cond:
+            if key is not None:
+                items = [(stack, count) for stack, count
+                         in self.stacks.get(key, {}).items()]
+            else:
+                items = [('%s;%s' % (k, stack), count)
+                         for k, key_stacks in self.stacks.items()
+                         for stack, count in key_stacks.items()]
+        return ''.join(['%s %d\n' % (stack, count)
+                        for stack, count in sorted(items)])
+
+
+class SamplingProfileMiddleware(Middleware):
+    """A statistical profiler, cheap enough to leave installed in
+    production. While a request is being sampled, the stack of its
+    thread is recorded every *interval* seconds by a
+    :class:`StackSampler`, and the samples are aggregated by route
+    pattern.
+
+    A random *sample_rate* fraction of requests are sampled, along
+    with every request while the profiler is enabled, see
+    :meth:`enable`. Other requests only pay for a time check and a
+    random number. Serve the results with
+    :func:`create_sampling_profile_app`.
+    """
+    def __init__(self, sample_rate=0.0, interval=0.01, max_depth=64):
+        self.sample_rate = sample_rate
+        self.sampler = StackSampler(interval=interval, max_depth=max_depth)
+        self.enabled_until = 0.0
+
+    def enable(self, duration=60.0):
+        "Sample every request for the next *duration* seconds."
+        self.enabled_until = time.time() + duration
+
+    def disable(self):
+        self.enabled_until = 0.0
+
+    @property
+    def is_enabled(self):
+        return time.time() < self.enabled_until
+
+    def reset(self):
+        self.sampler.reset()
+
+    def request(self, next, request, _route):
+        if not (time.time() < self.enabled_until
+                or (self.sample_rate and random.random() < self.sample_rate)):
+            return next()
+        self.sampler.start(_route.pattern, sys._getframe())
+        try:
+            return next()
+        finally:
+            self.sampler.stop()
+
+
+def _get_sampling_mw(_application):
+    try:
+        sampling_mw = [mw for mw in _application.middlewares
+                       if isinstance(mw, SamplingProfileMiddleware)][0]
+    except IndexError:
+        raise NotImplemented("SamplingProfileMiddleware not installed on app %r"
+                             % _application)
+    return sampling_mw
+
+
+def get_sampling_summary(_application):
+    """Sample counts by route pattern. Download /collapsed for
+    flamegraph-compatible stacks (optionally filtered with
+    ?pattern=), and POST to /enable?seconds=60 to sample every
+    request for a while."""
+    sampling_mw = _get_sampling_mw(_application)
+    return {'enabled': sampling_mw.is_enabled,
+            'sample_rate': sampling_mw.sample_rate,
+            'interval': sampling_mw.sampler.interval,
+            'sample_counts': sampling_mw.sampler.get_sample_counts()}
+
+
+def get_collapsed_stacks(_application, request):
+    sampling_mw = _get_sampling_mw(_application)
+    pattern = request.args.get('pattern')
+    return Response(sampling_mw.sampler.get_collapsed(pattern),
+                    content_type='text/plain; charset=utf-8')
+
+
+def enable_sampling(_application, request):
+    sampling_mw = _get_sampling_mw(_application)
+    sampling_mw.enable(request.args.get('seconds', 60.0, float))
+    return get_sampling_summary(_application)
+
+
+def disable_sampling(_application):
+    _get_sampling_mw(_application).disable()
+    return get_sampling_summary(_application)
+
+
+def reset_sampling(_application):
+    _get_sampling_mw(_application).reset()
+    return get_sampling_summary(_application)
+
+
+def create_sampling_profile_app():
+    # imported here because this module is imported by clastic.route
+    from ..route import POST
+    from ..render import render_basic
+    from ..application import Application
+
+    routes = [('/', get_sampling_summary, render_basic),
+              ('/collapsed', get_collapsed_stacks),
+              POST('/enable', enable_sampling, render_basic),
+              POST('/disable', disable_sampling, render_basic),
+              POST('/reset', reset_sampling, render_basic)]
+    return Application(routes)
@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import os
+import math
+import mmap
 import time
+import struct
+import hashlib
 import random
 import datetime
+import itertools
+import threading
+import multiprocessing
+from time import perf_counter
+from array import array
 from collections import namedtuple, defaultdict
 
-from boltons.statsutils import Stats
 from boltons.iterutils import bucketize
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from werkzeug.wsgi import ClosingIterator
+from werkzeug.wrappers import Response
+
 from ..route import POST
 from ..application import Application
 from ..render import render_basic
@@ -84,7 +101,8 @@ class Reservoir(object):
 
 
 Hit = namedtuple('Hit', 'start_time url pattern status_code '
-                 ' duration content_type')
+                 ' duration content_type content_length',
+                 defaults=(None,))
 
 
 class RouteStatReservoir(Reservoir):
@@ -99,20 +117,804 @@ class RouteStatReservoir(Reservoir):
         self.total_duration += hit.duration
 
 
-class StatsMiddleware(Middleware):
+class LatencyHistogram(object):
+    """A fixed-memory histogram of durations (in seconds), or other
+    positive values, with logarithmically-sized buckets, in the style
+    of HDR histograms.
+
+    Quantiles are computed in O(buckets) time, with a relative error
+    bounded by *precision*, and histograms with the same layout can be
+    merged by adding their bucket counts. Values at or below
+    *min_value* share the first bucket, values above *max_value* the
+    last. The defaults (1% precision, 1us to 1 hour) use about 1,100
+    buckets, or 9KB.
+    """
+    def __init__(self, precision=0.01, min_value=1e-6, max_value=3600.0):
+        self.precision = precision
+        self.min_value = min_value
+        self.max_value = max_value
+        # each bucket is *growth* times wider than the last, such that
+        # its midpoint is within *precision* of any value in it
+        self._growth = 1 + 2.0 * precision
+        self._log_growth = math.log(self._growth)
+        self._log_min = math.log(min_value)
+        bucket_count = 2 + int(math.ceil(math.log(max_value / min_value)
+                                         / self._log_growth))
+        self.counts = array('Q', bytes(8 * bucket_count))
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = None
+        self.max = None
+
+    @property
+    def layout(self):
+        return (self.precision, self.min_value, self.max_value)
+
+    def _get_index(self, value):
+        if value <= self.min_value:
+            return 0
+        idx = 1 + int((math.log(value) - self._log_min) / self._log_growth)
+        return min(idx, len(self.counts) - 1)
+
+    def _get_bucket_value(self, idx):
+        if idx == 0:
+            return self.min_value
+        lower = self.min_value * self._growth ** (idx - 1)
+        return lower * (1 + self._growth) / 2
+
+    def add(self, value):
+        self.counts[self._get_index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def update(self, other):
+        "Merge the counts of *other*, which must have the same layout."
+        if other.layout != self.layout:
+            raise ValueError('cannot merge histograms with different layouts:'
+                             ' %r and %r' % (self.layout, other.layout))
+        counts = self.counts
+        for idx, val in enumerate(other.counts):
+            if val:
+                counts[idx] += val
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        for attr, func in (('min', min), ('max', max)):
+            vals = [v for v in (getattr(self, attr), getattr(other, attr))
+                    if v is not None]
+            setattr(self, attr, func(vals) if vals else None)
+
+    def copy(self):
+        ret = self.__class__.__new__(self.__class__)
+        ret.__dict__.update(self.__dict__)
+        ret.counts = array('Q', self.counts)
+        return ret
+
+    def clear(self):
+        self.counts = array('Q', bytes(8 * len(self.counts)))
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = None
+        self.max = None
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def std_dev(self):
+        if not self.count:
+            return 0.0
+        variance = self.total_sq / self.count - self.mean ** 2
+        return math.sqrt(max(variance, 0.0))
+
+    def _clamp(self, value):
+        return min(max(value, self.min), self.max)
+
+    def get_quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = max(q * self.count, 1)
+        cumulative = 0
+        for idx, val in enumerate(self.counts):
+            cumulative += val
+            if cumulative >= rank:
+                return self._clamp(self._get_bucket_value(idx))
+        return self.max
+
+    def get_mad(self):
+        "Approximate median absolute deviation."
+        if not self.count:
+            return 0.0
+        median = self.get_quantile(0.5)
+        dists = sorted([(abs(self._clamp(self._get_bucket_value(idx)) - median), val)
+                        for idx, val in enumerate(self.counts) if val])
+        rank, cumulative = self.count / 2.0, 0
+        for dist, val in dists:
+            cumulative += val
+            if cumulative >= rank:
+                return dist
+        return 0.0
+
+    def get_cumulative_counts(self, bounds):
+        """Returns a list of the number of values less than or equal to
+        each of the ascending *bounds*, as used by Prometheus-style
+        histograms, in O(buckets) time. Values are attributed by
+        their bucket, so counts are approximate near each bound.
+        """
+        ret = []
+        bounds = list(bounds)
+        bound_idx, cumulative = 0, 0
+        for idx, val in enumerate(self.counts):
+            bucket_value = self._get_bucket_value(idx)
+            while bound_idx < len(bounds) and bucket_value > bounds[bound_idx]:
+                ret.append(cumulative)
+                bound_idx += 1
+            cumulative += val
+        ret.extend([cumulative] * (len(bounds) - bound_idx))
+        return ret
+
+    def describe(self, quantiles=(0.25, 0.5, 0.75, 0.95, 0.99), scale=1.0):
+        """Returns a dict of summary statistics, with the same keys as
+        :meth:`boltons.statsutils.Stats.describe`. Values are multiplied
+        by *scale* (e.g., pass ``1000`` for milliseconds).
+        """
+        ret = {'count': self.count,
+               'mean': self.mean * scale,
+               'std_dev': self.std_dev * scale,
+               'mad': self.get_mad() * scale,
+               'min': (self.min or 0.0) * scale}
+        for q in quantiles:
+            ret[str(q)] = self.get_quantile(q) * scale
+        ret['max'] = (self.max or 0.0) * scale
+        return ret
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s count=%r, bucket_count=%r, precision=%r>'
+                % (cn, self.count, len(self.counts), self.precision))
+
+
+def _new_size_histogram():
+    # 1 byte to 4GB, ~230 buckets
+    return LatencyHistogram(precision=0.05, min_value=1, max_value=2 ** 32)
+
+
+class RouteStats(object):
+    """Fixed-memory statistics for one route and status, built from
+    :class:`Hit` records. *sizes* only counts responses with a known
+    content length, and is ``None`` for stats read from a
+    :class:`SharedStatsStore`."""
     def __init__(self):
+        self.last_hit = None
+        self.durations = LatencyHistogram()
+        self.sizes = _new_size_histogram()
+
+    @property
+    def total_count(self):
+        return self.durations.count
+
+    @property
+    def total_duration(self):
+        return self.durations.total
+
+    def add(self, hit):
+        self.durations.add(hit.duration)
+        if hit.content_length is not None:
+            self.sizes.add(hit.content_length)
+        if self.last_hit is None or hit.start_time > self.last_hit:
+            self.last_hit = hit.start_time
+
+    def copy(self):
+        ret = self.__class__.__new__(self.__class__)
+        ret.last_hit = self.last_hit
+        ret.durations = self.durations.copy()
+        ret.sizes = self.sizes.copy() if self.sizes is not None else None
+        return ret
+
+    @classmethod
+    def merge(cls, route_stats_list):
+        ret = cls()
+        for rs in route_stats_list:
+            ret.durations.update(rs.durations)
+            if rs.sizes is None:
+                ret.sizes = None
+            elif ret.sizes is not None:
+                ret.sizes.update(rs.sizes)
+            if rs.last_hit is not None and (ret.last_hit is None
+                                            or rs.last_hit > ret.last_hit):
+                ret.last_hit = rs.last_hit
+        return ret
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s total_count=%r, last_hit=%r>'
+                % (cn, self.total_count, self.last_hit))
+
+
+def new_route_hits():
+    """Returns an empty mapping of route (or pattern) to status to
+    :class:`RouteStats`, which are created on first access."""
+    return defaultdict(lambda: defaultdict(RouteStats))
+
+
+def is_error_status(status):
+    """Whether a :class:`Hit` status is an error: a 5xx code, or the
+    name of an exception raised instead of returning a response."""
+    # statuses are repr()'d codes, or exception type names
+    return not status.isdigit() or int(status) >= 500
+
+
+def _new_window_histogram():
+    # coarser than the main histograms, as there is one per interval:
+    # 10% precision, 100us to 100s, ~75 buckets
+    return LatencyHistogram(precision=0.1, min_value=1e-4, max_value=100.0)
+
+
+def _new_phase_histogram():
+    # phases are often only microseconds long:
+    # 5% precision, 100ns to 100s, ~220 buckets
+    return LatencyHistogram(precision=0.05, min_value=1e-7, max_value=100.0)
+
+
+def _sum_timings(timings):
+    "Sums (name, duration) pairs by name, keeping first-seen order."
+    ret = {}
+    for timing in timings or ():
+        name, duration = timing[0], timing[1]
+        ret[name] = ret.get(name, 0.0) + duration
+    return ret
+
+
+class WindowedRouteStats(object):
+    """Recent statistics for one route, in a ring buffer of intervals
+    *resolution* seconds long, covering the last *span* seconds.
+
+    Recording a hit is O(1), as an interval is only cleared when its
+    slot in the ring is reused. Histograms are allocated on first use.
+    """
+    def __init__(self, span=900, resolution=15):
+        self.span = span
+        self.resolution = resolution
+        self.slot_count = int(math.ceil(span / float(resolution))) + 1
+        self._epochs = [None] * self.slot_count
+        self._counts = array('Q', bytes(8 * self.slot_count))
+        self._errors = array('Q', bytes(8 * self.slot_count))
+        self._hists = [None] * self.slot_count
+
+    def add(self, hit, is_error=False):
+        epoch = int(hit.start_time // self.resolution)
+        pos = epoch % self.slot_count
+        hist = self._hists[pos]
+        if self._epochs[pos] != epoch:
+            self._epochs[pos] = epoch
+            self._counts[pos] = self._errors[pos] = 0
+            if hist is not None:
+                hist.clear()
+        if hist is None:
+            hist = self._hists[pos] = _new_window_histogram()
+        self._counts[pos] += 1
+        if is_error:
+            self._errors[pos] += 1
+        hist.add(hit.duration)
+
+    def get_window(self, seconds, now=None):
+        """Returns a ``(count, error_count, histogram, elapsed)`` tuple for
+        the intervals overlapping the last *seconds*, where *elapsed*
+        is the number of seconds those intervals cover so far.
+        """
+        now = time.time() if now is None else now
+        cur_epoch = int(now // self.resolution)
+        interval_count = min(int(math.ceil(seconds / float(self.resolution))),
+                             self.slot_count)
+        min_epoch = cur_epoch - interval_count + 1
+        count, errors, hist = 0, 0, _new_window_histogram()
+        for pos, epoch in enumerate(self._epochs):
+            if epoch is None or not (min_epoch <= epoch <= cur_epoch):
+                continue
+            count += self._counts[pos]
+            errors += self._errors[pos]
+            hist.update(self._hists[pos])
+        elapsed = ((interval_count - 1) * self.resolution
+                   + (now - cur_epoch * self.resolution))
+        return count, errors, hist, elapsed
+
+
+class _InFlightShard(object):
+    "Counts in-progress requests by route pattern."
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)
+
+    def incr(self, pattern, amount=1):
+        with self.lock:
+            self.counts[pattern] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts.items())
+
+
+class _StatsShard(object):
+    """One of several independently-locked partitions of
+    StatsMiddleware's data. Each thread is assigned a shard, so
+    concurrent requests rarely contend for the same lock."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.route_hits = new_route_hits()
+        self.phases = defaultdict(lambda: defaultdict(_new_phase_histogram))
+
+    def add(self, route, status, hit):
+        with self.lock:
+            self.route_hits[route][status].add(hit)
+
+    def add_phases(self, pattern, phase_durations):
+        with self.lock:
+            pattern_phases = self.phases[pattern]
+            for phase, duration in phase_durations.items():
+                pattern_phases[phase].add(duration)
+
+    def get_phases(self):
+        with self.lock:
+            return [(pattern, [(phase, hist.copy()) for phase, hist in ph.items()])
+                    for pattern, ph in self.phases.items()]
+
+    def snapshot(self):
+        with self.lock:
+            return [(rt, [(status, rs.copy()) for status, rs in rh.items()])
+                    for rt, rh in self.route_hits.items()]
+
+
+_SHM_MAGIC = struct.unpack('<Q', b'CLSTSTAT')[0]
+_SHM_VERSION = 1
+_SHM_HEADER_WORDS = 16
+_SHM_KEY_WORDS = 16  # 128 bytes of route pattern and status
+_SHM_SLOT_META_WORDS = 7
+# header word offsets
+(_H_MAGIC, _H_VERSION, _H_SLOT_COUNT, _H_USED_SLOTS, _H_BUCKET_COUNT,
+ _H_DROPPED, _H_PRECISION, _H_MIN_VALUE, _H_MAX_VALUE, _H_LAST_RESET) = range(10)
+# slot word offsets, after the key
+(_S_KEY_LEN, _S_COUNT, _S_TOTAL, _S_TOTAL_SQ,
+ _S_LAST_HIT, _S_MIN, _S_MAX) = range(_SHM_KEY_WORDS,
+                                      _SHM_KEY_WORDS + _SHM_SLOT_META_WORDS)
+
+
+class SharedStatsStore(object):
+    """Fixed-layout route statistics in a shared memory segment, so that
+    every process of a multi-process deployment records into, and
+    reports from, the same counters and histogram buckets.
+
+    Each route pattern and status pair is assigned one of *max_slots*
+    slots, holding a count, duration totals, and the buckets of a
+    :class:`LatencyHistogram`. Hits for pairs beyond *max_slots* are
+    counted as dropped.
+
+    Without a *path*, the segment is anonymous and is shared with
+    processes forked after the store is created, such as the workers
+    of the development server's ``processes`` option, or a
+    preforking server which loads the application first. With a
+    *path*, the segment is backed by that file, and any process
+    opening the same path shares the stats (requires ``fcntl``).
+
+    Args:
+
+      path (str): Optional path of the backing file.
+      max_slots (int): Maximum number of (pattern, status) pairs.
+        Defaults to ``256``.
+      precision (float): Relative precision of the latency
+        histograms. Defaults to ``0.05``, about 230 buckets each.
+    """
+    def __init__(self, path=None, max_slots=256, precision=0.05):
+        self.path = path
+        self._hist_layout = LatencyHistogram(precision=precision)
+        self.bucket_count = len(self._hist_layout.counts)
+        self.max_slots = max_slots
+        self._slot_words = (_SHM_KEY_WORDS + _SHM_SLOT_META_WORDS
+                            + self.bucket_count)
+        size = 8 * (_SHM_HEADER_WORDS + self._slot_words * max_slots)
+
+        self._slot_cache = {}
+        self._thread_lock = threading.Lock()
+        if path is None:
+            self._file = None
+            self._proc_lock = multiprocessing.Lock()
+            self._mmap = mmap.mmap(-1, size)
+        else:
+            if fcntl is None:
+                raise RuntimeError('file-backed SharedStatsStore requires fcntl')
+            self._proc_lock = None
+            self._file = open(path, 'a+b')
+            with _StoreLock(self):
+                if os.fstat(self._file.fileno()).st_size < size:
+                    self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._lock = _StoreLock(self)
+        self._words = memoryview(self._mmap).cast('Q')
+        self._floats = memoryview(self._mmap).cast('d')
+        with self._lock:
+            self._init_header()
+
+    def _init_header(self):
+        words, floats = self._words, self._floats
+        layout = self._hist_layout
+        if words[_H_MAGIC] == _SHM_MAGIC:
+            if (words[_H_VERSION] != _SHM_VERSION
+                or words[_H_SLOT_COUNT] != self.max_slots
+                or words[_H_BUCKET_COUNT] != self.bucket_count
+                or floats[_H_PRECISION] != layout.precision):
+                raise ValueError('existing shared stats at %r have an'
+                                 ' incompatible layout' % self.path)
+            return
+        words[_H_VERSION] = _SHM_VERSION
+        words[_H_SLOT_COUNT] = self.max_slots
+        words[_H_USED_SLOTS] = 0
+        words[_H_BUCKET_COUNT] = self.bucket_count
+        words[_H_DROPPED] = 0
+        floats[_H_PRECISION] = layout.precision
+        floats[_H_MIN_VALUE] = layout.min_value
+        floats[_H_MAX_VALUE] = layout.max_value
+        floats[_H_LAST_RESET] = time.time()
+        words[_H_MAGIC] = _SHM_MAGIC
+
+    @property
+    def last_reset(self):
+        return datetime.datetime.utcfromtimestamp(self._floats[_H_LAST_RESET])
+
+    @property
+    def dropped_count(self):
+        return self._words[_H_DROPPED]
+
+    def _slot_offset(self, slot_idx):
+        return _SHM_HEADER_WORDS + slot_idx * self._slot_words
+
+    def _read_key(self, base):
+        key_len = self._words[base + _S_KEY_LEN]
+        start = base * 8
+        return bytes(self._mmap[start:start + key_len])
+
+    @staticmethod
+    def _encode_key(pattern, status):
+        key = (pattern + '\x00' + status).encode('utf8')
+        if len(key) > _SHM_KEY_WORDS * 8:
+            # keep long keys unique, if not quite readable
+            digest = hashlib.sha1(key).hexdigest()[:16].encode('ascii')
+            key = key[:_SHM_KEY_WORDS * 8 - len(digest)] + digest
+        return key
+
+    def _find_slot(self, key):
+        "must be called with the lock held"
+        used = self._words[_H_USED_SLOTS]
+        for slot_idx in range(used):
+            if self._read_key(self._slot_offset(slot_idx)) == key:
+                return slot_idx
+        if used >= self.max_slots:
+            return None
+        base = self._slot_offset(used)
+        self._mmap[base * 8:base * 8 + len(key)] = key
+        self._words[base + _S_KEY_LEN] = len(key)
+        self._words[_H_USED_SLOTS] = used + 1
+        return used
+
+    def add(self, pattern, status, hit):
+        key = self._encode_key(pattern, status)
+        words, floats = self._words, self._floats
+        bucket_idx = self._hist_layout._get_index(hit.duration)
+        with self._lock:
+            slot_idx = self._slot_cache.get(key)
+            if slot_idx is None:
+                slot_idx = self._find_slot(key)
+                if slot_idx is None:
+                    words[_H_DROPPED] += 1
+                    return
+                self._slot_cache[key] = slot_idx
+            base = self._slot_offset(slot_idx)
+            count = words[base + _S_COUNT]
+            words[base + _S_COUNT] = count + 1
+            floats[base + _S_TOTAL] += hit.duration
+            floats[base + _S_TOTAL_SQ] += hit.duration * hit.duration
+            if hit.start_time > floats[base + _S_LAST_HIT]:
+                floats[base + _S_LAST_HIT] = hit.start_time
+            if not count or hit.duration < floats[base + _S_MIN]:
+                floats[base + _S_MIN] = hit.duration
+            if not count or hit.duration > floats[base + _S_MAX]:
+                floats[base + _S_MAX] = hit.duration
+            words[base + _SHM_KEY_WORDS + _SHM_SLOT_META_WORDS + bucket_idx] += 1
+
+    def get_pattern_stats(self):
+        """Returns a dict mapping each route pattern to a dict of status to
+        :class:`RouteStats`, aggregated across all processes.
+        """
+        ret = defaultdict(dict)
+        words, floats = self._words, self._floats
+        with self._lock:
+            for slot_idx in range(words[_H_USED_SLOTS]):
+                base = self._slot_offset(slot_idx)
+                count = words[base + _S_COUNT]
+                if not count:
+                    continue
+                key = self._read_key(base).decode('utf8', 'replace')
+                pattern, _, status = key.partition('\x00')
+                rs = RouteStats()
+                rs.sizes = None
+                hist = rs.durations = self._hist_layout.copy()
+                bucket_start = base + _SHM_KEY_WORDS + _SHM_SLOT_META_WORDS
+                hist.counts = array('Q', words[bucket_start:
+                                               bucket_start + self.bucket_count])
+                hist.count = count
+                hist.total = floats[base + _S_TOTAL]
+                hist.total_sq = floats[base + _S_TOTAL_SQ]
+                hist.min = floats[base + _S_MIN]
+                hist.max = floats[base + _S_MAX]
+                rs.last_hit = floats[base + _S_LAST_HIT]
+                ret[pattern][status] = rs
+        return dict(ret)
+
+    def reset(self):
+        "Zero all counters, keeping slot assignments."
+        words, floats = self._words, self._floats
+        with self._lock:
+            for slot_idx in range(words[_H_USED_SLOTS]):
+                base = self._slot_offset(slot_idx)
+                start = base + _S_COUNT
+                end = base + self._slot_words
+                words[start:end] = array('Q', bytes(8 * (end - start)))
+            words[_H_DROPPED] = 0
+            floats[_H_LAST_RESET] = time.time()
+
+    def close(self):
+        self._words.release()
+        self._floats.release()
+        self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s path=%r max_slots=%r used_slots=%r>'
+                % (cn, self.path, self.max_slots, self._words[_H_USED_SLOTS]))
+
+
+class _StoreLock(object):
+    """Excludes other threads and other processes. Anonymous stores use
+    a multiprocessing lock (shared across fork), file-backed stores
+    use POSIX record locks on the file, which are per-process, so a
+    thread lock is held as well."""
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        store = self.store
+        if store._proc_lock is not None:
+            store._proc_lock.acquire()
+        else:
+            store._thread_lock.acquire()
+            fcntl.lockf(store._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        store = self.store
+        if store._proc_lock is not None:
+            store._proc_lock.release()
+        else:
+            fcntl.lockf(store._file.fileno(), fcntl.LOCK_UN)
+            store._thread_lock.release()
+
+
+class StatsMiddleware(Middleware):
+    """Records the duration, status, and content type of every request,
+    grouped by route and status code.
+
+    Hits are recorded into one of *shard_count* independently-locked
+    shards, chosen per-thread, so that multithreaded servers can
+    record concurrently without racing or contending on a single
+    lock. Shards are merged when the stats are read, through
+    :attr:`route_hits`. Each shard has its own histograms for every
+    route and status, about 11KB each, so more shards trade memory
+    for less contention.
+
+    For multi-process servers, pass a :class:`SharedStatsStore` as
+    *shared_store*, and hits will instead be recorded there, where
+    every worker's stats endpoint can see them. Note that
+    :attr:`route_hits` only reflects the local shards, use
+    :meth:`get_pattern_stats` for the stats of either mode.
+
+    Recent request rates, error rates, and latencies are kept for each
+    of the *windows* (in seconds, by default 1, 5, and 15 minutes), in
+    intervals *window_resolution* seconds long. See
+    :meth:`get_window_stats`. These are always per-process, and not
+    sharded, as each route pattern's intervals take up to about 38KB,
+    but are locked per pattern. Pass an empty *windows* to disable.
+
+    With *phase_timing* enabled, each request's time is also broken
+    down into phases: ``routing``, each middleware function (e.g.,
+    ``StatsMiddleware.request``), ``endpoint``, ``render``, and
+    ``write``, the time from the response's return to the server
+    closing it. Middleware phases exclude time spent in ``next()``,
+    so the phases add up to the whole request. See
+    :meth:`get_phase_stats`. Phases are always per-process, and only
+    recorded for requests served through the Application's WSGI
+    interface. *server_timing* implies *phase_timing*, and adds a
+    `Server-Timing
+    <https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing>`_
+    header (excluding the write phase) to every response.
+    """
+    def __init__(self, shard_count=4, shared_store=None,
+                 windows=(60, 300, 900), window_resolution=15,
+                 phase_timing=False, server_timing=False):
+        self.shard_count = shard_count
+        self.shared_store = shared_store
+        self.windows = tuple(windows or ())
+        self.window_resolution = window_resolution
+        self.server_timing = server_timing
+        self.phase_timing = phase_timing or server_timing
+        if self.phase_timing:
+            # the write phase is only over once the server closes the
+            # response, outside the middleware chain
+            self.wsgi_wrapper = self._wrap_wsgi
+        self._local = threading.local()
+        self._shard_idx_iter = itertools.count()
+        # in-flight counts are not stats and are not reset
+        self._in_flight_shards = tuple([_InFlightShard()
+                                        for _ in range(shard_count)])
         self.reset()
 
     def reset(self):
-        self.route_hits = defaultdict(lambda: defaultdict(RouteStatReservoir))
-        self.last_reset = datetime.datetime.utcnow()
+        self._shards = tuple([_StatsShard() for _ in range(self.shard_count)])
+        # pattern -> (lock, WindowedRouteStats)
+        self._window_stats = {}
+        self._window_stats_lock = threading.Lock()
+        self._last_reset = datetime.datetime.utcnow()
+        if self.shared_store is not None:
+            self.shared_store.reset()
+
+    @property
+    def last_reset(self):
+        if self.shared_store is not None:
+            return self.shared_store.last_reset
+        return self._last_reset
+
+    def _get_shard_idx(self):
+        try:
+            return self._local.shard_idx
+        except AttributeError:
+            # next() on a count is atomic, so threads are assigned
+            # shards round-robin without locking
+            idx = self._local.shard_idx = (next(self._shard_idx_iter)
+                                           % self.shard_count)
+            return idx
 
-    def request(self, next, request, _route):
+    def _get_shard(self):
+        return self._shards[self._get_shard_idx()]
+
+    def _add_window_hit(self, pattern, hit, is_error):
+        try:
+            lock, window_stats = self._window_stats[pattern]
+        except KeyError:
+            with self._window_stats_lock:
+                if pattern not in self._window_stats:
+                    self._window_stats[pattern] = (
+                        threading.Lock(),
+                        WindowedRouteStats(max(self.windows), self.window_resolution))
+                lock, window_stats = self._window_stats[pattern]
+        with lock:
+            window_stats.add(hit, is_error)
+
+    def get_in_flight_counts(self):
+        "Returns a dict mapping route patterns to in-progress request counts."
+        ret = defaultdict(int)
+        for shard in self._in_flight_shards:
+            for pattern, count in shard.snapshot():
+                ret[pattern] += count
+        return dict(ret)
+
+    @property
+    def route_hits(self):
+        """A merged snapshot of hits from all shards, mapping each route to
+        a dict of status to :class:`RouteStats`."""
+        grouped = defaultdict(lambda: defaultdict(list))
+        for shard in self._shards:
+            for rt, status_stats in shard.snapshot():
+                for status, rs in status_stats:
+                    grouped[rt][status].append(rs)
+        ret = new_route_hits()
+        for rt, status_stats in grouped.items():
+            for status, rs_list in status_stats.items():
+                if len(rs_list) == 1:
+                    ret[rt][status] = rs_list[0]
+                else:
+                    ret[rt][status] = RouteStats.merge(rs_list)
+        return ret
+
+    def get_pattern_stats(self):
+        """Returns a dict mapping each route pattern to a dict of status to
+        :class:`RouteStats`. Routes sharing a pattern are merged."""
+        if self.shared_store is not None:
+            return self.shared_store.get_pattern_stats()
+        grouped = defaultdict(lambda: defaultdict(list))
+        for rt, rh in self.route_hits.items():
+            for status, rs in rh.items():
+                grouped[rt.pattern][status].append(rs)
+        ret = {}
+        for pattern, status_stats in grouped.items():
+            ret[pattern] = dict([(status, rs_list[0] if len(rs_list) == 1
+                                  else RouteStats.merge(rs_list))
+                                 for status, rs_list in status_stats.items()])
+        return ret
+
+    def get_window_stats(self, now=None):
+        """Returns a dict mapping each route pattern to a dict of window
+        length (in seconds) to a ``(count, error_count, histogram,
+        elapsed)`` tuple."""
+        if not self.windows:
+            return {}
+        now = time.time() if now is None else now
+        ret = {}
+        for pattern, (lock, window_stats) in list(self._window_stats.items()):
+            with lock:
+                ret[pattern] = dict([(sec, window_stats.get_window(sec, now))
+                                     for sec in self.windows])
+        return ret
+
+    def get_phase_stats(self):
+        """Returns a dict mapping each route pattern to a dict of phase name
+        to a :class:`LatencyHistogram` of that phase's durations,
+        merged across shards. Empty unless *phase_timing* is enabled."""
+        ret = {}
+        for shard in self._shards:
+            for pattern, phase_hists in shard.get_phases():
+                cur = ret.setdefault(pattern, {})
+                for phase, hist in phase_hists:
+                    if phase in cur:
+                        cur[phase].update(hist)
+                    else:
+                        cur[phase] = hist
+        return ret
+
+    def _wrap_wsgi(self, wsgi_app):
+        def phase_timed_app(environ, start_response):
+            app_iter = wsgi_app(environ, start_response)
+            phase_info = environ.pop(_PHASE_ENVIRON_KEY, None)
+            if phase_info is None:
+                return app_iter  # not routed through this middleware
+            pattern, dispatch_state = phase_info
+            shard = self._get_shard()
+            write_start = perf_counter()
+
+            def _record_phases():
+                dispatch_state.add_timing('write', perf_counter() - write_start)
+                shard.add_phases(pattern, _sum_timings(dispatch_state.timings))
+            return ClosingIterator(app_iter, _record_phases)
+        return phase_timed_app
+
+    def request(self, next, request, _route, _dispatch_state):
+        in_flight = self._in_flight_shards[self._get_shard_idx()]
+        in_flight.incr(_route.pattern)
         start_time = time.time()
+        resp_length = None
         try:
             resp = next()
             resp_status = repr(getattr(resp, 'status_code', resp.__class__.__name__))
-            resp_mime_type = resp.content_type.partition(';')[0]
+            # read headers directly, BaseResponses (e.g., HTTPExceptions)
+            # lack the content_type/content_length properties
+            resp_mime_type = resp.headers.get('Content-Type', '').partition(';')[0]
+            resp_length = resp.headers.get('Content-Length', None, int)
+            if resp_length is None and resp.is_sequence:
+                resp_length = resp.calculate_content_length()
+            if self.phase_timing:
+                request.environ[_PHASE_ENVIRON_KEY] = (_route.pattern,
+                                                       _dispatch_state)
+            if self.server_timing:
+                phase_durations = _sum_timings(_dispatch_state.timings)
+                resp.headers['Server-Timing'] = ', '.join(
+                    ['%s;dur=%.3f' % (phase, duration * 1000)
+                     for phase, duration in phase_durations.items()])
         except Exception as e:
             # see Werkzeug #388
             resp_status = repr(getattr(e, 'code', e.__class__.__name__))
@@ -120,31 +922,76 @@ class StatsMiddleware(Middleware):
             raise
         finally:
             end_time = time.time()
+            in_flight.incr(_route.pattern, -1)
             duration = end_time - start_time
             hit = Hit(start_time,
                       request.path,
                       _route.pattern,
                       resp_status,
                       duration,
-                      resp_mime_type)
-            self.route_hits[_route][resp_status].add(hit)
+                      resp_mime_type,
+                      resp_length)
+            if self.shared_store is not None:
+                self.shared_store.add(_route.pattern, resp_status, hit)
+            else:
+                self._get_shard().add(_route, resp_status, hit)
+            if self.windows:
+                self._add_window_hit(_route.pattern, hit,
+                                     is_error_status(resp_status))
         return resp
 
 
-def _get_route_stats(rt_hits):
+_PHASE_ENVIRON_KEY = 'clastic.stats.phase_timing'
+
+
+def get_route_stats_dict(rt_hits):
+    """Returns a JSON-serializable dict describing each status's
+    :class:`RouteStats` in *rt_hits*, with latencies in milliseconds,
+    as used by the stats app."""
     ret = {}
-    for status, hits in rt_hits.items():
+    for status, rs in rt_hits.items():
         ret[status] = cur = {}
-        durs = [round(h.duration * 1000, 2) for h in hits]
-        stats = Stats(durs, use_copy=False)
-        desc_dict = stats.describe(quantiles=[0.25, 0.5, 0.75, 0.95, 0.99], format="dict")
-        desc_dict['count'] = hits.total_count  # need to account for reservoir count
-        desc_dict['last_hit'] = datetime.datetime.fromtimestamp(hits.last_hit).isoformat()
-        desc_dict['total_duration'] = round(hits.total_duration * 1000, 2)
+        desc_dict = rs.durations.describe(quantiles=[0.25, 0.5, 0.75, 0.95, 0.99],
+                                          scale=1000)
+        desc_dict = dict([(k, round(v, 2)) for k, v in desc_dict.items()])
+        desc_dict['last_hit'] = datetime.datetime.fromtimestamp(rs.last_hit).isoformat()
+        desc_dict['total_duration'] = round(rs.total_duration * 1000, 2)
         cur.update(desc_dict)
     return ret
 
 
+def _get_window_label(seconds):
+    if seconds % 60:
+        return '%ss' % seconds
+    return '%sm' % (seconds // 60)
+
+
+def _get_window_stats(window_stats):
+    ret = {}
+    for sec, (count, errors, hist, elapsed) in sorted(window_stats.items()):
+        cur = ret[_get_window_label(sec)] = {}
+        cur['count'] = count
+        cur['rate'] = round(count / elapsed, 3) if elapsed else 0.0
+        cur['error_count'] = errors
+        cur['error_rate'] = round(errors / float(count), 4) if count else 0.0
+        for q in (0.5, 0.95, 0.99):
+            cur[str(q)] = round(hist.get_quantile(q) * 1000, 2)
+        cur['mean'] = round(hist.mean * 1000, 2)
+    return ret
+
+
+def _get_phase_stats(phase_hists):
+    ret = {}
+    for phase, hist in phase_hists.items():
+        ret[phase] = cur = {}
+        cur['count'] = hist.count
+        cur['mean'] = round(hist.mean * 1000, 3)
+        for q in (0.5, 0.95, 0.99):
+            cur[str(q)] = round(hist.get_quantile(q) * 1000, 3)
+        cur['total_duration'] = round(hist.total * 1000, 2)
+    return ret
+
+
 def _get_stats_mw(_application):
     try:
         stats_mw = [mw for mw in _application.middlewares
@@ -156,17 +1003,26 @@ def _get_stats_mw(_application):
 
 def get_stats_dict(_application):
     """This endpoint provides a summary view of endppoint performance,
-    broken down by URL pattern and status code or exception.
+    broken down by URL pattern and status code or exception. Recent
+    rates, error rates, and latencies appear under window_stats, and
+    per-phase timings, if enabled, under phase_stats.
 
     Add ?format=json to the URL to get machine-readable data.
     """
     stats_mw = _get_stats_mw(_application)
-    rt_hits = stats_mw.route_hits
+    pattern_stats = stats_mw.get_pattern_stats()
     utcnow = datetime.datetime.utcnow().isoformat()
-    return {'route_stats': dict([(rt.pattern, _get_route_stats(rh)) for rt, rh
-                                 in rt_hits.items() if rh]),
-            'start_time_utc': stats_mw.last_reset.isoformat(),
-            'cur_time_utc': utcnow}
+    window_stats = stats_mw.get_window_stats()
+    ret = {'route_stats': dict([(pattern, get_route_stats_dict(ps)) for pattern, ps
+                                in pattern_stats.items() if ps]),
+           'window_stats': dict([(pattern, _get_window_stats(ws)) for pattern, ws
+                                 in window_stats.items()]),
+           'start_time_utc': stats_mw.last_reset.isoformat(),
+           'cur_time_utc': utcnow}
+    if stats_mw.phase_timing:
+        ret['phase_stats'] = dict([(pattern, _get_phase_stats(ph)) for pattern, ph
+                                   in stats_mw.get_phase_stats().items()])
+    return ret
 
 
 def get_and_reset_stats_dict(_application):
@@ -177,8 +1033,88 @@ def get_and_reset_stats_dict(_application):
     return ret
 
 
+# Prometheus' default buckets
+DEFAULT_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25,
+                            0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+DEFAULT_SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+_METRICS_MIME = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape_label(value):
+    return (value.replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(labels):
+    return '{%s}' % ','.join(['%s="%s"' % (k, _escape_label(str(v)))
+                              for k, v in labels])
+
+
+def _add_histogram_lines(lines, name, labels, hist, bounds):
+    cumulative = hist.get_cumulative_counts(bounds)
+    for bound, count in zip(bounds, cumulative):
+        bucket_labels = labels + [('le', repr(float(bound)))]
+        lines.append('%s_bucket%s %d' % (name, _format_labels(bucket_labels),
+                                         count))
+    lines.append('%s_bucket%s %d' % (name, _format_labels(labels + [('le', '+Inf')]),
+                                     hist.count))
+    lines.append('%s_sum%s %r' % (name, _format_labels(labels), hist.total))
+    lines.append('%s_count%s %d' % (name, _format_labels(labels), hist.count))
+
+
+def get_metrics_text(stats_mw, prefix='clastic',
+                     duration_buckets=DEFAULT_DURATION_BUCKETS,
+                     size_buckets=DEFAULT_SIZE_BUCKETS):
+    """Renders the stats of *stats_mw* in the Prometheus text exposition
+    format. Work is proportional to the number of histogram buckets,
+    not the number of requests recorded.
+    """
+    pattern_stats = sorted(stats_mw.get_pattern_stats().items())
+    req_lines, dur_lines, size_lines = [], [], []
+    for pattern, status_stats in pattern_stats:
+        for status, rs in sorted(status_stats.items()):
+            labels = [('pattern', pattern), ('status', status.strip("'"))]
+            req_lines.append('%s_requests_total%s %d'
+                             % (prefix, _format_labels(labels), rs.total_count))
+            _add_histogram_lines(dur_lines, prefix + '_request_duration_seconds',
+                                 labels, rs.durations, duration_buckets)
+            if rs.sizes is not None:
+                _add_histogram_lines(size_lines, prefix + '_response_size_bytes',
+                                     labels, rs.sizes, size_buckets)
+    in_flight_lines = ['%s_requests_in_flight%s %d'
+                       % (prefix, _format_labels([('pattern', pattern)]), count)
+                       for pattern, count
+                       in sorted(stats_mw.get_in_flight_counts().items())]
+
+    lines = []
+    for name, mtype, help_text, metric_lines in [
+            ('requests_total', 'counter',
+             'Requests handled, by route pattern and status.', req_lines),
+            ('request_duration_seconds', 'histogram',
+             'Request duration, by route pattern and status.', dur_lines),
+            ('requests_in_flight', 'gauge',
+             'Requests in progress in this process, by route pattern.',
+             in_flight_lines),
+            ('response_size_bytes', 'histogram',
+             'Response content length, by route pattern and status.',
+             size_lines)]:
+        lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, mtype))
+        lines.extend(metric_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def get_stats_metrics(_application):
+    """Route stats in the Prometheus/OpenMetrics text format, suitable
+    for frequent scraping."""
+    stats_mw = _get_stats_mw(_application)
+    return Response(get_metrics_text(stats_mw), content_type=_METRICS_MIME)
+
+
 def create_stats_app():
     routes = [('/', get_stats_dict, render_basic),
+              ('/metrics', get_stats_metrics),
               POST('/reset', get_and_reset_stats_dict, render_basic)]
     app = Application(routes)
     return app
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""Request tracing, with `W3C Trace Context
+<https://www.w3.org/TR/trace-context/>`_ propagation and spans
+exported in the `OTLP <https://opentelemetry.io/docs/specs/otlp/>`_
+JSON format.
+
+:class:`TracingMiddleware` creates a span for each sampled request,
+and, optionally, child spans for routing, each middleware function,
+the endpoint, and the render. Finished spans are handed to a :class:`BatchSpanProcessor`,
+which exports them from a background thread to an exporter, such as
+:class:`InMemorySpanExporter` or :class:`FileSpanExporter`. Any object
+with an ``export(spans)`` method will do.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+from collections import deque
+from time import perf_counter
+
+from .._background import BatchQueue
+from .core import Middleware
+
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+_TRACEPARENT_RE = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+_INVALID_TRACE_ID = '0' * 32
+_INVALID_SPAN_ID = '0' * 16
+
+
+def _new_trace_id():
+    return '%032x' % random.getrandbits(128)
+
+
+def _new_span_id():
+    return '%016x' % random.getrandbits(64)
+
+
+def parse_traceparent(header):
+    """Parses a ``traceparent`` header value into a ``(trace_id,
+    parent_span_id, sampled)`` tuple, or returns ``None`` if it is
+    missing or invalid."""
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if not match:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == 'ff' or trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+class TraceContext(object):
+    """The trace state of a request, provided to endpoints and other
+    middlewares as ``trace_context``. Use :meth:`get_headers` to
+    propagate the trace to outgoing requests."""
+    __slots__ = ('trace_id', 'span_id', 'parent_span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, parent_span_id=None, sampled=False):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self):
+        return '00-%s-%s-%s' % (self.trace_id, self.span_id,
+                                '01' if self.sampled else '00')
+
+    def get_headers(self):
+        return {'traceparent': self.traceparent}
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return '<%s traceparent=%r>' % (cn, self.traceparent)
+
+
+class Span(object):
+    """A finished span. Times are in nanoseconds since the epoch."""
+    __slots__ = ('trace_id', 'span_id', 'parent_span_id', 'name', 'kind',
+                 'start_time', 'end_time', 'attributes', 'status_code')
+
+    def __init__(self, trace_id, span_id, parent_span_id, name, start_time,
+                 end_time, kind=SPAN_KIND_INTERNAL, attributes=None,
+                 status_code=STATUS_UNSET):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_time = start_time
+        self.end_time = end_time
+        self.attributes = attributes or {}
+        self.status_code = status_code
+
+    @property
+    def duration(self):
+        "The duration of the span, in seconds."
+        return (self.end_time - self.start_time) / 1e9
+
+    def to_otlp(self):
+        "Returns the span as a dict in the OTLP JSON encoding."
+        ret = {'traceId': self.trace_id,
+               'spanId': self.span_id,
+               'name': self.name,
+               'kind': self.kind,
+               # 64-bit ints are strings in the protobuf JSON mapping
+               'startTimeUnixNano': str(self.start_time),
+               'endTimeUnixNano': str(self.end_time),
+               'attributes': _to_otlp_attributes(self.attributes),
+               'status': {'code': self.status_code}}
+        if self.parent_span_id:
+            ret['parentSpanId'] = self.parent_span_id
+        return ret
+
+    def __repr__(self):
+        cn = self.__class__.__name__
+        return ('<%s name=%r trace_id=%r span_id=%r parent_span_id=%r>'
+                % (cn, self.name, self.trace_id, self.span_id, self.parent_span_id))
+
+
+def _to_otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    elif isinstance(value, int):
+        return {'intValue': str(value)}
+    elif isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _to_otlp_attributes(attributes):
+    return [{'key': k, 'value': _to_otlp_value(v)}
+            for k, v in sorted(attributes.items()) if v is not None]
+
+
+def spans_to_otlp(spans, service_name='clastic'):
+    """Returns *spans* as an OTLP ``ExportTraceServiceRequest`` dict,
+    suitable for JSON encoding and POSTing to a collector's
+    ``/v1/traces`` endpoint."""
+    resource = {'attributes': _to_otlp_attributes({'service.name': service_name})}
+    return {'resourceSpans': [{'resource': resource,
+                               'scopeSpans': [{'scope': {'name': 'clastic'},
+                                               'spans': [s.to_otlp() for s in spans]}]}]}
+
+
+class InMemorySpanExporter(object):
+    "Keeps the most recent *max_spans* exported spans, for tests and debugging."
+    def __init__(self, max_spans=10000):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+    def get_finished_spans(self):
+        return list(self.spans)
+
+    def clear(self):
+        self.spans.clear()
+
+
+class FileSpanExporter(object):
+    """Writes each batch of spans as one line of OTLP JSON to the file at
+    *path*, opened for appending, or *stream*."""
+    def __init__(self, path=None, stream=None, service_name='clastic'):
+        if path is not None and stream is not None:
+            raise TypeError('expected one of path or stream, not both')
+        if path is not None:
+            stream = open(path, 'a', encoding='utf-8')
+        self.stream = stream if stream is not None else sys.stderr
+        self.service_name = service_name
+
+    def export(self, spans):
+        otlp = spans_to_otlp(spans, service_name=self.service_name)
+        self.stream.write(json.dumps(otlp, sort_keys=True) + '\n')
+        self.stream.flush()
+
+
+class BatchSpanProcessor(object):
+    """Queues finished spans and exports them from a background thread,
+    in batches of up to *batch_size*, at least every *flush_interval*
+    seconds while spans are waiting. Spans which do not fit in the
+    *max_queue*-long queue are dropped and counted in
+    :attr:`dropped_count`, instead of making the request wait.
+    """
+    def __init__(self, exporter, batch_size=512, flush_interval=1.0,
+                 max_queue=4096):
+        self.exporter = exporter
+        self._queue = BatchQueue(exporter.export, 'clastic-span-exporter',
+                                 batch_size=batch_size,
+                                 flush_interval=flush_interval,
+                                 max_queue=max_queue)
+
+    @property
+    def dropped_count(self):
+        return self._queue.dropped_count
+
+    def on_end(self, spans):
+        for span in spans:
+            self._queue.put(span)
+
+    def flush(self):
+        "Blocks until every queued span has been exported."
+        self._queue.flush()
+
+
+class TracingMiddleware(Middleware):
+    """Traces a *sample_rate* fraction of requests, or, if the request
+    carries a valid ``traceparent`` header, follows the caller's
+    sampling decision (unless *respect_parent* is ``False``).
+
+    Each sampled request gets a server span, with attributes for the
+    method, path, route pattern, status, and request id. If
+    *layer_spans* is ``True``, routing, each middleware function, the
+    endpoint, and the render get child spans, too.
+    Install this middleware first, as layers outside of it are not
+    traced.
+
+    Spans are passed to *processor*, by default a
+    :class:`BatchSpanProcessor` around *exporter*, by default an
+    :class:`InMemorySpanExporter`. Every request is provided a
+    :class:`TraceContext` as ``trace_context``, sampled or not.
+
+    Unsampled requests pay for a random number and a
+    :class:`TraceContext`. *layer_spans* defaults to ``False``, as
+    every request, sampled or not, then pays for an extra function
+    call per layer, unless another middleware, such as
+    :class:`~clastic.middleware.stats.StatsMiddleware` with
+    *phase_timing*, needs timings anyway.
+    """
+    provides = ('trace_context',)
+
+    def __init__(self, sample_rate=1.0, exporter=None, processor=None,
+                 layer_spans=False, respect_parent=True):
+        self.sample_rate = sample_rate
+        if processor is None:
+            if exporter is None:
+                exporter = InMemorySpanExporter()
+            processor = BatchSpanProcessor(exporter)
+        self.exporter = exporter
+        self.processor = processor
+        self.layer_spans = layer_spans
+        self.phase_timing = layer_spans
+        self.respect_parent = respect_parent
+        self._route_needs_timings = {}
+
+    def _needs_timings(self, route):
+        # whether another of the route's middlewares needs the
+        # _dispatch_state timings, even if this request isn't traced
+        try:
+            return self._route_needs_timings[route]
+        except KeyError:
+            ret = any([getattr(mw, 'phase_timing', False)
+                       for mw in route.middlewares if mw is not self])
+            self._route_needs_timings[route] = ret
+            return ret
+
+    def request(self, next, request, _route, _dispatch_state):
+        parent = None
+        if self.respect_parent:
+            parent = parse_traceparent(request.headers.get('traceparent'))
+        if parent:
+            trace_id, parent_span_id, sampled = parent
+        else:
+            trace_id, parent_span_id = _new_trace_id(), None
+            sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        trace_context = TraceContext(trace_id, _new_span_id(), parent_span_id, sampled)
+        if not sampled:
+            if self.layer_spans and not self._needs_timings(_route):
+                _dispatch_state.timings = None
+            return next(trace_context=trace_context)
+
+        start_ns, start = time.time_ns(), perf_counter()
+        status_code, resp_status = STATUS_UNSET, None
+        try:
+            resp = next(trace_context=trace_context)
+            resp_status = getattr(resp, 'status_code', None)
+            if resp_status and resp_status >= 500:
+                status_code = STATUS_ERROR
+        except Exception as e:
+            resp_status = getattr(e, 'code', None)
+            status_code = STATUS_ERROR
+            raise
+        finally:
+            end = perf_counter()
+            self._end_trace(trace_context, request, _route, _dispatch_state,
+                            start_ns, start, end, resp_status, status_code)
+        return resp
+
+    def _end_trace(self, trace_context, request, route, dispatch_state,
+                   start_ns, start, end, resp_status, status_code):
+        def to_ns(perf_time):
+            return start_ns + int((perf_time - start) * 1e9)
+
+        trace_id, root_id = trace_context.trace_id, trace_context.span_id
+        timings = [t for t in dispatch_state.timings or ()
+                   if t[2] is not None]
+        root_start = min([start] + [t[2] for t in timings])
+        attributes = {'http.request.method': request.method,
+                      'url.path': request.path,
+                      'http.route': route.pattern,
+                      'http.response.status_code': resp_status,
+                      'clastic.request_id': getattr(request, 'request_id', None)}
+        spans = [Span(trace_id, root_id, trace_context.parent_span_id,
+                      '%s %s' % (request.method, route.pattern),
+                      to_ns(root_start), to_ns(end),
+                      kind=SPAN_KIND_SERVER, attributes=attributes,
+                      status_code=status_code)]
+        # timed layers nest, so each span's parent is the innermost
+        # enclosing span, found by walking them in start order
+        stack = []
+        for name, _, t_start, t_end in sorted(timings, key=lambda t: (t[2], -t[3])):
+            while stack and stack[-1][1] <= t_start:
+                stack.pop()
+            parent_id = stack[-1][0] if stack else root_id
+            span_id = _new_span_id()
+            spans.append(Span(trace_id, span_id, parent_id, name,
+                              to_ns(t_start), to_ns(t_end)))
+            stack.append((span_id, t_end))
+        self.processor.on_end(spans)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""A watchdog for stuck requests. :class:`SlowRequestMiddleware`
+tracks in-flight requests, and captures the stack of any request
+running longer than a threshold, while it is still running.
+"""
+
+import sys
+import time
+import datetime
+import threading
+import traceback
+from collections import namedtuple, deque
+
+from ..route import POST
+from ..application import Application
+from ..render import render_basic
+from ..errors import NotImplemented
+from .._background import LazyThread
+from .core import Middleware
+
+
+_InFlightRequest = namedtuple('_InFlightRequest', 'request_id path pattern start_time'
+                              ' thread_ident stop_frame')
+
+_SlowRequestReport = namedtuple('_SlowRequestReport', 'request_id path pattern start_time'
+                                ' duration thread_ident stack')
+
+
+class SlowRequestReport(_SlowRequestReport):
+    """A record of a request which exceeded the
+    :class:`SlowRequestMiddleware` threshold, with its thread's stack
+    at the time, as a list of formatted lines."""
+    __slots__ = ()
+
+    def format(self):
+        start = datetime.datetime.utcfromtimestamp(self.start_time).isoformat()
+        header = ('request %s (%s, route %s) running for %.3fs since %s,'
+                  ' in thread %s:\n' % (self.request_id, self.path, self.pattern,
+                                        self.duration, start, self.thread_ident))
+        return header + ''.join(self.stack)
+
+    def to_dict(self):
+        ret = self._asdict()
+        ret['start_time'] = datetime.datetime.utcfromtimestamp(self.start_time).isoformat()
+        return ret
+
+
+def _format_stack(frame, stop_frame=None):
+    # like traceback.format_stack(), but only up to the middleware
+    frames = []
+    while frame is not None and frame is not stop_frame:
+        frames.append((frame, frame.f_lineno))
+        frame = frame.f_back
+    return traceback.StackSummary.extract(reversed(frames)).format()
+
+
+class SlowRequestMiddleware(Middleware):
+    """Tracks in-flight requests, and, from a background thread which
+    checks every *check_interval* seconds, captures the stack of any
+    request which has been running for more than *threshold* seconds.
+    Requests are reported at most once.
+
+    The most recent *max_reports* reports are kept, see
+    :attr:`reports` and :func:`create_watchdog_app`. *on_report*, if
+    set, is called with each :class:`SlowRequestReport` as it is
+    captured, e.g., to log ``report.format()``.
+
+    Unlike :class:`~clastic.middleware.stats.StatsMiddleware`, which
+    only records requests once they complete, this middleware shows
+    where requests are stuck while they are stuck.
+    """
+    def __init__(self, threshold=10.0, check_interval=1.0,
+                 max_reports=100, on_report=None):
+        self.threshold = threshold
+        self.check_interval = check_interval
+        self.on_report = on_report
+        self.reports = deque(maxlen=max_reports)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._reported = set()
+        self._thread = LazyThread(self._run, 'clastic-watchdog')
+
+    def request(self, next, request, _route):
+        self._thread.ensure_started()
+        # this frame is unique for as long as the request is in flight
+        key = sys._getframe()
+        entry = _InFlightRequest(getattr(request, 'request_id', None),
+                                 request.path,
+                                 _route.pattern,
+                                 time.time(),
+                                 threading.get_ident(),
+                                 key)
+        with self._lock:
+            self._in_flight[key] = entry
+        try:
+            return next()
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                self._reported.discard(key)
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.check()
+
+    def check(self, now=None):
+        """Reports any in-flight requests which have exceeded the
+        threshold. Called periodically by the watchdog thread."""
+        now = time.time() if now is None else now
+        with self._lock:
+            slow = [(key, entry) for key, entry in self._in_flight.items()
+                    if key not in self._reported
+                    and now - entry.start_time > self.threshold]
+            self._reported.update([key for key, _ in slow])
+        if not slow:
+            return []
+        frames = sys._current_frames()
+        ret = []
+        for key, entry in slow:
+            frame = frames.get(entry.thread_ident)
+            stack = _format_stack(frame, entry.stop_frame) if frame else []
+            report = SlowRequestReport(entry.request_id,
+                                       entry.path,
+                                       entry.pattern,
+                                       entry.start_time,
+                                       now - entry.start_time,
+                                       entry.thread_ident,
+                                       stack)
+            self.reports.append(report)
+            if self.on_report is not None:
+                self.on_report(report)
+            ret.append(report)
+        return ret
+
+    def get_in_flight(self, now=None):
+        """Returns a list of dicts describing in-flight requests, longest
+        running first."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entries = list(self._in_flight.values())
+        entries.sort(key=lambda e: e.start_time)
+        return [{'request_id': e.request_id,
+                 'path': e.path,
+                 'pattern': e.pattern,
+                 'duration': round(now - e.start_time, 3),
+                 'thread_ident': e.thread_ident} for e in entries]
+
+
+def _get_watchdog_mw(_application):
+    try:
+        watchdog_mw = [mw for mw in _application.middlewares
+                       if isinstance(mw, SlowRequestMiddleware)][0]
+    except IndexError:
+        raise NotImplemented("SlowRequestMiddleware not installed on app %r"
+                             % _application)
+    return watchdog_mw
+
+
+def get_watchdog_dict(_application):
+    """In-flight requests, and the most recent requests which ran longer
+    than the watchdog threshold, with their stacks at the time,
+    most recent first."""
+    watchdog_mw = _get_watchdog_mw(_application)
+    return {'threshold': watchdog_mw.threshold,
+            'in_flight': watchdog_mw.get_in_flight(),
+            'slow_requests': [r.to_dict() for r in reversed(watchdog_mw.reports)]}
+
+
+def clear_watchdog_reports(_application):
+    watchdog_mw = _get_watchdog_mw(_application)
+    watchdog_mw.reports.clear()
+    return get_watchdog_dict(_application)
+
+
+def create_watchdog_app():
+    routes = [('/', get_watchdog_dict, render_basic),
+              POST('/clear', clear_watchdog_reports, render_basic)]
+    return Application(routes)
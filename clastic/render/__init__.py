@@ -5,15 +5,32 @@ from .simple import (BasicRender,
                      render_json,
                      render_json_dev,
                      render_basic)
-from .tabular import Table, TabularRender
+from .tabular import (Table,
+                      TabularRender,
+                      CSVRender,
+                      TSVRender,
+                      StreamingTableRender)
+from .binary import MsgpackRender, CBORRender
 
 
-import ashes
-from .ashes_templates import AshesRenderFactory
+def __getattr__(name):
+    # ashes is only imported once templates are used
+    if name == 'ashes':
+        import ashes
+        return ashes
+    elif name == 'AshesRenderFactory':
+        from .ashes_templates import AshesRenderFactory
+        return AshesRenderFactory
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
 __all__ = ('JSONRender',
            'JSONPRender',
+           'CSVRender',
+           'TSVRender',
+           'StreamingTableRender',
+           'MsgpackRender',
+           'CBORRender',
            'render_json',
            'render_json_dev',
            'render_basic',
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Binary serialization renders for service-to-service traffic.
+
+MessagePack support requires the `msgpack
+<https://pypi.org/project/msgpack/>`_ package, and CBOR support
+requires `cbor2 <https://pypi.org/project/cbor2/>`_. Both are
+optional; :data:`HAVE_MSGPACK` and :data:`HAVE_CBOR` indicate which
+are importable, and :class:`~clastic.render.BasicRender` only
+negotiates formats whose library is installed.
+"""
+
+import json
+import datetime
+
+from werkzeug.wrappers import Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+HAVE_MSGPACK = msgpack is not None
+HAVE_CBOR = cbor2 is not None
+
+MSGPACK_MIME = 'application/msgpack'
+CBOR_MIME = 'application/cbor'
+
+
+def _make_default_hook(dev_mode):
+    # reuse the JSON encoder's fallback conversions (mappings,
+    # iterables, to_dict(), isoformat(), etc.) so that all of
+    # Clastic's serialized formats agree on what a context looks
+    # like. (imported here because simple.py imports this module)
+    from .simple import ClasticJSONEncoder
+    return ClasticJSONEncoder(dev_mode=dev_mode).default
+
+
+class MsgpackRender(object):
+    """Serializes a context to `MessagePack <https://msgpack.org>`_.
+
+    Args:
+
+      dev_mode (bool): Fall back to ``repr()`` for otherwise
+        unserializable objects, instead of raising a
+        :exc:`TypeError`. Defaults to ``False``.
+    """
+    mimetype = MSGPACK_MIME
+
+    def __init__(self, dev_mode=False):
+        if msgpack is None:
+            raise ImportError('MsgpackRender requires the msgpack package.'
+                              ' run `pip install msgpack`.')
+        self.dev_mode = dev_mode
+        self._default = _make_default_hook(dev_mode)
+
+    def dumps(self, context):
+        return msgpack.packb(context, default=self._default,
+                             use_bin_type=True)
+
+    def __call__(self, context):
+        return Response([self.dumps(context)], mimetype=self.mimetype)
+
+
+class CBORRender(object):
+    """Serializes a context to `CBOR <https://cbor.io>`_ (RFC 8949).
+
+    Naive datetimes are assumed to be UTC, matching the rest of
+    Clastic's use of ``utcnow()``.
+
+    Args:
+
+      dev_mode (bool): Fall back to ``repr()`` for otherwise
+        unserializable objects, instead of raising a
+        :exc:`TypeError`. Defaults to ``False``.
+    """
+    mimetype = CBOR_MIME
+
+    def __init__(self, dev_mode=False):
+        if cbor2 is None:
+            raise ImportError('CBORRender requires the cbor2 package.'
+                              ' run `pip install cbor2`.')
+        self.dev_mode = dev_mode
+        self._default = _make_default_hook(dev_mode)
+
+    def _cbor_default(self, encoder, value):
+        encoder.encode(self._default(value))
+
+    def dumps(self, context):
+        return cbor2.dumps(context, default=self._cbor_default,
+                           timezone=datetime.timezone.utc)
+
+    def __call__(self, context):
+        return Response([self.dumps(context)], mimetype=self.mimetype)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def get_body_loaders():
+    """Returns a dict mapping request body MIME types to functions which
+    decode bytes of that type. JSON is always supported, MessagePack
+    and CBOR only when their libraries are installed.
+    """
+    ret = {'application/json': json.loads}
+    if msgpack is not None:
+        ret[MSGPACK_MIME] = _msgpack_loads
+        ret['application/x-msgpack'] = _msgpack_loads
+    if cbor2 is not None:
+        ret[CBOR_MIME] = cbor2.loads
+    return ret
@@ -7,7 +7,9 @@ from collections.abc import Mapping, Sized, Iterable
 
 from werkzeug.wrappers import Response
 
-from .tabular import TabularRender
+from ..sinter import get_arg_names
+from .tabular import TabularRender, StreamingTableRender, CSVRender, TSVRender
+from . import binary
 
 class ClasticJSONEncoder(JSONEncoder):
     def __init__(self, **kw):
@@ -80,7 +82,10 @@ class JSONPRender(JSONRender):
 class BasicRender(object):
     _default_mime = 'application/json'
     _format_mime_map = {'html': 'text/html',
-                        'json': 'application/json'}
+                        'json': 'application/json',
+                        'csv': 'text/csv',
+                        'tsv': 'text/tab-separated-values'}
+    _streaming_mimes = ('text/html', 'text/csv', 'text/tab-separated-values')
 
     def __init__(self, **kwargs):
         self.qp_name = kwargs.pop('qp_name', 'format')
@@ -96,6 +101,31 @@ class BasicRender(object):
             default_tabular = TabularRender(table_type=table_type)
 
         self.tabular_render = kwargs.pop('tabular_render', default_tabular)
+        # custom tabular renders may predate the request argument
+        self._tabular_takes_request = ('request' in
+                                       get_arg_names(self.tabular_render))
+        # iterators (e.g., generators) are streamed, not paged
+        self.streaming_table_render = kwargs.pop('streaming_table_render',
+                                                 StreamingTableRender())
+        self.csv_render = kwargs.pop('csv_render', CSVRender())
+        self.tsv_render = kwargs.pop('tsv_render', TSVRender())
+
+        # binary formats are only negotiated if their library is
+        # installed or an explicit render is passed in
+        default_msgpack = None
+        if binary.HAVE_MSGPACK:
+            default_msgpack = binary.MsgpackRender(dev_mode=self.dev_mode)
+        self.msgpack_render = kwargs.pop('msgpack_render', default_msgpack)
+        default_cbor = None
+        if binary.HAVE_CBOR:
+            default_cbor = binary.CBORRender(dev_mode=self.dev_mode)
+        self.cbor_render = kwargs.pop('cbor_render', default_cbor)
+
+        self._format_mime_map = dict(self._format_mime_map)
+        if self.msgpack_render is not None:
+            self._format_mime_map['msgpack'] = binary.MSGPACK_MIME
+        if self.cbor_render is not None:
+            self._format_mime_map['cbor'] = binary.CBOR_MIME
         if kwargs:
             raise TypeError('unexpected keyword arguments: %r' % kwargs)
 
@@ -112,13 +142,35 @@ class BasicRender(object):
                 return Response(context, mimetype="text/plain")
 
         # not serialized yet, time to guess what the requester wants
-        if not isinstance(context, Sized):
+        if not isinstance(context, Sized) and not isinstance(context, Iterable):
             return Response(str(context), mimetype="text/plain")
         return self._serialize_to_resp(context, request, _route)
 
     __call__ = render_response
 
     def _serialize_to_resp(self, context, request, _route):
+        resp_mime = self._get_resp_mime(request)
+        if not isinstance(context, Sized) and resp_mime not in self._streaming_mimes:
+            # only tabular formats consume iterators (e.g., generators)
+            return Response(str(context), mimetype="text/plain")
+
+        if resp_mime == 'application/json':
+            return self.json_render(context)
+        elif resp_mime == 'text/html':
+            if not isinstance(context, Sized):
+                return self.streaming_table_render(context)
+            return self._call_tabular_render(context, request, _route)
+        elif resp_mime == 'text/csv':
+            return self.csv_render(context)
+        elif resp_mime == 'text/tab-separated-values':
+            return self.tsv_render(context)
+        elif resp_mime == binary.MSGPACK_MIME:
+            return self.msgpack_render(context)
+        elif resp_mime == binary.CBOR_MIME:
+            return self.cbor_render(context)
+        return Response(str(context), mimetype="text/plain")
+
+    def _get_resp_mime(self, request):
         req_format = request.args.get(self.qp_name)  # explicit GET query param
         if req_format and req_format not in self._format_mime_map:
             # TODO: badrequest
@@ -130,12 +182,12 @@ class BasicRender(object):
             resp_mime = request.accept_mimetypes.best_match(self.mimetypes)
         if resp_mime not in self._mime_format_map:
             resp_mime = self._default_mime
+        return resp_mime
 
-        if resp_mime == 'application/json':
-            return self.json_render(context)
-        elif resp_mime == 'text/html':
-            return self.tabular_render(context, _route)
-        return Response(str(context), mimetype="text/plain")
+    def _call_tabular_render(self, context, request, _route):
+        if self._tabular_takes_request:
+            return self.tabular_render(context, _route, request=request)
+        return self.tabular_render(context, _route)
 
     @property
     def _mime_format_map(self):
@@ -2,11 +2,16 @@
 
 import os
 import re
+import csv
+import json
+import itertools
 from textwrap import dedent
+from urllib.parse import urlencode
+from collections.abc import Mapping, Sequence, Set, Iterable
 from html import escape as html_escape
 
 
-from boltons.tableutils import Table
+from boltons.tableutils import Table, UnsupportedData
 from boltons.urlutils import find_all_links
 from werkzeug.wrappers import Response
 
@@ -68,7 +73,61 @@ def linkify(text, default_scheme='https', schemes=()):
     return u''.join(ret)
 
 
+class _RawHTMLCell(object):
+    "a pre-rendered table cell, inserted into the table without escaping"
+    __slots__ = ('html',)
+
+    def __init__(self, html):
+        self.html = html
+
+
+def _is_container(value):
+    return (isinstance(value, (Mapping, Sequence, Set))
+            and not isinstance(value, (str, bytes)))
+
+
+def _make_cell_table_type(table_type):
+    # subclassing (instead of wrapping) keeps any customizations of
+    # get_cell_html and the _html_* attributes of a custom table_type
+    class CellTable(table_type):
+        @classmethod
+        def from_data(cls, data, *a, **kw):
+            if isinstance(data, _RawHTMLCell):
+                raise UnsupportedData('pre-rendered cell')
+            return super(CellTable, cls).from_data(data, *a, **kw)
+
+        def get_cell_html(self, value):
+            if isinstance(value, _RawHTMLCell):
+                return value.html
+            return super(CellTable, self).get_cell_html(value)
+
+    CellTable.__name__ = table_type.__name__
+    return CellTable
+
+
 class TabularRender(object):
+    """Renders a context as nested HTML tables, suitable for debugging
+    and browsing data with a web browser.
+
+    Args:
+
+      max_depth (int): How many levels of nested tables to render
+        before falling back to text. Defaults to ``4``.
+      orientation (str): One of ``'auto'``, ``'horizontal'``, or
+        ``'vertical'``.
+      max_rows (int): Maximum number of top-level rows (or mapping
+        items) rendered per page. Further rows are reachable with
+        pagination links. Defaults to ``1000``; ``None`` disables
+        pagination.
+      collapse_depth (int): If set, nested values this many levels
+        down are not rendered inline, but as links which render
+        just that value on demand, using a sub-request to the same
+        URL. Defaults to ``None``.
+      page_qp_name (str): The query parameter for the page number.
+        Defaults to ``'_page'``.
+      path_qp_name (str): The query parameter for the path of a
+        collapsed value. Defaults to ``'_path'``.
+    """
     default_table_type = Table
 
     _html_doctype = '<!doctype html>'
@@ -82,6 +141,11 @@ class TabularRender(object):
         self.enable_title = kwargs.pop('enable_title', True)
         self.table_type = kwargs.pop('table_type', self.default_table_type)
         self.with_metadata = kwargs.pop('with_metadata', True)
+        self.max_rows = kwargs.pop('max_rows', 1000)
+        self.collapse_depth = kwargs.pop('collapse_depth', None)
+        self.page_qp_name = kwargs.pop('page_qp_name', '_page')
+        self.path_qp_name = kwargs.pop('path_qp_name', '_path')
+        self._cell_table_type = _make_cell_table_type(self.table_type)
 
     def _html_format_ep(self, route):
         ctx_label, func_name, argstr = get_callable_labels(route.endpoint)
@@ -102,7 +166,154 @@ class TabularRender(object):
                  % (ctx_label, func_name, argstr, html_doc))
         return title
 
-    def context_to_response(self, context, _route=None):
+    def _get_href(self, base_args, path=None, page=None):
+        args = list(base_args)
+        if path:
+            args.append((self.path_qp_name, json.dumps(path)))
+        if page:
+            args.append((self.page_qp_name, str(page)))
+        return escape_html('?' + urlencode(args))
+
+    def _get_path(self, request):
+        # paths are only linked to, and so only accepted, when
+        # collapsing nested values
+        if request is None or self.collapse_depth is None:
+            return []
+        path_str = request.args.get(self.path_qp_name)
+        if not path_str:
+            return []
+        try:
+            path = json.loads(path_str)
+        except ValueError:
+            path = None
+        if not isinstance(path, list):
+            raise _bad_request('expected %s to be a JSON list, not %r'
+                               % (self.path_qp_name, path_str))
+        return path
+
+    @staticmethod
+    def _resolve_path(context, path):
+        # only keys and indexes are followed, as paths come from the
+        # client, and attributes would expose arbitrary internals
+        cur = context
+        for seg in path:
+            if isinstance(cur, Mapping):
+                if isinstance(seg, (str, int)) and seg in cur:
+                    cur = cur[seg]
+                    continue
+                for key in cur:
+                    if str(key) == str(seg):
+                        cur = cur[key]
+                        break
+                else:
+                    raise _bad_request('no key %r in path %r' % (seg, path))
+            elif isinstance(cur, Sequence) and not isinstance(cur, (str, bytes)):
+                try:
+                    cur = cur[int(seg)]
+                except (TypeError, ValueError, IndexError):
+                    raise _bad_request('no index %r in path %r' % (seg, path))
+            else:
+                raise _bad_request('no item %r in path %r' % (seg, path))
+        return cur
+
+    def _get_page(self, context, page):
+        """Returns a (page_data, total_count, has_next) tuple. Counts are
+        None when not cheaply available (i.e., for iterators).
+        """
+        max_rows = self.max_rows
+        start = (page - 1) * max_rows
+        if isinstance(context, Mapping):
+            total = len(context)
+            if total <= max_rows and page == 1:
+                return context, total, False
+            items = itertools.islice(context.items(), start, start + max_rows)
+            return dict(items), total, total > start + max_rows
+        elif isinstance(context, Sequence):
+            total = len(context)
+            if total <= max_rows and page == 1:
+                return context, total, False
+            return (context[start:start + max_rows], total,
+                    total > start + max_rows)
+        elif _is_container(context) or isinstance(context, (str, bytes)):
+            return context, None, False
+        elif isinstance(context, Iterable) and not isinstance(context, Table):
+            rows = list(itertools.islice(context, start, start + max_rows + 1))
+            return rows[:max_rows], None, len(rows) > max_rows
+        return context, None, False
+
+    def _render_cell(self, value, path, depth, base_args):
+        if not _is_container(value):
+            return value
+        if self.collapse_depth is not None and depth >= self.collapse_depth:
+            size = len(value)
+            label = '%s (%s item%s)' % (value.__class__.__name__,
+                                        size, '' if size == 1 else 's')
+            href = self._get_href(base_args, path=path)
+            return _RawHTMLCell('<a href="%s">%s</a>'
+                                % (href, escape_html(label)))
+        if depth != 1:
+            return self._prepare(value, path, depth, base_args)
+
+        # top-level cells get rendered separately
+        nested_depth = self.max_depth - 1
+        if nested_depth < 1:
+            return value
+        prepared = self._prepare(value, path, depth, base_args)
+        try:
+            table = self._cell_table_type.from_data(prepared,
+                                                    max_depth=nested_depth)
+        except UnsupportedData:
+            return value
+        return _RawHTMLCell(table.to_html(max_depth=nested_depth))
+
+    def _prepare(self, value, path, depth, base_args, is_root=False):
+        """Walks as much of *value* as will be displayed, collapsing and
+        pre-rendering nested cells. Rows of a top-level sequence are
+        considered to be on the same level as the sequence itself.
+        """
+        child_depth = depth + 1
+        if isinstance(value, Mapping):
+            return dict([(k, self._render_cell(v, path + [_path_key(k)],
+                                               child_depth, base_args))
+                         for k, v in value.items()])
+        elif isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+            if is_root:
+                return [self._prepare(v, path + [i], depth, base_args)
+                        if _is_container(v) else v
+                        for i, v in enumerate(value)]
+            return [self._render_cell(v, path + [i], child_depth, base_args)
+                    for i, v in enumerate(value)]
+        return value
+
+    def _html_format_nav(self, base_args, path, page, total, has_next):
+        parts = []
+        if path:
+            crumbs = ['<a href="%s">(root)</a>' % self._get_href(base_args)]
+            for i, seg in enumerate(path):
+                href = self._get_href(base_args, path=path[:i + 1])
+                crumbs.append('<a href="%s">%s</a>'
+                              % (href, escape_html(str(seg))))
+            parts.append('<p>' + ' / '.join(crumbs) + '</p>')
+        if page > 1 or has_next:
+            links = []
+            if page > 1:
+                links.append('<a href="%s">&laquo; prev</a>'
+                             % self._get_href(base_args, path, page - 1))
+            start = (page - 1) * self.max_rows
+            if total is None:
+                links.append('page %s' % page)
+            else:
+                links.append('rows %s-%s of %s'
+                             % (start + 1,
+                                min(start + self.max_rows, total), total))
+            if has_next:
+                links.append('<a href="%s">next &raquo;</a>'
+                             % self._get_href(base_args, path, page + 1))
+            parts.append('<p class="clastic-atr-pages">%s</p>'
+                         % ' | '.join(links))
+        return '\n'.join(parts)
+
+    def context_to_response(self, context, _route=None, request=None):
         content_parts = [self._html_wrapper]
         if self._html_style_content:
             content_parts.extend(['<head><style type="text/css">',
@@ -117,8 +328,23 @@ class TabularRender(object):
         if isinstance(context, self.table_type):
             table = context
         else:
-            table = self.table_type.from_data(context,
-                                              max_depth=self.max_depth)
+            path, page, base_args = self._get_path(request), 1, []
+            if request is not None:
+                page = max(request.args.get(self.page_qp_name, 1, int), 1)
+                base_args = [(k, v) for k, v in request.args.items(multi=True)
+                             if k not in (self.page_qp_name,
+                                          self.path_qp_name)]
+            context = self._resolve_path(context, path)
+            total, has_next = None, False
+            if self.max_rows:
+                context, total, has_next = self._get_page(context, page)
+            nav = self._html_format_nav(base_args, path, page,
+                                        total, has_next)
+            if nav:
+                content_parts.append(nav)
+            context = self._prepare(context, path, 0, base_args, is_root=True)
+            table = self._cell_table_type.from_data(context,
+                                                    max_depth=self.max_depth)
         table._html_table_tag = self._html_table_tag
         content = table.to_html(max_depth=self.max_depth,
                                 orientation=self.orientation,
@@ -129,3 +355,173 @@ class TabularRender(object):
         return Response('\n'.join(content_parts), mimetype='text/html')
 
     __call__ = context_to_response
+
+
+def _bad_request(detail):
+    # clastic.errors imports the render package, hence the late import
+    from ..errors import BadRequest
+    return BadRequest(detail)
+
+
+def _path_key(key):
+    # keep path segments JSON-friendly for the path query parameter
+    if isinstance(key, (str, int)) and not isinstance(key, bool):
+        return key
+    return str(key)
+
+
+def iter_table_rows(context, headers=None):
+    """Returns a ``(headers, row_iter)`` pair for *context* without
+    materializing it, so that generators of arbitrary length can be
+    rendered in constant memory. Supports boltons :class:`Table`
+    instances, single mappings, and iterables of mappings, sequences,
+    or scalar values. Only the first row is examined to infer
+    *headers*, if they are not passed explicitly, but rows of other
+    types are still rendered.
+    """
+    if isinstance(context, Table):
+        return list(headers or context.headers or []), iter(context)
+    if isinstance(context, Mapping):
+        context = [context]
+    if isinstance(context, (str, bytes)) or not isinstance(context, Iterable):
+        raise TypeError('expected tabular data (an iterable of rows),'
+                        ' not %r' % type(context))
+    row_iter = iter(context)
+    try:
+        first = next(row_iter)
+    except StopIteration:
+        return list(headers or []), iter(())
+    row_iter = itertools.chain([first], row_iter)
+
+    if isinstance(first, Mapping):
+        headers = list(headers or first.keys())
+    elif isinstance(first, (str, bytes)) or not isinstance(first, Iterable):
+        headers = list(headers or ['value'])
+    else:
+        headers = list(headers or [])
+    return headers, (_get_row_cells(row, headers) for row in row_iter)
+
+
+def _get_row_cells(row, headers):
+    # decided per row, as a stream with mixed row types shouldn't
+    # fail partway through, after the headers have been sent
+    if isinstance(row, Mapping):
+        if headers:
+            return [row.get(h) for h in headers]
+        return list(row.values())
+    elif isinstance(row, (str, bytes)) or not isinstance(row, Iterable):
+        return [row]
+    return row
+
+
+class _LineBuffer(object):
+    "a file-like object for csv.writer, holding only the last row written"
+    def __init__(self):
+        self.value = ''
+
+    def write(self, text):
+        self.value = text
+
+
+class DelimitedRender(object):
+    """Streams a tabular context as delimiter-separated values, one row
+    at a time. Rows are produced by :func:`iter_table_rows`, so
+    generators are consumed lazily and never fully held in memory.
+
+    Args:
+
+      headers (list): Optional list of column names. Inferred from
+        the first row if not provided.
+      with_headers (bool): Whether to emit a header row. Defaults to
+        ``True``.
+      filename (str): If set, adds a ``Content-Disposition`` header
+        so browsers download the response as a file.
+      encoding (str): Defaults to ``'utf-8'``.
+    """
+    mimetype = 'text/csv'
+    dialect = 'excel'
+
+    def __init__(self, headers=None, with_headers=True,
+                 filename=None, encoding='utf-8'):
+        self.headers = headers
+        self.with_headers = with_headers
+        self.filename = filename
+        self.encoding = encoding
+
+    def iter_lines(self, context):
+        headers, row_iter = iter_table_rows(context, self.headers)
+        buff = _LineBuffer()
+        writer = csv.writer(buff, dialect=self.dialect)
+        if self.with_headers and headers:
+            writer.writerow(headers)
+            yield buff.value.encode(self.encoding)
+        for row in row_iter:
+            writer.writerow(row)
+            yield buff.value.encode(self.encoding)
+
+    def __call__(self, context):
+        resp = Response(self.iter_lines(context), mimetype=self.mimetype)
+        resp.mimetype_params['charset'] = self.encoding
+        if self.filename:
+            resp.headers['Content-Disposition'] = ('attachment; filename="%s"'
+                                                   % self.filename)
+        return resp
+
+
+class CSVRender(DelimitedRender):
+    mimetype = 'text/csv'
+    dialect = 'excel'
+
+
+class TSVRender(DelimitedRender):
+    mimetype = 'text/tab-separated-values'
+    dialect = 'excel-tab'
+
+
+class StreamingTableRender(object):
+    """Streams a flat HTML table row by row, in constant memory. Unlike
+    :class:`TabularRender`, nested values are not expanded into
+    sub-tables, they are simply converted to text.
+
+    Args:
+
+      headers (list): Optional list of column names. Inferred from
+        the first row if not provided.
+      encoding (str): Defaults to ``'utf-8'``.
+    """
+    _html_table_tag = TabularRender._html_table_tag
+    _html_style_content = _STYLE_CONTENT
+
+    def __init__(self, headers=None, encoding='utf-8'):
+        self.headers = headers
+        self.encoding = encoding
+
+    def _cell_html(self, value, tag='td'):
+        if value is None:
+            value = ''
+        return '<%s>%s</%s>' % (tag, escape_html(str(value)), tag)
+
+    def iter_html(self, context):
+        headers, row_iter = iter_table_rows(context, self.headers)
+        head = ['<!doctype html><html>']
+        if self._html_style_content:
+            head.extend(['<head><style type="text/css">',
+                         self._html_style_content,
+                         '</style></head>'])
+        head.extend(['<body>', self._html_table_tag])
+        if headers:
+            head.append('<thead><tr>')
+            head.extend([self._cell_html(h, 'th') for h in headers])
+            head.append('</tr></thead>')
+        head.append('<tbody>\n')
+        yield ''.join(head)
+        for row in row_iter:
+            yield '<tr>%s</tr>\n' % ''.join([self._cell_html(v) for v in row])
+        yield '</tbody></table></body></html>'
+
+    def __call__(self, context):
+        body_iter = (part.encode(self.encoding)
+                     for part in self.iter_html(context))
+        resp = Response(body_iter, mimetype='text/html')
+        resp.mimetype_params['charset'] = self.encoding
+        return resp
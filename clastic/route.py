@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import re
+import types
+import threading
 
 from boltons.iterutils import first
+from boltons.cacheutils import LRU
 
-from .sinter import inject, get_arg_names, get_fb, get_callable_name
+from .sinter import inject, make_injector, get_arg_names, get_fb, get_callable_name
 from .middleware import (check_middlewares,
                          merge_middlewares,
-                         make_middleware_chain)
+                         make_middleware_chain,
+                         check_middleware_chain)
 
 
 _REQUEST_BUILTINS = ('request', '_application', '_route', '_dispatch_state')
@@ -99,7 +103,21 @@ def build_converter(converter, optional=False, multi=False):
     return single_converter
 
 
+# (pattern, slash mode) -> (regex, converter map)
+_PATH_PATTERN_CACHE = LRU(max_size=4096)
+
+
 def _compile_path_pattern(pattern, mode=S_REWRITE):
+    # nested applications rebind the same patterns at every level
+    try:
+        regex, converters = _PATH_PATTERN_CACHE[(pattern, mode)]
+    except KeyError:
+        regex, converters = _PATH_PATTERN_CACHE[(pattern, mode)] = \
+            _compile_path_pattern_uncached(pattern, mode)
+    return regex, dict(converters)
+
+
+def _compile_path_pattern_uncached(pattern, mode=S_REWRITE):
     processed = []
     var_converter_map = {}
 
@@ -165,6 +183,19 @@ def normalize_path(path, is_branch):
     return '/'.join(ret)
 
 
+_UNSET = object()
+
+# see BoundRoute.compile
+_COMPILE_LOCK = threading.Lock()
+
+
+def _identity_key(obj):
+    # bound methods are created anew on each attribute access
+    if isinstance(obj, types.MethodType):
+        return (id(obj.__self__), id(obj.__func__))
+    return id(obj)
+
+
 def _noop_render(context):
     return context
 
@@ -246,9 +277,49 @@ class BoundRoute(object):
         check_middlewares(self.middlewares, src_provides_map)
         provided = set.union(*src_provides_map.values())
 
-        self._execute = make_middleware_chain(self.middlewares, unbound_route.endpoint, render, provided)
-
-        self._required_args = self._resolve_required_args()
+        timed = any([getattr(mw, 'phase_timing', False) for mw in self.middlewares])
+        # the chain and requirements only depend on these, so
+        # identical routes (e.g., from nested SubApplications) share
+        # compiled code. the cache lives on the app being bound to,
+        # so it's freed along with the app.
+        self._chain_key = chain_key = (_identity_key(unbound_route.endpoint),
+                                       _identity_key(render),
+                                       tuple([id(mw) for mw in self.middlewares]),
+                                       frozenset(provided),
+                                       timed)
+        chain_cache = getattr(app, '_chain_cache', None)
+        if chain_cache is None:
+            chain_cache = {}
+        self._lazy_chain = None
+        if getattr(route, '_chain_key', None) == chain_key and route._execute is not None:
+            # rebinding without changes, e.g., to an embedding app
+            self._execute, self._required_args = route._execute, route._required_args
+        elif chain_key in chain_cache:
+            self._execute, self._required_args, _ = chain_cache[chain_key]
+        else:
+            if getattr(app, 'lazy_compile', False) or isinstance(route, BoundRoute):
+                # validate now, generate code on first dispatch. routes
+                # rebound from embedded apps are always deferred, as
+                # the intermediate bindings may never be dispatched to.
+                check_middleware_chain(self.middlewares, unbound_route.endpoint,
+                                       render, provided)
+                self._execute = None
+                self._lazy_chain = (chain_cache, provided, timed)
+            else:
+                self._execute = make_middleware_chain(self.middlewares, unbound_route.endpoint,
+                                                      render, provided, timed=timed)
+            self._required_args = self._resolve_required_args()
+            if self._execute is not None:
+                # the last item keeps the keyed objects, and their ids, alive
+                chain_cache[chain_key] = (self._execute, self._required_args,
+                                          (unbound_route.endpoint, render, self.middlewares))
+
+        # precompiled alternatives to inject() for the request path,
+        # created on first use, as routes of embedded applications
+        # may only ever be executed through the embedding application
+        self._injector_sources = (self.resources, {'_route': self, '_application': app})
+        self._execute_injector = _UNSET
+        self._render_error_injector = _UNSET
 
     def bind(self, app, **kwargs):
         return BoundRoute(self, app, **kwargs)
@@ -347,7 +418,48 @@ class BoundRoute(object):
     def is_required_arg(self, arg_name):
         return arg_name in self._required_args
 
+    def compile(self):
+        """Generates this route's middleware chain and injector code, if
+        not already done. Called on the route's first dispatch, and
+        by :meth:`Application.compile_all`. Thread-safe.
+        """
+        if self._execute_injector is not _UNSET:
+            return
+        with _COMPILE_LOCK:
+            if self._execute_injector is not _UNSET:
+                return  # another thread got here first
+            if self._execute is None:
+                self._execute = self._compile_lazy_chain()
+            if self._render_error_injector is _UNSET and callable(self.render_error):
+                self._render_error_injector = make_injector(
+                    self.render_error, ('request', '_error'), self._injector_sources,
+                    name='execute_error')
+            # set last, as it marks the route compiled
+            self._execute_injector = make_injector(
+                self._execute, ('request',), self._injector_sources, name='execute')
+        return
+
+    def _compile_lazy_chain(self):
+        chain_cache, provided, timed = self._lazy_chain
+        try:
+            # an identical route may have been compiled since
+            execute = chain_cache[self._chain_key][0]
+        except KeyError:
+            execute = make_middleware_chain(self.middlewares, self.unbound_route.endpoint,
+                                            self.render, provided, timed=timed)
+            chain_cache[self._chain_key] = (execute, self._required_args,
+                                            (self.unbound_route.endpoint, self.render,
+                                             self.middlewares))
+        self._lazy_chain = None
+        return execute
+
     def execute(self, request, **kwargs):
+        injector = self._execute_injector
+        if injector is _UNSET:
+            self.compile()
+            injector = self._execute_injector
+        if injector is not None:
+            return injector(request, kwargs)
         injectables = {'_route': self,
                        'request': request,
                        '_application': self.bound_apps[-1]}
@@ -358,6 +470,13 @@ class BoundRoute(object):
     def execute_error(self, request, _error, **kwargs):
         if not callable(self.render_error):
             raise TypeError('render_error not set or not callable')
+        injector = self._render_error_injector
+        if injector is _UNSET:
+            injector = self._render_error_injector = make_injector(
+                self.render_error, ('request', '_error'), self._injector_sources,
+                name='execute_error')
+        if injector is not None:
+            return injector(request, _error, kwargs)
         injectables = {'_route': self,
                        '_error': _error,
                        'request': request,
@@ -3,19 +3,28 @@
 from collections import deque
 import os
 import sys
+import site
+import time
+import errno
+import runpy
 import socket
 import signal
+import sysconfig
+import traceback
 import subprocess
 from itertools import chain
 from ast import literal_eval
 
 import _thread as thread
 
-from ._werkzeug_serving import reloader_loop, make_server
+from . import _inotify
+from ._werkzeug_serving import _reloader_stat_loop, make_server
 
 
 _MON_PREFIX = '__clastic_mon_files:'
 _STDERR_BUFF_SIZE = 1024
+_RELOAD_DEBOUNCE = 0.1
+_MAX_DEBOUNCE_WAIT = 1.0
 
 
 def open_test_socket(host, port, raise_exc=True):
@@ -67,7 +76,7 @@ def enable_tty_echo(tty=None):
 
 def iter_monitor_files():
     unique_files = set()
-    for module in sys.modules.values():
+    for module in list(sys.modules.values()):
         filename = getattr(module, '__file__', None)
         if filename:
             old = None
@@ -84,26 +93,200 @@ def iter_monitor_files():
                     yield filename
 
 
-def restart_with_reloader(error_func=None):
-    to_mon = []
-    while 1:
-        print(' * Clastic restarting with reloader')
-        args = [sys.executable]
+def wait_for_change(extra_files=None, interval=1, debounce=_RELOAD_DEBOUNCE):
+    """Blocks until a monitored file changes, using inotify, and returns
+    its path. Monitored files are those from
+    :func:`iter_monitor_files`, plus *extra_files*.
+
+    Their directories are watched, rather than the files themselves,
+    so that files replaced by editors, and new Python files, are
+    caught. Newly-imported modules are added every *interval*
+    seconds. After a change, events are read until none arrive for
+    *debounce* seconds, so that bursts of changes, e.g., from a
+    checkout, cause a single reload.
+
+    Raises :exc:`OSError` if inotify is unavailable, or a directory
+    can't be watched, e.g., because the user's watch limit is reached.
+    """
+    notifier = _inotify.Inotify()
+    try:
+        changed, module_count, monitored = None, None, set()
+        while changed is None:
+            if module_count != len(sys.modules):
+                # only rescan (and stat) modules when more are imported
+                module_count = len(sys.modules)
+                monitored = set([os.path.abspath(f) for f in
+                                 chain(iter_monitor_files(), extra_files or ())])
+            for dir_path in set([os.path.dirname(f) for f in monitored]):
+                if notifier.is_watched(dir_path):
+                    continue
+                try:
+                    notifier.add_watch(dir_path)
+                except OSError as ose:
+                    if ose.errno != errno.ENOENT:
+                        raise
+            for path, _ in notifier.read_events(interval):
+                if path is None:
+                    changed = '(lost events)'  # inotify queue overflowed
+                    break
+                if path in monitored or path.endswith('.py'):
+                    changed = path
+                    break
+        deadline = time.time() + _MAX_DEBOUNCE_WAIT
+        while notifier.read_events(debounce) and time.time() < deadline:
+            pass
+    finally:
+        notifier.close()
+    return changed
+
+
+def reloader_loop(extra_files=None, interval=1):
+    """Exits with code 3, which tells :func:`restart_with_reloader` to
+    restart the server, once a monitored file changes. Uses inotify,
+    via :func:`wait_for_change`, where available, and otherwise polls
+    the files' modification times every *interval* seconds.
+    """
+    if _inotify.is_available():
+        try:
+            changed = wait_for_change(extra_files, interval)
+        except OSError:
+            pass  # fall back to polling
+        else:
+            print(' * Detected change in %r, reloading' % changed)
+            sys.exit(3)
+    _reloader_stat_loop(extra_files, interval)
+
+
+def _get_reloader_args():
+    args = [sys.executable]
+    path, basename = os.path.split(sys.argv[0])
+    if basename == '__main__.py':
+        pkg_name = os.path.basename(path)
+        args.extend(['-m', pkg_name] + sys.argv[1:])
+    else:
+        args.extend(sys.argv)
+    return args
+
+
+def _spawn_reloader_child():
+    new_environ = os.environ.copy()
+    new_environ['WERKZEUG_RUN_MAIN'] = 'true'
+    if os.name == 'nt':  # pragma: no cover
+        for key, value in new_environ.items():
+            if isinstance(value, str):
+                new_environ[key] = value.encode('iso-8859-1')
+    return subprocess.Popen(_get_reloader_args(),
+                            env=new_environ,
+                            stderr=subprocess.PIPE)
+
+
+def _get_library_paths():
+    paths = set(site.getsitepackages() + [site.getusersitepackages()])
+    sc_paths = sysconfig.get_paths()
+    paths.update([sc_paths.get(key) for key in
+                  ('stdlib', 'platstdlib', 'purelib', 'platlib')])
+    return tuple([os.path.join(os.path.abspath(p), '') for p in paths if p])
+
+
+def get_app_module_names():
+    """Returns the names of imported modules which are not part of the
+    standard library, or installed in site-packages. These are the
+    modules a warm reload imports anew."""
+    lib_paths = _get_library_paths()
+    ret = []
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None)
+        if not filename or name == '__main__':
+            continue
+        if not os.path.abspath(filename).startswith(lib_paths):
+            ret.append(name)
+    return ret
+
+
+class _ForkedChild(object):
+    """A reloader child forked from the current, "warm", process, with
+    enough of the :class:`subprocess.Popen` interface for
+    :func:`restart_with_reloader`."""
+    def __init__(self, pid, stderr):
+        self.pid = pid
+        self.stderr = stderr
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                if os.WIFSIGNALED(status):
+                    self.returncode = -os.WTERMSIG(status)
+                else:
+                    self.returncode = os.WEXITSTATUS(status)
+        return self.returncode
+
+
+def _run_main_in_child():
+    # runs the main script (or module) again, in the forked child,
+    # without returning to the parent's stack
+    exit_code = 1
+    try:
+        os.environ['WERKZEUG_RUN_MAIN'] = 'true'
+        for name in get_app_module_names():
+            sys.modules.pop(name, None)
         path, basename = os.path.split(sys.argv[0])
         if basename == '__main__.py':
-            pkg_name = os.path.basename(path)
-            args.extend(['-m', pkg_name] + sys.argv[1:])
+            runpy.run_module(os.path.basename(path), run_name='__main__', alter_sys=True)
+        else:
+            runpy.run_path(sys.argv[0], run_name='__main__')
+        exit_code = 0
+    except SystemExit as se:
+        if se.code is None:
+            exit_code = 0
+        elif isinstance(se.code, int):
+            exit_code = se.code
         else:
-            args.extend(sys.argv)
-        new_environ = os.environ.copy()
-        new_environ['WERKZEUG_RUN_MAIN'] = 'true'
-        if os.name == 'nt':  # pragma: no cover
-            for key, value in new_environ.items():
-                if isinstance(value, str):
-                    new_environ[key] = value.encode('iso-8859-1')
-        child_proc = subprocess.Popen(args,
-                                      env=new_environ,
-                                      stderr=subprocess.PIPE)
+            sys.stderr.write('%s\n' % (se.code,))
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def _fork_reloader_child():
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        os.dup2(write_fd, 2)  # stderr goes to the parent, as with Popen
+        os.close(write_fd)
+        _run_main_in_child()  # never returns
+    os.close(write_fd)
+    return _ForkedChild(pid, os.fdopen(read_fd, 'rb'))
+
+
+def restart_with_reloader(error_func=None, warm_reload=False):
+    """Runs the server in a child process, restarting it whenever it
+    exits with code 3, as :func:`reloader_loop` does on changes.
+
+    By default, each child is a new interpreter. With *warm_reload*,
+    where :func:`os.fork` is available, each child is instead forked
+    from this process, which keeps the standard library and installed
+    packages imported, and only the application's own modules (see
+    :func:`get_app_module_names`) are imported again. Note that
+    children inherit any state the main script's imports set up,
+    such as open connections, but not threads.
+    """
+    spawn_child = _spawn_reloader_child
+    if warm_reload and hasattr(os, 'fork'):
+        spawn_child = _fork_reloader_child
+    to_mon = []
+    while 1:
+        print(' * Clastic restarting with reloader')
+        child_proc = spawn_child()
         stderr_buff = deque(maxlen=_STDERR_BUFF_SIZE)
 
         def consume_lines():
@@ -145,7 +328,7 @@ def restart_with_reloader(error_func=None):
 
 
 def run_with_reloader(main_func, extra_files=None, interval=1,
-                      error_func=None):
+                      error_func=None, warm_reload=False):
     signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
     enable_tty_echo()
     if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
@@ -160,7 +343,8 @@ def run_with_reloader(main_func, extra_files=None, interval=1,
             raise
 
     try:
-        sys.exit(restart_with_reloader(error_func=error_func))
+        sys.exit(restart_with_reloader(error_func=error_func,
+                                       warm_reload=warm_reload))
     except KeyboardInterrupt:
         pass
 
@@ -168,7 +352,7 @@ def run_with_reloader(main_func, extra_files=None, interval=1,
 def run_simple(hostname, port, application, use_reloader=False,
                use_debugger=False, use_evalex=True, extra_files=None,
                reloader_interval=1, passthrough_errors=False, processes=None,
-               threaded=False, ssl_context=None):
+               threaded=False, ssl_context=None, warm_reload=False):
     if use_debugger:
         from werkzeug.debug import DebuggedApplication
         application = DebuggedApplication(application, use_evalex)
@@ -196,6 +380,6 @@ def run_simple(hostname, port, application, use_reloader=False,
     if use_reloader:
         open_test_socket(hostname, port)
         run_with_reloader(serve_forever, extra_files, reloader_interval,
-                          error_func=serve_error_app)
+                          error_func=serve_error_app, warm_reload=warm_reload)
     else:
         serve_forever()
@@ -1,19 +1,44 @@
 # -*- coding: utf-8 -*-
 
 
+import os
+import sys
 import types
+import marshal
+import weakref
 import inspect
 import hashlib
+import tempfile
 import linecache
+import threading
+import importlib.util
 
 from boltons import iterutils
+from boltons.cacheutils import LRU
 from boltons.funcutils import FunctionBuilder
 
 _VERBOSE = False
 _INDENT = '    '
 
 
+# callable -> {drop_self: FunctionBuilder}. weakly keyed so that
+# introspecting a callable doesn't keep it alive.
+_FB_CACHE = weakref.WeakKeyDictionary()
+# FunctionBuilder -> (defaults dict, arg names, varkw), for inject()
+_INJECT_INFO_CACHE = weakref.WeakKeyDictionary()
+_CACHE_LOCK = threading.Lock()
+# (name, code string) -> code object. routes with the same signatures
+# generate the same chain code, so compile() once per shape.
+_CODE_CACHE = LRU(max_size=4096)
+# optional directory of marshalled code objects, see set_code_cache_dir()
+_CODE_CACHE_DIR = os.environ.get('CLASTIC_CODE_CACHE_DIR') or None
+
+
 def get_fb(f, drop_self=True):
+    """Returns a FunctionBuilder describing the signature of *f*, which
+    may be a function, method, or callable object. Results are cached
+    per callable, and should be treated as read-only.
+    """
     # TODO: support partials
     if not (inspect.isfunction(f) or inspect.ismethod(f) or \
             inspect.isbuiltin(f)) and hasattr(f, '__call__'):
@@ -24,13 +49,40 @@ def get_fb(f, drop_self=True):
     if isinstance(getattr(f, '_sinter_fb', None), FunctionBuilder):
         return f._sinter_fb  # we'll take your word for it; good luck, lil buddy.
 
+    is_method = isinstance(f, types.MethodType)
+    drop_self = drop_self and is_method
+    # bound methods are created anew on every attribute access, but
+    # share their signature with the underlying function
+    key = f.__func__ if is_method else f
+    try:
+        return _FB_CACHE[key][drop_self]
+    except (KeyError, TypeError):  # TypeError: not weakref-able
+        pass
+
     ret = FunctionBuilder.from_func(f)
 
     if not all([isinstance(a, str) for a in ret.args]):
         raise TypeError('does not support anonymous tuple arguments'
                         ' or any other strange args for that matter.')
-    if drop_self and isinstance(f, types.MethodType):
+    if drop_self:
         ret.args = ret.args[1:]  # discard "self" on methods
+
+    with _CACHE_LOCK:
+        try:
+            _FB_CACHE.setdefault(key, {})[drop_self] = ret
+        except TypeError:
+            pass
+    return ret
+
+
+def _get_inject_info(fb):
+    try:
+        return _INJECT_INFO_CACHE[fb]
+    except KeyError:
+        pass
+    ret = (fb.get_defaults_dict(), fb.get_arg_names(), fb.varkw)
+    with _CACHE_LOCK:
+        _INJECT_INFO_CACHE[fb] = ret
     return ret
 
 
@@ -58,17 +110,74 @@ def inject(f, injectables):
     __traceback_hide__ = True
 
     fb = get_fb(f)
+    defaults, arg_names, varkw = _get_inject_info(fb)
 
-    all_kwargs = fb.get_defaults_dict()
+    all_kwargs = dict(defaults)
     all_kwargs.update(injectables)
 
-    if fb.varkw:
+    if varkw:
         return f(**all_kwargs)
 
-    kwargs = dict([(k, v) for k, v in all_kwargs.items() if k in fb.get_arg_names()])
+    kwargs = dict([(k, all_kwargs[k]) for k in arg_names if k in all_kwargs])
     return f(**kwargs)
 
 
+_INJECTOR_TMPL = \
+'''
+def {name}({params}kwargs):
+    __traceback_hide__ = True
+    try:
+{lookups}
+    except KeyError as ke:
+        raise TypeError('%s() missing required argument: %s' % ({target_name!r}, ke))
+    return target({call_args})
+'''
+
+
+def make_injector(f, params=(), sources=(), name='injector'):
+    """Compiles a specialized alternative to :func:`inject`, for
+    callables invoked many times from the same sources of arguments.
+
+    The returned function takes the names in *params* positionally,
+    followed by a dict of injectables, and calls *f* with exactly the
+    arguments it takes. Each argument comes from the dict if present,
+    otherwise from the first of the mappings in *sources* which had
+    it when the injector was made, otherwise from *f*'s defaults.
+    Unlike :func:`inject`, no signature introspection or filtering
+    happens per call.
+
+    Returns ``None`` if *f* takes ``**kwargs``, as it would need every
+    injectable anyway.
+    """
+    fb = get_fb(f)
+    if fb.varkw:
+        return None
+    defaults = fb.get_defaults_dict()
+    sources = list(sources) + [defaults]
+    env = {'target': f}
+    lookups, call_args = [], []
+    for i, arg in enumerate(fb.get_arg_names()):
+        if arg in params:
+            call_args.append('%s=%s' % (arg, arg))
+            continue
+        local_name = 'arg_%d' % i
+        lookup = 'kwargs[%r]' % arg
+        for src_idx, source in enumerate(sources):
+            if arg in source:
+                env['source_%d' % src_idx] = source
+                lookup = ('kwargs[%r] if %r in kwargs else source_%d[%r]'
+                          % (arg, arg, src_idx, arg))
+                break
+        lookups.append('%s%s%s = %s' % (_INDENT, _INDENT, local_name, lookup))
+        call_args.append('%s=%s' % (arg, local_name))
+    code_str = _INJECTOR_TMPL.format(name=name,
+                                     params=''.join([p + ', ' for p in params]),
+                                     lookups='\n'.join(lookups) or _INDENT * 2 + 'pass',
+                                     target_name=fb.name,
+                                     call_args=', '.join(call_args))
+    return compile_code(code_str, name, env)
+
+
 def get_callable_labels(obj):
     ctx_parts = []
     if isinstance(obj, types.MethodType):
@@ -145,33 +254,107 @@ def compile_chain(funcs, params, inner_name, verbose=_VERBOSE):
     return compile_code(call_str, inner_name, {'funcs': funcs}, verbose=verbose)
 
 
+def set_code_cache_dir(path):
+    """Sets a directory in which :func:`compile_code` stores the code it
+    compiles, so that later processes, such as restarted or
+    additional workers, load it instead of compiling it again. The
+    directory is created when first written to. Pass ``None`` to disable. Also set
+    by the ``CLASTIC_CODE_CACHE_DIR`` environment variable.
+    """
+    global _CODE_CACHE_DIR
+    if path is not None:
+        path = os.path.abspath(path)
+    _CODE_CACHE_DIR = path
+
+
+def _get_code_cache_path(cache_dir, name, code_str):
+    key = hashlib.sha1(('%s\n%s' % (name, code_str)).encode('utf8')).hexdigest()
+    # marshal's format varies by Python version
+    return os.path.join(cache_dir, '%s.%s.code' % (key, sys.implementation.cache_tag))
+
+
+def _load_cached_code(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    magic = importlib.util.MAGIC_NUMBER
+    if data[:len(magic)] != magic:
+        return None
+    try:
+        return marshal.loads(data[len(magic):])
+    except (EOFError, ValueError, TypeError):
+        return None  # corrupt, will be overwritten
+
+
+def _store_cached_code(path, code):
+    data = importlib.util.MAGIC_NUMBER + marshal.dumps(code)
+    try:
+        # write then rename, so concurrent processes never read partial files
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass  # the cache is an optimization; compiling still works
+    return
+
+
 def compile_code(code_str, name, env=None, verbose=_VERBOSE):
     code_hash = hashlib.sha1(code_str.encode('utf8')).hexdigest()[:16]
     unique_filename = "<sinter generated %s %s>" % (name, code_hash)
-    code = compile(code_str, unique_filename, 'single')
+    code = _CODE_CACHE.get((name, code_str))
+    if code is None:
+        cache_dir = _CODE_CACHE_DIR
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = _get_code_cache_path(cache_dir, name, code_str)
+            code = _load_cached_code(cache_path)
+        if code is None:
+            code = compile(code_str, unique_filename, 'single')
+            if cache_path is not None:
+                _store_cached_code(cache_path, code)
+        _CODE_CACHE[(name, code_str)] = code
     if verbose:
         print(code_str)
     exec(code, env)
 
-    linecache.cache[unique_filename] = (
-        len(code_str),
-        None,
-        code_str.splitlines(True),
-        unique_filename,
-    )
+    if unique_filename not in linecache.cache:
+        linecache.cache[unique_filename] = (
+            len(code_str),
+            None,
+            code_str.splitlines(True),
+            unique_filename,
+        )
     return env[name]
 
 
 
-def make_chain(funcs, provides, final_func, preprovided, inner_name):
-    funcs = list(funcs)
-    provides = list(provides)
+def get_chain_args(funcs, provides, final_func, preprovided, inner_name):
+    """Returns the arguments the chain of *funcs* and *final_func* would
+    take, and those of them which are not *preprovided*, as two sets,
+    without generating any code."""
     preprovided = set(preprovided)
-    reqs, opts = chain_argspec(funcs + [final_func],
-                               provides + [()], inner_name)
+    reqs, opts = chain_argspec(list(funcs) + [final_func],
+                               list(provides) + [()], inner_name)
 
-    unresolved = tuple(reqs - preprovided)
+    unresolved = reqs - preprovided
     args = reqs | (preprovided & opts)
+    return args, unresolved
+
+
+def make_chain(funcs, provides, final_func, preprovided, inner_name):
+    funcs = list(funcs)
+    provides = list(provides)
+    args, unresolved = get_chain_args(funcs, provides, final_func,
+                                      preprovided, inner_name)
+    # sorted, so that the generated code is the same across processes
     chain = compile_chain(funcs + [final_func],
-                          [args] + provides, inner_name)
+                          [sorted(args)] + provides, inner_name)
     return chain, set(args), set(unresolved)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from pytest import raises
+
+from clastic import Application, render_basic
+from clastic.bench import load
+from clastic.bench.suite import run_benchmarks, compare_results, main
+
+
+def test_bench_suite(tmp_path):
+    results = run_benchmarks(['middleware_chain', 'static'], min_time=0.001, repeat=2)
+    assert results['environment']['clastic_version']
+    names = set([r['name'] for r in results['results']])
+    assert names == set(['middleware_chain', 'static'])
+    for result in results['results']:
+        assert result['loops'] >= 1 and result['repeat'] == 2
+        assert 0 < result['min'] <= result['median']
+
+    baseline = json.loads(json.dumps(results))
+    for result in baseline['results']:
+        result['min'] /= 2
+    comparison = compare_results(baseline, results, threshold=0.5)
+    assert len(comparison) == len(results['results'])
+    assert all([is_regression for _, _, _, _, _, is_regression in comparison])
+
+    output_path = str(tmp_path / 'results.json')
+    assert main(['construction', '--min-time', '0.001', '--repeat', '1',
+                 '-q', '-o', output_path]) == 0
+    with open(output_path) as f:
+        assert len(json.load(f)['results']) == 3
+
+
+def _fail():
+    raise ValueError('nope')
+
+
+load_app = Application([('/', lambda: 'hi', render_basic),
+                        ('/hi/<name>', lambda name: 'hi %s' % name, render_basic),
+                        ('/fail', _fail, render_basic)])
+
+
+def test_load_app():
+    assert load.load_app('clastic.tests.test_bench:load_app') is load_app
+    assert load.load_app('clastic.tests.test_bench:Application()').routes == []
+    with raises(ValueError):
+        load.load_app('clastic.tests.test_bench:nonexistent')
+
+    assert load.get_route_pattern(load_app, '/hi/bob') == '/hi/<name>'
+    assert load.get_route_pattern(load_app, '/missing') == '/missing'
+
+
+def test_run_load():
+    paths = ['/', '/hi/bob', '/hi/alice', '/fail', '/missing']
+    report = load.run_load(load_app, paths=paths, concurrency=3, requests=50)
+    total = report['total']
+    assert total['count'] == 50
+    assert total['error_count'] == 10
+    assert total['rps'] > 0
+    assert total['latency']['min'] <= total['latency']['0.5'] <= total['latency']['max']
+    routes = report['routes']
+    assert routes['/hi/<name>']['200']['count'] == 20
+    assert routes['/fail']['500']['count'] == 10
+    assert routes['/missing']['404']['count'] == 10
+    assert 'Requests/sec' in load.format_load_report(report)
+
+    report = load.run_load(load_app, paths=['/hi/bob', '/fail'], server=True,
+                           concurrency=2, duration=0.2)
+    assert report['settings']['mode'] == 'server'
+    routes = report['routes']
+    assert routes['/hi/<name>']['200']['count'] > 0
+    assert routes['/fail']['500']['count'] > 0
+    assert report['total']['bytes'] > 0
+    json.dumps(report)
+
+
+def test_load_main(capsys):
+    assert load.main(['clastic.tests.test_bench:load_app', '-p', '/hi/x',
+                      '-n', '5', '-c', '1', '--rate', '1000', '--json']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['routes']['/hi/<name>']['200']['count'] == 5
+
+
+def test_bench_tools(capsys):
+    from clastic.bench.__main__ import main as bench_main
+    from clastic.bench.cold_start import run_cold_start
+
+    results = run_cold_start(route_count=5, runs=1)
+    assert results['no_cache_min'] > 0 and results['warm_cache_min'] > 0
+
+    assert bench_main(['suite', 'construction', '--min-time', '0.001',
+                       '--repeat', '1', '-q']) == 0
+    assert len(json.loads(capsys.readouterr().out)['results']) == 3
+    assert bench_main(['clastic.tests.test_bench:load_app', '-n', '2', '--json']) == 0
+    assert json.loads(capsys.readouterr().out)['total']['count'] == 2
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import subprocess
+
+from pytest import raises
+
+import clastic
+
+
+# modules which "import clastic" shouldn't load, see clastic.__getattr__
+_HEAVY_MODULES = ('ashes', 'glom', 'werkzeug.debug',
+                  'clastic.meta', 'clastic.static', 'clastic.server',
+                  'clastic._contextual_errors')
+
+# in a fresh process, as this one has likely imported them already
+_CHILD_CODE = '''
+import sys, json
+import clastic
+print(json.dumps([m for m in %r if m in sys.modules]))
+''' % (_HEAVY_MODULES,)
+
+
+def _run_import():
+    env = dict(os.environ)
+    pkg_parent = os.path.dirname(os.path.dirname(os.path.abspath(clastic.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [pkg_parent, env.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, '-c', _CHILD_CODE], env=env)
+    return json.loads(output)
+
+
+def test_lazy_import():
+    assert _run_import() == []
+
+
+def test_lazy_attrs():
+    assert clastic.MetaApplication.__name__ == 'MetaApplication'
+    assert clastic.StaticFileRoute.__name__ == 'StaticFileRoute'
+    assert callable(clastic.server.run_simple)
+    assert 'MetaApplication' in dir(clastic)
+    from clastic import META_ASSETS_APP
+    assert META_ASSETS_APP is clastic.meta.META_ASSETS_APP
+    from clastic.render import AshesRenderFactory
+    assert AshesRenderFactory.__name__ == 'AshesRenderFactory'
+    with raises(AttributeError):
+        clastic.nonexistent
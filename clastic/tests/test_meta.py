@@ -86,3 +86,34 @@ def test_resource_redaction():
     content = resp.get_data(as_text=True)
     assert 'bokay' in content
     assert 'vsecret' not in content
+
+
+def test_meta_memory():
+    from clastic.middleware.memory import MemoryProfileMiddleware
+
+    retained = []
+
+    def leaky():
+        retained.append(bytearray(100000))
+        return 'ok'
+
+    mem_mw = MemoryProfileMiddleware(sample_rate=1.0)
+    app = Application([('/meta', MetaApplication()),
+                       ('/leaky', leaky, render_basic)],
+                      middlewares=[mem_mw])
+    cl = app.get_local_client()
+    for _ in range(3):
+        assert cl.get('/leaky').status_code == 200
+
+    route_allocs = mem_mw.get_route_allocations()
+    assert route_allocs['/leaky']['sample_count'] == 3
+    assert route_allocs['/leaky']['mean_size_diff'] >= 100000
+    top_site = route_allocs['/leaky']['top_sites'][0]
+    assert top_site['site'].endswith('test_meta.py:%s' % (leaky.__code__.co_firstlineno + 1))
+
+    resp = cl.get('/meta/json/')
+    memory = json.loads(resp.data)['memory']
+    assert 'exc_content' not in memory
+    assert memory['gc']['generations'][0]['generation'] == 0
+    assert memory['routes'][0]['pattern'] == '/leaky'
+    assert cl.get('/meta/').status_code == 200
@@ -2,6 +2,7 @@
 
 
 import json
+import time
 import itertools
 
 import attr
@@ -94,6 +95,8 @@ def test_big_mw_stack():
                    cookie.SignedCookieMiddleware(),
                    form.PostDataMiddleware({'lol': str}),
                    profile.SimpleProfileMiddleware(),
+                   profile.SamplingProfileMiddleware(),
+                   profile.ProfileSessionMiddleware(),
                    stats.StatsMiddleware(),
                    url.ScriptRootMiddleware(),
                    url.GetParamMiddleware({})]
@@ -134,6 +137,201 @@ def test_profile_mw():
     assert '0.00' in resp_data # had to split this because pypy sometimes gives back "-0.000 seconds"
 
 
+def test_profile_session_mw():
+    import pstats
+    import tempfile
+    from clastic.middleware import profile
+
+    session_mw = profile.ProfileSessionMiddleware()
+    app = Application([('/<name?>', hello_world),
+                       ('/_prof', profile.create_profile_session_app())],
+                      middlewares=[session_mw])
+    cl = app.get_local_client()
+    cl.get('/')
+    assert session_mw.profiled_count == 0  # inactive by default
+
+    resp = cl.post('/_prof/start?count=3&pattern=/<name?>&format=json')
+    assert json.loads(resp.get_data(True))['remaining'] == 3
+    for name in ('a', 'b', 'c', 'd'):
+        assert cl.get('/' + name).status_code == 200
+    assert session_mw.profiled_count == 3
+    assert not session_mw.is_active
+
+    resp = cl.get('/_prof/stats?sort=time&limit=5')
+    assert 'function calls' in resp.get_data(True)
+    assert cl.get('/_prof/stats?sort=nope').status_code == 400
+
+    resp = cl.get('/_prof/download.prof')
+    assert 'attachment' in resp.headers['Content-Disposition']
+    with tempfile.NamedTemporaryFile(suffix='.prof') as tmp:
+        tmp.write(resp.get_data())
+        tmp.flush()
+        stats = pstats.Stats(tmp.name)
+    assert any([func[2] == 'hello_world' and stat[0] == 3
+                for func, stat in stats.stats.items()])
+
+    cl.post('/_prof/reset')
+    assert session_mw.profiled_count == 0
+
+
+def test_sampling_profile_mw():
+    from clastic.middleware import profile
+
+    def slow_endpoint():
+        time.sleep(0.1)
+        return 'done'
+
+    sampling_mw = profile.SamplingProfileMiddleware(interval=0.002)
+    app = Application([('/slow', slow_endpoint, render_basic),
+                       ('/_prof', profile.create_sampling_profile_app())],
+                      middlewares=[sampling_mw])
+    cl = app.get_local_client()
+    cl.get('/slow')
+    assert sampling_mw.sampler.get_sample_counts() == {}  # disabled by default
+
+    resp = cl.post('/_prof/enable?seconds=30')
+    assert resp.status_code == 200
+    assert sampling_mw.is_enabled
+    assert cl.get('/slow').get_data(True) == 'done'
+
+    counts = sampling_mw.sampler.get_sample_counts()
+    assert counts['/slow'] > 0
+    collapsed = cl.get('/_prof/collapsed').get_data(True)
+    slow_stacks = [line.rpartition(' ') for line in collapsed.splitlines()
+                   if line.startswith('/slow;')]
+    assert any([stack.endswith(':slow_endpoint') for stack, _, _ in slow_stacks])
+    assert sum([int(count) for _, _, count in slow_stacks]) == counts['/slow']
+    collapsed = cl.get('/_prof/collapsed?pattern=/slow').get_data(True)
+    assert not collapsed.startswith('/slow;')
+
+    cl.post('/_prof/reset')
+    assert sampling_mw.sampler.get_sample_counts() == {}
+
+
+def test_access_log_mw():
+    from io import StringIO
+    from clastic.middleware.access_log import AccessLogMiddleware
+
+    stream = StringIO()
+    log_mw = AccessLogMiddleware(stream=stream, flush_interval=0.01)
+    app = Application([('/<name?>', hello_world)], middlewares=[log_mw])
+    cl = app.get_local_client()
+    cl.get('/')
+    cl.get('/bob')
+    cl.get('/not/found')
+    log_mw.flush()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [r['path'] for r in records] == ['/', '/bob', '/not/found']
+    assert records[1]['pattern'] == '/<name?>'
+    assert records[1]['status'] == 200
+    assert records[1]['bytes'] == len('Hello, bob!')
+    assert records[2]['status'] == 404
+    assert records[0]['request_id'] < records[1]['request_id']
+    assert log_mw.dropped_count == 0
+
+    # a full queue drops instead of blocking
+    log_mw = AccessLogMiddleware(stream=StringIO(), max_queue=1)
+    log_mw._queue._thread.ensure_started = lambda: None  # no writer to drain the queue
+    for i in range(3):
+        log_mw.log({'i': i})
+    assert log_mw.dropped_count == 2
+
+
+def test_tracing_mw():
+    from io import StringIO
+    from clastic.middleware.tracing import (TracingMiddleware,
+                                            BatchSpanProcessor,
+                                            InMemorySpanExporter,
+                                            FileSpanExporter,
+                                            parse_traceparent)
+
+    def traced_endpoint(trace_context):
+        return trace_context.traceparent
+
+    exporter = InMemorySpanExporter()
+    tracing_mw = TracingMiddleware(processor=BatchSpanProcessor(exporter, flush_interval=0.01),
+                                   layer_spans=True)
+    app = Application([('/', traced_endpoint, render_basic)],
+                      middlewares=[tracing_mw, GetParamMiddleware({})])
+    cl = app.get_local_client()
+    parent_header = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+    resp = cl.get('/', headers={'traceparent': parent_header})
+    trace_id, span_id, sampled = parse_traceparent(resp.get_data(True))
+    assert trace_id == '0af7651916cd43dd8448eb211c80319c'
+    assert sampled
+    tracing_mw.processor.flush()
+
+    spans = dict([(s.name, s) for s in exporter.get_finished_spans()])
+    assert set(spans) == set(['GET /', 'routing', 'GetParamMiddleware.request',
+                              'endpoint', 'render'])
+    root = spans['GET /']
+    assert root.span_id == span_id
+    assert root.parent_span_id == 'b7ad6b7169203331'
+    assert root.attributes['http.response.status_code'] == 200
+    assert spans['GetParamMiddleware.request'].parent_span_id == root.span_id
+    assert spans['endpoint'].parent_span_id == spans['GetParamMiddleware.request'].span_id
+    assert all([s.trace_id == trace_id for s in spans.values()])
+    assert all([root.start_time <= s.start_time <= s.end_time <= root.end_time
+                for s in spans.values()])
+
+    # unsampled parent: propagated, but not recorded
+    exporter.clear()
+    resp = cl.get('/', headers={'traceparent': parent_header[:-2] + '00'})
+    assert resp.get_data(True).endswith('-00')
+    resp = cl.get('/', headers={'traceparent': 'garbage'})
+    tracing_mw.processor.flush()
+    assert len(exporter.get_finished_spans()) == 5
+
+    stream = StringIO()
+    processor = BatchSpanProcessor(FileSpanExporter(stream=stream), flush_interval=0.01)
+    tracing_mw = TracingMiddleware(sample_rate=0.0, processor=processor)
+    app = Application([('/', traced_endpoint, render_basic)],
+                      middlewares=[tracing_mw])
+    app.get_local_client().get('/')
+    assert stream.getvalue() == ''
+
+    tracing_mw.sample_rate = 1.0
+    app.get_local_client().get('/')
+    tracing_mw.processor.flush()
+    otlp = json.loads(stream.getvalue())
+    otlp_spans = otlp['resourceSpans'][0]['scopeSpans'][0]['spans']
+    # without layer_spans, nothing is timed, so only the server span
+    assert [s['name'] for s in otlp_spans] == ['GET /']
+    assert not tracing_mw.phase_timing
+
+
+def test_slow_request_watchdog():
+    from clastic.middleware.watchdog import (SlowRequestMiddleware,
+                                             create_watchdog_app)
+    reported = []
+
+    def stuck_endpoint():
+        time.sleep(0.3)
+        return 'finally'
+
+    watchdog_mw = SlowRequestMiddleware(threshold=0.05, check_interval=0.02,
+                                        on_report=reported.append)
+    app = Application([('/stuck', stuck_endpoint, render_basic),
+                       ('/watchdog', create_watchdog_app())],
+                      middlewares=[watchdog_mw])
+    c = app.get_local_client()
+    assert c.get('/stuck').get_data(True) == 'finally'
+
+    assert len(reported) == 1  # reported once, while in flight
+    report = reported[0]
+    assert report.pattern == '/stuck'
+    assert report.request_id is not None
+    assert 'stuck_endpoint' in report.stack[-1]
+    assert 'in thread' in report.format()
+
+    data = json.loads(c.get('/watchdog/?format=json').get_data(True))
+    assert data['slow_requests'][0]['path'] == '/stuck'
+    assert data['in_flight'][0]['pattern'] == '/watchdog/'  # itself
+    c.post('/watchdog/clear')
+    assert not watchdog_mw.reports
+
+
 def test_wsgi_mw():
     @attr.s(frozen=True)
     class HeaderAddMW(object):
@@ -197,3 +395,36 @@ def test_wsgi_mw():
     app = Application([('/', inner_app)],
                       middlewares=[WmwX(), WmwY()])
     _test_app(app)
+
+
+def test_body_data_mw():
+    from clastic.middleware.form import BodyDataMiddleware
+
+    def echo_body(body_data):
+        return {'received': body_data}
+
+    app = Application([('/', echo_body, render_basic)],
+                      middlewares=[BodyDataMiddleware()])
+    cl = app.get_local_client()
+
+    resp = cl.post('/', data=json.dumps({'a': [1, 2]}),
+                   content_type='application/json')
+    assert resp.status_code == 200
+    assert json.loads(resp.get_data(True)) == {'received': {'a': [1, 2]}}
+
+    resp = cl.post('/')
+    assert json.loads(resp.get_data(True)) == {'received': None}
+
+    resp = cl.post('/', data=b'{nope', content_type='application/json')
+    assert resp.status_code == 400
+
+    resp = cl.post('/', data=b'<a/>', content_type='application/xml')
+    assert resp.status_code == 415
+
+    try:
+        import msgpack
+    except ImportError:
+        return
+    resp = cl.post('/', data=msgpack.packb({'b': [3, 'x']}),
+                   content_type='application/msgpack')
+    assert json.loads(resp.get_data(True)) == {'received': {'b': [3, 'x']}}
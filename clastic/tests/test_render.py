@@ -3,13 +3,21 @@
 import os
 import json
 
+import pytest
+
+from werkzeug.wrappers import Response
+
 from clastic import Application, Redirector
 from clastic.render import (JSONRender,
                             JSONPRender,
                             render_basic,
                             BasicRender,
                             Table,
-                            TabularRender)
+                            TabularRender,
+                            CSVRender,
+                            TSVRender,
+                            StreamingTableRender)
+from clastic.render import binary
 
 from clastic.tests.common import (hello_world_str,
                                   hello_world_html,
@@ -145,3 +153,172 @@ def test_redirector():
     assert resp.headers['Location'] == 'http://localhost/other'
 
     repr(redirect_other)
+
+
+@pytest.mark.skipif(not binary.HAVE_MSGPACK, reason='msgpack not installed')
+def test_basic_render_msgpack():
+    import msgpack
+    app = Application([('/beta/<name>/', complex_context, render_basic)])
+    c = app.get_local_client()
+
+    resp = c.get('/beta/Rajkumar/?format=msgpack')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/msgpack'
+    resp_data = msgpack.unpackb(resp.data, raw=False)
+    assert resp_data['name'] == 'Rajkumar'
+    assert resp_data['date']
+
+    resp = c.get('/beta/Rajkumar/',
+                 headers={'Accept': 'application/msgpack'})
+    assert resp.mimetype == 'application/msgpack'
+
+    resp = c.get('/beta/Rajkumar/', headers={'Accept': '*/*'})
+    assert resp.mimetype == 'text/html'
+
+
+@pytest.mark.skipif(not binary.HAVE_CBOR, reason='cbor2 not installed')
+def test_basic_render_cbor():
+    import cbor2
+    app = Application([('/beta/<name>/', complex_context, render_basic)])
+    c = app.get_local_client()
+
+    resp = c.get('/beta/Rajkumar/', headers={'Accept': 'application/cbor'})
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/cbor'
+    resp_data = cbor2.loads(resp.data)
+    assert resp_data['name'] == 'Rajkumar'
+    assert resp_data['bool_vals'] == set([True, False])
+
+
+def test_basic_render_no_binary():
+    br = BasicRender(msgpack_render=None, cbor_render=None)
+    assert set(br.formats) == set(['html', 'json', 'csv', 'tsv'])
+    app = Application([('/', hello_world_ctx, br)])
+    c = app.get_local_client()
+    resp = c.get('/', headers={'Accept': 'application/msgpack'})
+    assert resp.mimetype == 'application/json'
+
+
+def test_streaming_delimited_render():
+    consumed = []
+
+    def gen_rows():
+        for i in range(1000):
+            consumed.append(i)
+            yield {'id': i, 'name': 'row, %s' % i}
+
+    app = Application([('/csv', gen_rows, CSVRender(filename='rows.csv')),
+                       ('/tsv', gen_rows, TSVRender(with_headers=False)),
+                       ('/html', gen_rows, StreamingTableRender()),
+                       ('/basic', hello_world_ctx, render_basic)])
+    c = app.get_local_client()
+
+    resp = c.get('/csv', buffered=False)
+    assert resp.is_streamed
+    assert len(consumed) < 2  # rows are pulled as the body is iterated
+    lines = resp.get_data(True).splitlines()
+    assert len(consumed) == 1000
+    assert lines[0] == 'id,name'
+    assert lines[1] == '0,"row, 0"'
+    assert len(lines) == 1001
+    assert resp.headers['Content-Disposition'] == 'attachment; filename="rows.csv"'
+
+    resp = c.get('/tsv')
+    assert resp.mimetype == 'text/tab-separated-values'
+    assert resp.get_data(True).splitlines()[0] == '0\trow, 0'
+
+    resp = c.get('/html')
+    resp_data = resp.get_data(True)
+    assert resp_data.count('<tr>') == 1001
+    assert '<th>name</th>' in resp_data
+
+    resp = c.get('/basic?format=csv')
+    assert resp.mimetype == 'text/csv'
+    assert resp.get_data(True).splitlines() == ['name,greeting',
+                                                'world,"Hello, world!"']
+    resp = c.get('/basic', headers={'Accept': 'text/tab-separated-values'})
+    assert resp.mimetype == 'text/tab-separated-values'
+
+    # BasicRender streams iterables to the tabular formats
+    def mixed_rows():
+        yield {'id': 0, 'name': 'a'}
+        yield [1, 'b']
+        yield 'c'
+
+    app = Application([('/', mixed_rows, render_basic)])
+    c = app.get_local_client()
+    resp = c.get('/?format=csv')
+    assert resp.mimetype == 'text/csv'
+    assert resp.get_data(True).splitlines() == ['id,name', '0,a', '1,b', 'c']
+    resp = c.get('/?format=tsv')
+    assert resp.get_data(True).splitlines()[1] == '0\ta'
+    resp = c.get('/?format=json')
+    assert resp.mimetype == 'text/plain'
+    resp = c.get('/?format=html', buffered=False)
+    assert resp.is_streamed
+    resp_data = resp.get_data(True)
+    assert resp_data.count('<tr>') == 4
+    assert '<th>name</th>' in resp_data
+    assert '<td>c</td>' in resp_data
+
+
+def test_tabular_render_paging():
+    def many_rows():
+        return [{'id': i, 'nested': {'id_str': str(i), 'parity': [i % 2]}}
+                for i in range(25)]
+
+    tr = TabularRender(max_rows=10, collapse_depth=2)
+    app = Application([('/', many_rows, tr),
+                       ('/basic', many_rows, BasicRender(tabular_render=tr))])
+    c = app.get_local_client()
+
+    resp = c.get('/?x=y')
+    resp_data = resp.get_data(True)
+    assert 'rows 1-10 of 25' in resp_data
+    assert 'next &raquo;' in resp_data
+    assert '?x=y&amp;_page=2' in resp_data
+    assert 'list (1 item)' in resp_data  # collapsed at depth 2
+
+    resp = c.get('/basic?format=html&_page=3')
+    resp_data = resp.get_data(True)
+    assert 'rows 21-25 of 25' in resp_data
+    assert 'next &raquo;' not in resp_data
+    assert '&laquo; prev' in resp_data
+
+    resp = c.get('/?_path=' + json.dumps([23, 'nested', 'parity']))
+    resp_data = resp.get_data(True)
+    assert '(root)' in resp_data
+    assert '<td>1</td>' in resp_data
+    assert 'rows 1-' not in resp_data
+
+    resp = c.get('/?_path=nope')
+    assert resp.status_code == 400
+    resp = c.get('/?_path=' + json.dumps([23, 'nested', 'missing']))
+    assert resp.status_code == 400
+    resp = c.get('/?_path=' + json.dumps([23, 'id', 'real']))
+    assert resp.status_code == 400
+
+    # only keys and indexes are followed, never attributes
+    class Obj(object):
+        secret = 'hunter2'
+
+    tr = TabularRender(collapse_depth=2)
+    app = Application([('/', lambda: {'obj': Obj()}, tr)])
+    c = app.get_local_client()
+    resp = c.get('/?_path=' + json.dumps(['obj', 'secret']))
+    assert resp.status_code == 400
+    assert 'hunter2' not in resp.get_data(True)
+
+    # _path is ignored unless collapse_depth is set
+    app = Application([('/', lambda: {'a': {'b': 1}}, TabularRender())])
+    resp = app.get_local_client().get('/?_path=' + json.dumps(['a', 'nope']))
+    assert resp.status_code == 200
+
+    # tabular renders without a request argument still work
+    def old_tabular_render(context, _route):
+        return Response('old', mimetype='text/html')
+
+    app = Application([('/', lambda: {'a': 1},
+                        BasicRender(tabular_render=old_tabular_render))])
+    resp = app.get_local_client().get('/?format=html')
+    assert resp.get_data(True) == 'old'
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 
+import gc
+import weakref
+
 from pytest import raises
 
 from clastic import Application, render_basic, Response
@@ -196,3 +199,87 @@ def test_slashing_behaviors():
     assert cl_strict.get('/dne/dne//').status_code == 404
     assert cl_rewrite.get('/dne/dne//').status_code == 404
     assert cl_redirect.get('/dne/dne//').status_code == 404
+
+
+def test_nested_bind_caching():
+    from clastic.middleware import GetParamMiddleware
+
+    def greet(name, greeting=None):
+        return '%s, %s!' % (greeting or 'Hello', name)
+
+    inner = Application([('/greet/<name>', greet, render_basic)])
+    outer = Application([('/a', inner), ('/b', inner)],
+                        middlewares=[GetParamMiddleware(['greeting'])])
+    rt_a, rt_b = outer.routes[0], outer.routes[1]
+    assert rt_a.pattern == '/a/greet/<name>'
+
+    # rebound routes are compiled on first use, and identical
+    # endpoint, render, middlewares, and provides share a chain
+    assert rt_a._execute is None and rt_b._execute is None
+    outer.compile_all()
+    assert rt_a._execute is rt_b._execute
+    assert rt_a._execute is not inner.routes[0]._execute
+    # routes unchanged by embedding share the embedded route's chain
+    plain_outer = Application([('/a', inner)])
+    assert plain_outer.routes[0]._execute is inner.routes[0]._execute
+    # regexes are cached by pattern and slash mode
+    rt_c = Route('/a/greet/<name>', greet).bind(Application())
+    assert rt_c.regex is rt_a.regex
+    rt_c = Route('/a/greet/<name>', greet).bind(Application(slash_mode=S_STRICT))
+    assert rt_c.regex is not rt_a.regex
+
+    cl = outer.get_local_client()
+    assert cl.get('/b/greet/Bob?greeting=Hi').get_data(True) == 'Hi, Bob!'
+    assert cl.get('/a/greet/Bob').get_data(True) == 'Hello, Bob!'
+    assert cl.get('/a/nope').status_code == 404
+    # execute() still works for routes of the embedded app
+    assert inner.get_local_client().get('/greet/Al').get_data(True) == 'Hello, Al!'
+
+    # discarded apps and their middlewares aren't kept alive
+    mw_ref = weakref.ref(outer.middlewares[0])
+    del outer, rt_a, rt_b, cl
+    gc.collect()
+    assert mw_ref() is None
+
+
+def test_lazy_compile():
+    import threading
+    from clastic.middleware import GetParamMiddleware
+
+    def lazy_greet(name, greeting=None):
+        return '%s, %s!' % (greeting or 'Hello', name)
+
+    def lazy_hi(name):
+        return 'Hi, %s!' % name
+
+    # dependencies are still checked at construction
+    with raises(NameError):
+        Application([('/<name>', lambda name, missing: None, render_basic)],
+                    lazy_compile=True)
+
+    mw = GetParamMiddleware(['greeting'])
+    app = Application([('/greet/<name>', lazy_greet, render_basic),
+                       ('/hi/<name>', lazy_hi, render_basic)],
+                      middlewares=[mw], lazy_compile=True)
+    greet_rt, hi_rt = app.routes
+    assert greet_rt._execute is None and hi_rt._execute is None
+    assert sorted(greet_rt.get_required_args()) == ['greeting', 'name']
+
+    cl = app.get_local_client()
+    results = []
+
+    def get():
+        results.append(cl.get('/greet/Bob?greeting=Yo').get_data(True))
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ['Yo, Bob!'] * 8
+    assert callable(greet_rt._execute)
+    assert hi_rt._execute is None
+    assert cl.get('/nope').status_code == 404
+
+    app.compile_all()
+    assert callable(hi_rt._execute)
+    assert cl.get('/hi/Al').get_data(True) == 'Hi, Al!'
@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import types
 import socket
+import threading
 from io import StringIO
 
 import pytest
 
-from clastic.server import open_test_socket, iter_monitor_files, enable_tty_echo
+from clastic import _inotify
+from clastic.server import (open_test_socket, iter_monitor_files, enable_tty_echo,
+                            wait_for_change, reloader_loop,
+                            get_app_module_names, restart_with_reloader)
 
 
 # -- open_test_socket --
@@ -91,3 +97,95 @@ def test_enable_tty_echo_default_stdin_non_tty():
     # In CI / test runners, stdin is not a tty — should return None without error.
     result = enable_tty_echo()
     assert result is None
+
+
+# -- reloader --
+
+_needs_inotify = pytest.mark.skipif(not _inotify.is_available(),
+                                    reason='inotify not available')
+
+
+class _RepeatedWriter(object):
+    # keeps writing until stopped, as the watches may not be set up
+    # in time for the first write
+    def __init__(self, path, text, interval=0.05):
+        self.path, self.text, self.interval = path, text, interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with open(self.path, 'w') as f:
+                f.write(self.text)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+@_needs_inotify
+def test_wait_for_change(tmp_path):
+    watched = str(tmp_path / 'watched.txt')
+    with open(watched, 'w') as f:
+        f.write('v1')
+
+    writer = _RepeatedWriter(watched, 'v2')
+    try:
+        assert wait_for_change([watched], interval=5, debounce=0.01) == watched
+    finally:
+        writer.stop()
+
+    # new Python files in watched directories also count
+    added = str(tmp_path / 'added.py')
+    writer = _RepeatedWriter(added, 'x = 1')
+    try:
+        assert wait_for_change([watched], interval=5, debounce=0.01) == added
+    finally:
+        writer.stop()
+
+
+@_needs_inotify
+def test_reloader_loop_exit_code(tmp_path):
+    watched = str(tmp_path / 'watched.txt')
+    with open(watched, 'w') as f:
+        f.write('v1')
+    writer = _RepeatedWriter(watched, 'v2')
+    try:
+        with pytest.raises(SystemExit) as exc_info:
+            reloader_loop([watched], interval=5)
+    finally:
+        writer.stop()
+    assert exc_info.value.code == 3
+
+
+def test_get_app_module_names(tmp_path, monkeypatch):
+    app_module = types.ModuleType('_test_app_module')
+    app_module.__file__ = str(tmp_path / '_test_app_module.py')
+    monkeypatch.setitem(sys.modules, '_test_app_module', app_module)
+    app_module_names = get_app_module_names()
+    assert 'os' not in app_module_names
+    assert 'werkzeug' not in app_module_names
+    assert '_test_app_module' in app_module_names
+
+
+_RELOADED_SCRIPT = '''
+import os, sys
+assert os.environ['WERKZEUG_RUN_MAIN'] == 'true'
+run_count_path = os.path.join(os.path.dirname(__file__), 'run_count')
+with open(run_count_path, 'a') as f:
+    f.write('x')
+with open(run_count_path) as f:
+    run_count = len(f.read())
+sys.exit(3 if run_count < 3 else 0)  # 3 means reload
+'''
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='os.fork not available')
+def test_warm_reload(tmp_path, monkeypatch):
+    script_path = tmp_path / 'reloaded.py'
+    script_path.write_text(_RELOADED_SCRIPT)
+    monkeypatch.setattr(sys, 'argv', [str(script_path)])
+    assert restart_with_reloader(warm_reload=True) == 0
+    assert (tmp_path / 'run_count').read_text() == 'xxx'
+    assert os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
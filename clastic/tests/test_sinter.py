@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gc
+import weakref
+
+from pytest import raises
+from boltons.funcutils import FunctionBuilder
+
+from clastic import sinter
+from clastic.sinter import (get_fb, get_arg_names, inject, make_injector,
+                            compile_code, set_code_cache_dir)
+
+
+class Greeter(object):
+    def greet(self, name, greeting='Hello'):
+        return '%s, %s!' % (greeting, name)
+
+    def __call__(self, name):
+        return self.greet(name)
+
+
+def test_get_fb_cache():
+    def func(a, b=1):
+        return a + b
+
+    assert get_fb(func) is get_fb(func)
+    assert get_fb(func).get_arg_names() == ('a', 'b')
+
+    # bound methods share their function's entry, minus self
+    g1, g2 = Greeter(), Greeter()
+    assert get_fb(g1.greet) is get_fb(g2.greet)
+    assert get_fb(g1.greet).args == ['name', 'greeting']
+    assert get_fb(g1.greet, drop_self=False).args == ['self', 'name', 'greeting']
+    assert get_arg_names(g1) == ('name',)
+
+    # overrides bypass the cache
+    override = FunctionBuilder('func', args=['x'])
+    func._sinter_fb = override
+    assert get_fb(func) is override
+
+    # the cache doesn't keep callables alive
+    def temp_func(x):
+        return x
+    get_fb(temp_func)
+    assert temp_func in sinter._FB_CACHE
+    temp_ref = weakref.ref(temp_func)
+    del temp_func
+    gc.collect()
+    assert temp_ref() is None
+
+
+def test_inject():
+    g = Greeter()
+    assert inject(g.greet, {'name': 'Bob', 'unused': 1}) == 'Hello, Bob!'
+    assert inject(g.greet, {'name': 'Bob', 'greeting': 'Hi'}) == 'Hi, Bob!'
+    assert inject(g, {'name': 'Bob'}) == 'Hello, Bob!'
+
+    def varkw_func(a, **kwargs):
+        return sorted(kwargs)
+    assert inject(varkw_func, {'a': 1, 'b': 2, 'c': 3}) == ['b', 'c']
+
+
+def test_make_injector():
+    def target(request, res, builtin, path_arg, opt='default'):
+        return (request, res, builtin, path_arg, opt)
+
+    resources = {'res': 'resource', 'unused': 'x'}
+    injector = make_injector(target, ('request',),
+                             (resources, {'builtin': 'builtin'}))
+    assert injector('req', {'path_arg': 'p'}) == ('req', 'resource', 'builtin',
+                                                  'p', 'default')
+    # injectables take precedence over every other source
+    assert injector('req', {'path_arg': 'p', 'res': 'r', 'builtin': 'b',
+                            'opt': 'o'}) == ('req', 'r', 'b', 'p', 'o')
+    with raises(TypeError, match='path_arg'):
+        injector('req', {})
+
+    def raises_key_error(request):
+        return {}['nope']
+    with raises(KeyError):  # not mistaken for a missing argument
+        make_injector(raises_key_error, ('request',))('req', {})
+
+    def varkw_func(a, **kwargs):
+        return kwargs
+    assert make_injector(varkw_func) is None
+
+
+def test_code_cache_dir(tmp_path):
+    code_str = 'def cached_func():\n    return %r\n' % str(tmp_path)
+    cache_dir = str(tmp_path / 'code_cache')
+    set_code_cache_dir(cache_dir)
+    try:
+        assert compile_code(code_str, 'cached_func', {})() == str(tmp_path)
+        cache_files = os.listdir(cache_dir)
+        assert len(cache_files) == 1
+        cache_path = os.path.join(cache_dir, cache_files[0])
+
+        # a new process would load the code from the cache dir
+        del sinter._CODE_CACHE[('cached_func', code_str)]
+        other_code = compile('def cached_func():\n    return "from disk"\n',
+                             '<test>', 'single')
+        sinter._store_cached_code(cache_path, other_code)
+        assert compile_code(code_str, 'cached_func', {})() == 'from disk'
+
+        # corrupt entries are recompiled and replaced
+        del sinter._CODE_CACHE[('cached_func', code_str)]
+        with open(cache_path, 'wb') as f:
+            f.write(b'garbage')
+        assert compile_code(code_str, 'cached_func', {})() == str(tmp_path)
+        assert sinter._load_cached_code(cache_path) is not None
+    finally:
+        set_code_cache_dir(None)
@@ -1,9 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import json
 
-from clastic import Application
-from clastic.middleware.stats import StatsMiddleware, create_stats_app
+import pytest
+from pytest import raises
+
+from clastic import Application, render_basic
+from clastic.middleware.stats import (StatsMiddleware,
+                                      LatencyHistogram,
+                                      SharedStatsStore,
+                                      WindowedRouteStats,
+                                      Hit,
+                                      create_stats_app)
 from clastic.tests.common import hello_world
 
 
@@ -27,3 +37,219 @@ def test_stats_mw():
     resp = c.get('/stats/')
     data = json.loads(resp.get_data(True))
     assert data['route_stats'].get('/') is None
+
+
+def test_stats_mw_threaded():
+    from concurrent.futures import ThreadPoolExecutor
+
+    stats_mw = StatsMiddleware(shard_count=4)
+    app = Application([('/', hello_world),
+                       ('/t/<name>', hello_world),
+                       ('/stats', create_stats_app())],
+                      middlewares=[stats_mw])
+
+    def hammer(i):
+        c = app.get_local_client()
+        for _ in range(50):
+            c.get('/')
+            c.get('/t/thread%s' % i)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(hammer, range(32)))
+
+    data = json.loads(app.get_local_client().get('/stats/').get_data(True))
+    assert data['route_stats']['/']['200']['count'] == 32 * 50
+    assert data['route_stats']['/t/<name>']['200']['count'] == 32 * 50
+
+    route_hits = stats_mw.route_hits
+    assert sum([rh['200'].total_count for rt, rh in route_hits.items()
+                if rt.pattern in ('/', '/t/<name>')]) == 32 * 100
+    # windows aren't sharded, there's one per pattern
+    window_stats = stats_mw.get_window_stats()
+    assert window_stats['/t/<name>'][60][0] == 32 * 50
+    assert len(stats_mw._window_stats) == 3
+
+
+def test_latency_histogram():
+    hist = LatencyHistogram(precision=0.01)
+    for i in range(1, 10001):
+        hist.add(i / 1000.0)  # 1ms to 10s
+    assert hist.count == 10000
+    assert hist.min == 0.001
+    assert hist.max == 10.0
+    for q in (0.25, 0.5, 0.95, 0.99):
+        assert abs(hist.get_quantile(q) - q * 10) / (q * 10) < 0.011
+    assert abs(hist.mean - 5.0005) < 1e-9
+
+    desc = hist.describe(scale=1000)
+    assert desc['count'] == 10000
+    assert abs(desc['0.5'] - 5000) < 55
+    assert abs(desc['mad'] - 2500) < 55
+
+    other = LatencyHistogram(precision=0.01)
+    for i in range(10001, 20001):
+        other.add(i / 1000.0)
+    merged = hist.copy()
+    merged.update(other)
+    assert merged.count == 20000
+    assert hist.count == 10000
+    assert merged.max == 20.0
+    assert abs(merged.get_quantile(0.5) - 10) < 0.11
+
+    with raises(ValueError):
+        merged.update(LatencyHistogram(precision=0.05))
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+def test_stats_mw_shared_fork():
+    store = SharedStatsStore(max_slots=8)
+    app = Application([('/', hello_world),
+                       ('/stats', create_stats_app())],
+                      middlewares=[StatsMiddleware(shared_store=store)])
+    c = app.get_local_client()
+    c.get('/')
+
+    child_pids = []
+    for i in range(3):
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            try:
+                for _ in range(5):
+                    c.get('/')
+            finally:
+                os._exit(0)
+        child_pids.append(pid)
+    for pid in child_pids:
+        os.waitpid(pid, 0)
+
+    data = json.loads(c.get('/stats/').get_data(True))
+    assert data['route_stats']['/']['200']['count'] == 16
+
+    data = json.loads(c.post('/stats/reset').get_data(True))
+    assert data['reset'] is True
+    data = json.loads(c.get('/stats/').get_data(True))
+    assert data['route_stats'].get('/') is None
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires fcntl')
+def test_stats_shared_store_file(tmp_path):
+    path = str(tmp_path / 'clastic_stats')
+    store = SharedStatsStore(path, max_slots=2)
+    other = SharedStatsStore(path, max_slots=2)
+
+    mw = StatsMiddleware(shared_store=store)
+    app = Application([('/', hello_world), ('/<name>/', hello_world)],
+                      middlewares=[mw])
+    c = app.get_local_client()
+    c.get('/')
+    c.get('/Kurt/')
+    c.get('/Kurt/?x=1')
+    c.get('/nope/nope')  # 404, a third slot
+
+    stats = other.get_pattern_stats()
+    assert stats['/']['200'].total_count == 1
+    assert stats['/<name>/']['200'].total_count == 2
+    assert other.dropped_count == 1
+    repr(other)
+
+    with raises(ValueError):
+        SharedStatsStore(path, max_slots=4)
+    store.close()
+    other.close()
+
+
+def test_stats_metrics():
+    stats_mw = StatsMiddleware()
+    app = Application([('/', hello_world),
+                       ('/stats', create_stats_app())],
+                      middlewares=[stats_mw])
+    c = app.get_local_client()
+    c.get('/')
+    c.get('/')
+    assert c.get('/nope').status_code == 404
+
+    resp = c.get('/stats/metrics')
+    assert resp.mimetype == 'text/plain'
+    lines = resp.get_data(True).splitlines()
+    assert '# TYPE clastic_requests_total counter' in lines
+    assert 'clastic_requests_total{pattern="/",status="200"} 2' in lines
+    assert 'clastic_requests_total{pattern="/<_ignored*>",status="404"} 1' in lines
+    assert ('clastic_request_duration_seconds_bucket'
+            '{pattern="/",status="200",le="+Inf"} 2') in lines
+    assert ('clastic_response_size_bytes_bucket'
+            '{pattern="/",status="200",le="100.0"} 2') in lines
+    assert 'clastic_response_size_bytes_sum{pattern="/",status="200"} 26.0' in lines
+    assert 'clastic_requests_in_flight{pattern="/stats/metrics"} 1' in lines
+    assert 'clastic_requests_in_flight{pattern="/"} 0' in lines
+
+
+def test_windowed_route_stats():
+    ws = WindowedRouteStats(span=300, resolution=10)
+    start = 1000000.0
+    for i in range(600):  # one hit per second for 10 minutes
+        is_error = (i % 10 == 0)
+        ws.add(Hit(start + i, '/', '/', '200', 0.01 * (1 + i % 2), ''), is_error)
+    now = start + 600
+
+    count, errors, hist, elapsed = ws.get_window(60, now=now)
+    assert 50 <= count <= 60
+    assert errors == count // 10
+    assert 0.009 < hist.get_quantile(0.25) < 0.011
+    assert 0.019 < hist.get_quantile(0.99) < 0.021
+
+    count, errors, hist, elapsed = ws.get_window(300, now=now)
+    assert 290 <= count <= 300
+    assert abs(count / elapsed - 1.0) < 0.05
+
+    # nothing recent
+    assert ws.get_window(60, now=now + 3600)[0] == 0
+
+
+def test_stats_mw_window_stats():
+    app = Application([('/', hello_world),
+                       ('/stats', create_stats_app())],
+                      middlewares=[StatsMiddleware()])
+    c = app.get_local_client()
+    c.get('/')
+    c.get('/')
+    c.get('/nope')
+
+    data = json.loads(c.get('/stats/').get_data(True))
+    windows = data['window_stats']['/']
+    assert sorted(windows) == ['15m', '1m', '5m']
+    assert windows['1m']['count'] == 2
+    assert windows['1m']['error_rate'] == 0.0
+    assert windows['1m']['rate'] > 0
+    assert data['window_stats']['/<_ignored*>']['5m']['error_count'] == 0
+
+
+def test_stats_mw_phase_timing():
+    stats_mw = StatsMiddleware(server_timing=True)
+    app = Application([('/', hello_world),
+                       ('/ctx', lambda: {'a': 1}, render_basic),
+                       ('/stats', create_stats_app())],
+                      middlewares=[stats_mw])
+    c = app.get_local_client()
+    resp = c.get('/', buffered=True)
+    server_timing = resp.headers['Server-Timing']
+    assert server_timing.startswith('routing;dur=')
+    assert 'endpoint;dur=' in server_timing
+    assert 'write' not in server_timing
+    c.get('/', buffered=True)
+
+    phase_stats = stats_mw.get_phase_stats()['/']
+    assert set(phase_stats) == set(['routing', 'StatsMiddleware.request',
+                                    'endpoint', 'write'])
+    assert all([hist.count == 2 for hist in phase_stats.values()])
+
+    resp = c.get('/ctx', buffered=True)
+    assert 'render;dur=' in resp.headers['Server-Timing']
+    assert stats_mw.get_phase_stats()['/ctx']['render'].count == 1
+
+    data = json.loads(c.get('/stats/?format=json', buffered=True).get_data(True))
+    assert data['phase_stats']['/']['endpoint']['count'] == 2
+
+    # disabled by default
+    app = Application([('/', hello_world)], middlewares=[StatsMiddleware()])
+    resp = app.get_local_client().get('/')
+    assert 'Server-Timing' not in resp.headers